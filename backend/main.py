@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, json
+from flask import Flask, request, jsonify, render_template, json, Response, stream_with_context
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 import openai
@@ -8,6 +8,7 @@ import json
 from statistics import mean, stdev
 from datetime import datetime, timedelta, timezone
 import time
+import math
 import logging
 import praw
 import re
@@ -15,13 +16,48 @@ from tabulate import tabulate
 import getpass
 import requests
 import os
+import numpy as np
+import threading
+import queue
+import heapq
+import hashlib
+import tempfile
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process poller lock
+    fcntl = None
+import csv
+import io
+import base64
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text, tuple_
+from sqlalchemy.exc import IntegrityError
 from flask_bcrypt import Bcrypt
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+try:
+    import websocket
+except ImportError:  # Order book diff feeds are optional; books fall back to snapshots
+    websocket = None
 from dotenv import load_dotenv
 load_dotenv()
 
 
-
+def env_flag(name, default=False):
+    """
+    Read a boolean environment variable: 1, true, yes or on (any case) are true.
+    """
+    value = os.getenv(name)
+    return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
 
 
 app = Flask(__name__)
@@ -60,6 +96,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     wallet_balance = db.Column(db.Float, default=0.0)
 
+    # Legacy per-coin balances, superseded by Holding (see `flask migrate-holdings`)
     btc_balance = db.Column(db.Float, default=0.0)
     eth_balance = db.Column(db.Float, default=0.0)
     ltc_balance = db.Column(db.Float, default=0.0)
@@ -82,6 +119,45 @@ class Transaction(db.Model):
     total_value = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Backs keyset pagination of /transactions on (user_id, timestamp, id)
+    __table_args__ = (db.Index('ix_transaction_user_timestamp_id', 'user_id', 'timestamp', 'id'),)
+
+class Holding(db.Model):
+    # One row per (user, asset); the composite primary key doubles as the lookup index
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    symbol = db.Column(db.String(10), primary_key=True)  # e.g. BTC
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+
+class PortfolioPosition(db.Model):
+    # Running per-(user, asset) aggregates of the Transaction ledger, kept in step with every trade
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    symbol = db.Column(db.String(10), primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    avg_cost = db.Column(db.Float, nullable=False, default=0.0)
+    realized_pnl = db.Column(db.Float, nullable=False, default=0.0)
+    last_trade_at = db.Column(db.DateTime)
+
+class PortfolioValueBar(db.Model):
+    # OHLC of a user's total portfolio value (wallet + holdings) per 1m/1h/1d bucket
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    resolution = db.Column(db.String(4), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+
+class PortfolioRollupQueue(db.Model):
+    # Users whose wallet or holdings changed since the poller's last portfolio rollup
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+class BatchOrder(db.Model):
+    # Client-supplied idempotency key per user, with the response to replay on retries
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    idempotency_key = db.Column(db.String(64), primary_key=True)
+    response = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 @app.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -114,14 +190,6 @@ reddit = praw.Reddit(
     user_agent=REDDIT_USER_AGENT
 )
 
-# Initialize a mock wallet (using a dictionary for simplicity)
-wallet = {
-    "balance": 1000.0,  # Starting balance
-    "assets": {
-        "BTC": 0.0,
-        "ETH": 0.0
-    }
-}
 EXCHANGE_FEES = {
     "Coinbase": 0.005,  # 0.5%
     "Crypto.com": 0.004,  # 0.4%
@@ -151,9 +219,894 @@ RATE_LIMITS = {
     "Coinbase": 100,
     "Crypto.com": 120,
     "Binance": 150,
-    "Kraken": 80
+    "Kraken": 80,
+    "CoinGecko": 30
+}
+
+# Shared name/ticker -> symbol normalization table
+SYMBOL_MAP = {
+    "bitcoin": "BTC", "btc": "BTC",
+    "ethereum": "ETH", "eth": "ETH",
+    "dogecoin": "DOGE", "doge": "DOGE",
+    "solana": "SOL", "sol": "SOL",
+    "cardano": "ADA", "ada": "ADA",
+    "litecoin": "LTC", "ltc": "LTC"
 }
 
+# CoinGecko ids for the wallet assets
+COINGECKO_IDS = {
+    "BTC": "bitcoin",
+    "ETH": "ethereum",
+    "LTC": "litecoin",
+    "SOL": "solana"
+}
+
+# Background price poller settings
+PRICE_POLLER_ENABLED = env_flag("PRICE_POLLER_ENABLED", True)
+PRICE_POLL_INTERVAL = float(os.getenv("PRICE_POLL_INTERVAL", 5))
+# Only the process holding this lock polls, however many workers import the app
+POLLER_LOCK_FILE = os.getenv("POLLER_LOCK_FILE", os.path.join(tempfile.gettempdir(), "intelicoin-poller.lock"))
+# The poller publishes its latest ticks, books and scans here; the other workers on the host follow it
+POLLER_SNAPSHOT_FILE = os.getenv(
+    "POLLER_SNAPSHOT_FILE", os.path.join(tempfile.gettempdir(), "intelicoin-poller.json")
+)
+# Ticks older than this are ignored by the request path
+PRICE_TICK_MAX_AGE = float(os.getenv("PRICE_TICK_MAX_AGE", PRICE_POLL_INTERVAL * 2))
+# Number of ticks kept per (exchange, symbol)
+TICK_BUFFER_SIZE = int(os.getenv("TICK_BUFFER_SIZE", 4096))
+
+# Upstream record/replay: "live", "record" (call upstream and save) or "replay" (serve saved)
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+# Latency injected into every replayed response, in seconds
+REPLAY_LATENCY = float(os.getenv("REPLAY_LATENCY", 0))
+
+# Per-exchange request deadline in seconds
+EXCHANGE_TIMEOUTS = {
+    "Coinbase": 2.0,
+    "Crypto.com": 2.0,
+    "Binance": 2.0,
+    "Kraken": 2.0
+}
+
+# Overall deadline for a price fan-out (defaults to the slowest exchange deadline)
+PRICE_FETCH_DEADLINE = float(os.getenv("PRICE_FETCH_DEADLINE", max(EXCHANGE_TIMEOUTS.values())))
+
+# Shared worker pool for concurrent upstream price requests
+price_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PRICE_FETCH_WORKERS", 16)),
+    thread_name_prefix="price-fetch"
+)
+
+# Keep-alive HTTP sessions, one connection pool per upstream
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(name):
+    """
+    Return the pooled keep-alive session for an upstream, creating it on first use.
+    """
+    with _http_sessions_lock:
+        session = _http_sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_sessions[name] = session
+        return session
+
+
+class Cassette:
+    """
+    On-disk store of recorded upstream responses, one JSON-lines file per source.
+    Each line is {"key": <request hash>, "request": ..., "response": ...}.
+    Repeated recordings of the same request are replayed in order and then cycled.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._entries = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request_parts):
+        return hashlib.sha1(json.dumps(request_parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def path(self, source):
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_-]", "_", source) + ".jsonl")
+
+    def _load(self, source):
+        if source not in self._entries:
+            entries = {}
+            if os.path.exists(self.path(source)):
+                with open(self.path(source)) as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            entries.setdefault(record["key"], []).append(record["response"])
+            self._entries[source] = entries
+        return self._entries[source]
+
+    def record(self, source, request_parts, response):
+        key = self.key(request_parts)
+        line = json.dumps({"key": key, "request": request_parts, "response": response}, default=str)
+        with self._lock:
+            self._load(source).setdefault(key, []).append(json.loads(line)["response"])
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(source), "a") as f:
+                f.write(line + "\n")
+
+    def replay(self, source, request_parts):
+        key = self.key(request_parts)
+        with self._lock:
+            responses = self._load(source).get(key)
+            if not responses:
+                raise LookupError(f"No recorded {source} response for {request_parts}")
+            cursor = self._cursors.get((source, key), 0)
+            self._cursors[(source, key)] = cursor + 1
+            return responses[cursor % len(responses)]
+
+
+cassette = Cassette(CASSETTE_DIR)
+
+
+def recorded_call(source, request_parts, fn):
+    """
+    Run an upstream call through the record/replay layer selected by UPSTREAM_MODE.
+    request_parts identifies the request and must be JSON-serializable, as must fn's result.
+    """
+    if UPSTREAM_MODE == "replay":
+        if REPLAY_LATENCY:
+            time.sleep(REPLAY_LATENCY)
+        return cassette.replay(source, request_parts)
+
+    result = fn()
+    if UPSTREAM_MODE == "record":
+        cassette.record(source, request_parts, result)
+    return result
+
+
+def replaying():
+    """
+    True in replay mode. Replay serves each request straight from the cassette, with no poller,
+    quote cache or rate limits, so the responses depend only on the sequence of requests.
+    """
+    return UPSTREAM_MODE == "replay"
+
+
+def http_get_json(source, url, params=None, timeout=None):
+    """
+    GET a JSON document from an upstream over its pooled session.
+    """
+    def get():
+        response = get_http_session(source).get(
+            url, params=params, timeout=timeout or EXCHANGE_TIMEOUTS.get(source, 2.0)
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return recorded_call(source, [url, params], get)
+
+
+def create_chat_completion(**kwargs):
+    """
+    openai.ChatCompletion.create routed through the record/replay layer.
+    """
+    return recorded_call("OpenAI", kwargs, lambda: openai.ChatCompletion.create(**kwargs))
+
+
+class QuoteCache:
+    """
+    Bounded in-process cache of price quotes keyed by (source, symbol).
+    Quotes younger than ttl are served as fresh. Quotes inside the stale window
+    are served immediately while a background refresh fetches a new one.
+    The least recently used quote is evicted once max_entries is reached.
+    """
+
+    def __init__(self, ttl, stale_ttl, max_entries):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, source, symbol, loader):
+        """
+        Return the cached quote for (source, symbol), calling loader() on a miss.
+        Failed loads (None) are not cached. Bypassed while replaying.
+        """
+        if replaying():
+            return loader()
+        key = (source, symbol)
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+                if age <= self.ttl:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return value
+                if age <= self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        refresh = True
+                else:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+
+        if entry is not None:
+            if refresh:
+                price_executor.submit(self._refresh, key, loader)
+            return entry[0]
+
+        value = loader()
+        if value is not None:
+            self.set(source, symbol, value)
+        return value
+
+    def get_many(self, source, symbols, batch_loader):
+        """
+        Return {symbol: quote} for many symbols of one source.
+        All misses are resolved with a single batch_loader(symbols) call returning
+        a dict, and stale quotes are refreshed together in one background call.
+        Bypassed while replaying.
+        """
+        if replaying():
+            return {symbol: value for symbol, value in (batch_loader(list(symbols)) or {}).items() if value is not None}
+        results = {}
+        missing = []
+        stale = []
+        with self._lock:
+            now = time.monotonic()
+            for symbol in symbols:
+                key = (source, symbol)
+                entry = self._entries.get(key)
+                age = now - entry[1] if entry is not None else None
+                if entry is not None and age <= self.ttl:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[symbol] = entry[0]
+                elif entry is not None and age <= self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._entries.move_to_end(key)
+                    results[symbol] = entry[0]
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        stale.append(symbol)
+                else:
+                    self.misses += 1
+                    missing.append(symbol)
+
+        if stale:
+            price_executor.submit(self._refresh_many, source, stale, batch_loader)
+        if missing:
+            loaded = batch_loader(missing) or {}
+            for symbol, value in loaded.items():
+                if value is not None:
+                    self.set(source, symbol, value)
+                    results[symbol] = value
+        return results
+
+    def set(self, source, symbol, value):
+        key = (source, symbol)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, key, loader):
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key[0], key[1], value)
+        except Exception as e:
+            logging.warning(f"Background refresh failed for {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_many(self, source, symbols, batch_loader):
+        try:
+            for symbol, value in (batch_loader(symbols) or {}).items():
+                if value is not None:
+                    self.set(source, symbol, value)
+        except Exception as e:
+            logging.warning(f"Background refresh failed for {source} {symbols}: {e}")
+        finally:
+            with self._lock:
+                for symbol in symbols:
+                    self._refreshing.discard((source, symbol))
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "max_entries": self.max_entries,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0,
+                "entries": [
+                    {"source": source, "symbol": symbol, "age": round(now - stored_at, 3)}
+                    for (source, symbol), (_, stored_at) in self._entries.items()
+                ]
+            }
+
+
+class TickRing:
+    """
+    Fixed-size ring buffer of (timestamp, price) ticks backed by flat float arrays.
+    """
+    __slots__ = ("capacity", "timestamps", "prices", "head", "count")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.prices = array("d", bytes(8 * capacity))
+        self.head = 0  # next write position
+        self.count = 0
+
+    def append(self, timestamp, price):
+        self.timestamps[self.head] = timestamp
+        self.prices[self.head] = price
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.timestamps[i], self.prices[i]
+
+    def history(self, limit=None):
+        """
+        Return (timestamps, prices) arrays of the last `limit` ticks, oldest first.
+        """
+        n = self.count if limit is None else max(0, min(limit, self.count))
+        start = (self.head - n) % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            return self.timestamps[start:end], self.prices[start:end]
+        end -= self.capacity
+        return (
+            self.timestamps[start:] + self.timestamps[:end],
+            self.prices[start:] + self.prices[:end]
+        )
+
+
+class TickStore:
+    """
+    In-memory tick history, one TickRing per (exchange, symbol).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def record(self, exchange, symbol, price, timestamp=None):
+        with self._lock:
+            ring = self._rings.get((exchange, symbol))
+            if ring is None:
+                ring = self._rings[(exchange, symbol)] = TickRing(self.capacity)
+            ring.append(timestamp or time.time(), price)
+
+    def latest(self, exchange, symbol, max_age=None):
+        """
+        Return the latest price for (exchange, symbol), or None if missing or older than max_age.
+        """
+        with self._lock:
+            ring = self._rings.get((exchange, symbol))
+            tick = ring.latest() if ring else None
+        if tick is None:
+            return None
+        if max_age is not None and time.time() - tick[0] > max_age:
+            return None
+        return tick[1]
+
+    def latest_tick(self, exchange, symbol):
+        """
+        Return the latest (timestamp, price) for (exchange, symbol), or None.
+        """
+        with self._lock:
+            ring = self._rings.get((exchange, symbol))
+            return ring.latest() if ring else None
+
+    def history(self, exchange, symbol, limit=None):
+        with self._lock:
+            ring = self._rings.get((exchange, symbol))
+            if ring is None:
+                return array("d"), array("d")
+            return ring.history(limit)
+
+    def keys(self):
+        with self._lock:
+            return list(self._rings.keys())
+
+
+# Latest sampled prices written by the background poller
+tick_store = TickStore(TICK_BUFFER_SIZE)
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter refilled continuously at rate_per_minute.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1, rate_per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """
+        Take one token, waiting up to timeout seconds for a refill.
+        Returns False if no token became available in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_for = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one in-flight call
+    whose result (or exception) is shared by every caller.
+    """
+
+    class Call:
+        __slots__ = ("event", "result", "error")
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight.Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+# One token bucket per upstream, configured from RATE_LIMITS
+rate_limiters = {name: TokenBucket(limit) for name, limit in RATE_LIMITS.items()}
+
+# In-flight upstream calls keyed by (source, symbol)
+upstream_calls = SingleFlight()
+
+
+def call_upstream(source, key, fn):
+    """
+    Run an upstream request for (source, key) under the source's rate limit.
+    Concurrent callers for the same key share one request. Returns None when
+    no token frees up within the source's deadline. Replayed calls skip both.
+    """
+    if replaying():
+        return fn()
+
+    def limited():
+        limiter = rate_limiters.get(source)
+        if limiter and not limiter.acquire(timeout=EXCHANGE_TIMEOUTS.get(source, 2.0)):
+            logging.warning(f"Rate limit reached for {source}, skipping {key}")
+            return None
+        return fn()
+
+    return upstream_calls.do((source, key), limited)
+
+
+class EventHub:
+    """
+    Fans out published events to every subscribed client.
+    Each subscriber gets a bounded queue; slow clients drop their oldest events
+    instead of holding back the publisher.
+    """
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            while True:
+                try:
+                    q.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+# Live price ticks and opportunities pushed to /stream clients
+event_hub = EventHub()
+
+# Opportunity scanner: how many opportunities the top-K index keeps and how long they stay valid
+OPPORTUNITY_TOP_K = int(os.getenv("OPPORTUNITY_TOP_K", 20))
+OPPORTUNITY_TTL = float(os.getenv("OPPORTUNITY_TTL", PRICE_TICK_MAX_AGE))
+
+# Seconds between keep-alive comments on idle streams
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 15))
+# Each stream holds a worker thread: cap concurrent streams per process and recycle
+# them after STREAM_MAX_SECONDS (EventSource reconnects on its own)
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", 32))
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", 300))
+
+
+class OrderBook:
+    """
+    Local L2 order book kept as sorted parallel arrays of prices and sizes.
+    Both sides are stored in ascending price order, so the best bid is the last
+    element and the best ask the first. Snapshots replace both sides, deltas
+    insert, update or remove single levels by bisection, and executions walk
+    only the levels they touch.
+    """
+
+    def __init__(self):
+        self.bid_prices = array("d")
+        self.bid_sizes = array("d")
+        self.ask_prices = array("d")
+        self.ask_sizes = array("d")
+        self.updated_at = 0.0
+        self.sequence = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _side_arrays(levels):
+        levels = sorted((p, q) for p, q in levels if q > 0)
+        return array("d", (p for p, _ in levels)), array("d", (q for _, q in levels))
+
+    def apply_snapshot(self, bids, asks, sequence=None, updated_at=None):
+        bid_prices, bid_sizes = self._side_arrays(bids)
+        ask_prices, ask_sizes = self._side_arrays(asks)
+        with self._lock:
+            self.bid_prices, self.bid_sizes = bid_prices, bid_sizes
+            self.ask_prices, self.ask_sizes = ask_prices, ask_sizes
+            self.sequence = sequence
+            self.updated_at = updated_at or time.time()
+
+    def apply_delta(self, bids, asks, first_sequence, last_sequence):
+        """
+        Apply an incremental update of (price, size) levels; a size of 0 removes the level.
+        Updates the book already covers are ignored. Returns False when there is no snapshot
+        yet or the update skips sequence numbers, in which case the caller must resnapshot.
+        """
+        with self._lock:
+            if self.sequence is None:
+                return False
+            if last_sequence <= self.sequence:
+                return True
+            if first_sequence > self.sequence + 1:
+                return False
+            self._update_side(self.bid_prices, self.bid_sizes, bids)
+            self._update_side(self.ask_prices, self.ask_sizes, asks)
+            # Keep the levels nearest the touch; deeper ones were never in the snapshot
+            excess = len(self.bid_prices) - ORDER_BOOK_DEPTH
+            if excess > 0:
+                del self.bid_prices[:excess]
+                del self.bid_sizes[:excess]
+            excess = len(self.ask_prices) - ORDER_BOOK_DEPTH
+            if excess > 0:
+                del self.ask_prices[-excess:]
+                del self.ask_sizes[-excess:]
+            self.sequence = last_sequence
+            self.updated_at = time.time()
+        return True
+
+    @staticmethod
+    def _update_side(prices, sizes, levels):
+        for price, size in levels:
+            price, size = float(price), float(size)
+            i = bisect_left(prices, price)
+            found = i < len(prices) and prices[i] == price
+            if size <= 0:
+                if found:
+                    del prices[i]
+                    del sizes[i]
+            elif found:
+                sizes[i] = size
+            else:
+                prices.insert(i, price)
+                sizes.insert(i, size)
+
+    def levels(self):
+        """
+        Return (bids, asks) as lists of [price, size], each in ascending price order.
+        """
+        with self._lock:
+            return (
+                [list(level) for level in zip(self.bid_prices, self.bid_sizes)],
+                [list(level) for level in zip(self.ask_prices, self.ask_sizes)]
+            )
+
+    def best_bid(self):
+        return self.bid_prices[-1] if self.bid_prices else None
+
+    def best_ask(self):
+        return self.ask_prices[0] if self.ask_prices else None
+
+    def average_buy_price(self, usd_amount):
+        """
+        Average price paid to spend usd_amount walking up the asks,
+        or None if the book is not deep enough.
+        """
+        with self._lock:
+            remaining = usd_amount
+            quantity = 0.0
+            for price, size in zip(self.ask_prices, self.ask_sizes):
+                level_usd = price * size
+                if level_usd >= remaining:
+                    quantity += remaining / price
+                    remaining = 0.0
+                    break
+                quantity += size
+                remaining -= level_usd
+        if remaining > 0 or quantity <= 0:
+            return None
+        return usd_amount / quantity
+
+    def average_sell_price(self, quantity):
+        """
+        Average price received selling quantity walking down the bids,
+        or None if the book is not deep enough.
+        """
+        with self._lock:
+            remaining = quantity
+            proceeds = 0.0
+            for i in range(len(self.bid_prices) - 1, -1, -1):
+                price, size = self.bid_prices[i], self.bid_sizes[i]
+                if size >= remaining:
+                    proceeds += remaining * price
+                    remaining = 0.0
+                    break
+                proceeds += size * price
+                remaining -= size
+        if remaining > 0 or quantity <= 0:
+            return None
+        return proceeds / quantity
+
+
+class OrderBookStore:
+    """
+    Local order books keyed by (exchange, symbol).
+    """
+
+    def __init__(self):
+        self._books = {}
+        self._lock = threading.Lock()
+
+    def book(self, exchange, symbol):
+        with self._lock:
+            book = self._books.get((exchange, symbol))
+            if book is None:
+                book = self._books[(exchange, symbol)] = OrderBook()
+            return book
+
+    def get(self, exchange, symbol, max_age=None):
+        """
+        Return the book for (exchange, symbol), or None if missing or older than max_age.
+        """
+        with self._lock:
+            book = self._books.get((exchange, symbol))
+        if book is None or not book.updated_at:
+            return None
+        if max_age is not None and time.time() - book.updated_at > max_age:
+            return None
+        return book
+
+    def items(self):
+        with self._lock:
+            return list(self._books.items())
+
+
+order_books = OrderBookStore()
+
+
+class OpportunityIndex:
+    """
+    Latest scan result per symbol plus a top-K list of opportunities across all
+    symbols ranked by net profit. Entries expire after ttl seconds so stale
+    prices are never served as live opportunities.
+    """
+
+    def __init__(self, top_k, ttl):
+        self.top_k = top_k
+        self.ttl = ttl
+        self._scans = {}
+        self._top = []
+        self._lock = threading.Lock()
+
+    def update(self, symbol, prices, opportunities, timestamp=None):
+        timestamp = timestamp or time.time()
+        scan = {
+            "symbol": symbol,
+            "prices": prices,
+            "opportunities": opportunities,
+            "timestamp": timestamp,
+            "expires_at": timestamp + self.ttl
+        }
+        with self._lock:
+            self._scans[symbol] = scan
+            self._rank(timestamp)
+
+    def _rank(self, timestamp):
+        candidates = [
+            (o["net_profit"], sym, i)
+            for sym, entry in self._scans.items()
+            if entry["expires_at"] > timestamp
+            for i, o in enumerate(entry["opportunities"])
+        ]
+        self._top = [
+            dict(self._scans[sym]["opportunities"][i], symbol=sym, expires_at=self._scans[sym]["expires_at"])
+            for _, sym, i in heapq.nlargest(self.top_k, candidates)
+        ]
+
+    def export(self):
+        """
+        Return every stored scan, for publishing to other processes.
+        """
+        with self._lock:
+            return list(self._scans.values())
+
+    def load(self, scans):
+        """
+        Replace the index with scans exported by another process.
+        """
+        with self._lock:
+            self._scans = {scan["symbol"]: scan for scan in scans}
+            self._rank(time.time())
+
+    def updated_at(self):
+        """
+        Timestamp of the newest scan, or None if nothing was ever scanned.
+        """
+        with self._lock:
+            return max((scan["timestamp"] for scan in self._scans.values()), default=None)
+
+    def get(self, symbol):
+        """
+        Return the latest unexpired scan for a symbol, or None.
+        """
+        with self._lock:
+            scan = self._scans.get(symbol)
+        if scan is None or scan["expires_at"] <= time.time():
+            return None
+        return scan
+
+    def top(self, limit=None):
+        now = time.time()
+        with self._lock:
+            top = self._top
+        return [o for o in top if o["expires_at"] > now][:limit]
+
+
+# Opportunities found by the background scanner
+opportunity_index = OpportunityIndex(OPPORTUNITY_TOP_K, OPPORTUNITY_TTL)
+
+
+# Shared quote cache used by every price lookup
+quote_cache = QuoteCache(
+    ttl=float(os.getenv("QUOTE_CACHE_TTL", 5)),
+    stale_ttl=float(os.getenv("QUOTE_CACHE_STALE_TTL", 30)),
+    max_entries=int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", 1024))
+)
+
+
+# Trade size used to express fixed network fees as a fraction in the arbitrage graph
+GRAPH_NOTIONAL_USD = float(os.getenv("GRAPH_NOTIONAL_USD", 1000))
+
+# Order book settings: levels kept per side, snapshot refresh interval and max age
+ORDER_BOOK_DEPTH = int(os.getenv("ORDER_BOOK_DEPTH", 100))
+ORDER_BOOK_INTERVAL = float(os.getenv("ORDER_BOOK_INTERVAL", 30))
+ORDER_BOOK_MAX_AGE = float(os.getenv("ORDER_BOOK_MAX_AGE", ORDER_BOOK_INTERVAL * 2))
+# Keep books current between snapshots from exchange diff feeds (needs websocket-client)
+ORDER_BOOK_FEEDS = env_flag("ORDER_BOOK_FEEDS", True)
+ORDER_BOOK_FEED_TIMEOUT = float(os.getenv("ORDER_BOOK_FEED_TIMEOUT", 10))
+
+# Columnar tick recordings used by the backtester
+BACKTEST_DIR = os.getenv("BACKTEST_DIR", "backtest_data")
+BACKTEST_RECORD = env_flag("BACKTEST_RECORD")
+
+# Memory-mapped price history served by /history, recorded by the process holding the poller lock
+HISTORY_DIR = os.getenv("HISTORY_DIR", "price_history")
+HISTORY_RECORD = env_flag("HISTORY_RECORD", True)
+# On start the poller backfills CoinGecko history until this many days are covered
+HISTORY_BACKFILL_DAYS = int(os.getenv("HISTORY_BACKFILL_DAYS", "30"))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "5000"))
+HISTORY_RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("price", "<f8"), ("volume", "<f8")])
+
+# Trade success probability: 95% minus 10% per second of combined latency, kept within 70-95%
+SUCCESS_PROB_BASE = 0.95
+SUCCESS_PROB_PER_SECOND = 0.1
+SUCCESS_PROB_MIN = 0.7
+# Share of the trade amount lost when a trade fails
+FAILED_TRADE_LOSS = 0.02
+
+# Monte Carlo trade simulation: price volatility per sqrt(second), path cap and default time budget
+MONTE_CARLO_VOLATILITY = float(os.getenv("MONTE_CARLO_VOLATILITY", 0.0005))
+MONTE_CARLO_MAX_PATHS = int(os.getenv("MONTE_CARLO_MAX_PATHS", 200000))
+MONTE_CARLO_BUDGET_MS = float(os.getenv("MONTE_CARLO_BUDGET_MS", 100))
+MONTE_CARLO_BATCH = 8192
+
+# Upper bound for trade-size optimization (profit keeps growing past the slippage cap)
+MAX_TRADE_USD = float(os.getenv("MAX_TRADE_USD", 100000))
+
+# Slippage model: amount / SLIPPAGE_SCALE, clamped to [SLIPPAGE_MIN, SLIPPAGE_MAX]
+SLIPPAGE_MIN = 0.001
+SLIPPAGE_MAX = 0.01
+SLIPPAGE_SCALE = 100000
+
 
 # Set up basic logging to log transactions (could be expanded to log to a file or database)
 logging.basicConfig(level=logging.INFO)
@@ -222,22 +1175,65 @@ def log_transaction(transaction_type, amount, details):
 def get_wallet_balance():
      return wallet_balance["balance"]  # This returns the current balance
 
+def normalize_symbol(name):
+    """
+    Map a coin name or ticker (e.g. "bitcoin", "btc") to its symbol, or None if unsupported.
+    """
+    return SYMBOL_MAP.get(str(name).lower()) if name else None
+
 def fetch_live_price(symbol):
-    id_map = {
-        "BTC": "bitcoin",
-        "ETH": "ethereum",
-        "LTC": "litecoin",
-        "SOL": "solana"
-    }
+    """
+    Return the USD price of a symbol from CoinGecko.
+    Uses the poller's latest tick when fresh, otherwise the quote cache.
+    """
+    price = tick_store.latest("CoinGecko", symbol, max_age=PRICE_TICK_MAX_AGE)
+    if price is not None:
+        return price
+    quote = fetch_live_quotes([symbol]).get(symbol)
+    return quote["price"] if quote else None
+
+def fetch_live_quotes(symbols):
+    """
+    Return {symbol: {"price", "change_24h"}} for many symbols, served through the
+    quote cache. Every uncached symbol is resolved in a single CoinGecko request.
+    """
+    symbols = [s for s in symbols if s in COINGECKO_IDS]
+    if not symbols:
+        return {}
+    return quote_cache.get_many(
+        "CoinGecko",
+        symbols,
+        lambda batch: call_upstream("CoinGecko", tuple(sorted(batch)), lambda: fetch_coingecko_quotes(batch))
+    )
+
+def fetch_coingecko_quotes(symbols):
+    """
+    Fetch USD price and 24h change for several symbols with one CoinGecko simple/price call.
+    """
+    ids = ",".join(COINGECKO_IDS[s] for s in symbols)
     try:
-        response = requests.get(
-            f"https://api.coingecko.com/api/v3/simple/price?ids={id_map[symbol]}&vs_currencies=usd"
+        data = http_get_json(
+            "CoinGecko",
+            "https://api.coingecko.com/api/v3/simple/price",
+            params={"ids": ids, "vs_currencies": "usd", "include_24hr_change": "true", "include_24hr_vol": "true"}
         )
-        data = response.json()
-        return float(data[id_map[symbol]]['usd'])
     except Exception as e:
-        print(f"Error fetching price for {symbol}: {e}")
-        return None
+        print(f"Error fetching prices for {symbols}: {e}")
+        return {}
+
+    quotes = {}
+    for symbol in symbols:
+        entry = data.get(COINGECKO_IDS[symbol])
+        if not entry or "usd" not in entry:
+            continue
+        change = entry.get("usd_24h_change")
+        volume = entry.get("usd_24h_vol")
+        quotes[symbol] = {
+            "price": float(entry["usd"]),
+            "change_24h": round(float(change), 2) if change is not None else None,
+            "volume_24h": float(volume) if volume is not None else None
+        }
+    return quotes
 
 @app.route("/wallet", methods=["GET", "OPTIONS"])
 @jwt_required()
@@ -251,35 +1247,204 @@ def get_wallet():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    assets = {
-        "BTC": user.btc_balance,
-        "ETH": user.eth_balance,
-        "LTC": user.ltc_balance,
-        "SOL": user.sol_balance
-    }
-
-    prices = {
-        "BTC": 52291,
-        "ETH": 28291,
-        "LTC": 8291,
-        "SOL": 14291
-    }
+    assets = get_holdings(user_id)
 
-    changes = {
-        "BTC": 0.25,
-        "ETH": 0.25,
-        "LTC": 0.25,
-        "SOL": -0.25
+    # Mark all holdings to market with one batched quote
+    quotes = fetch_live_quotes(list(assets.keys()))
+    prices = {symbol: quote["price"] for symbol, quote in quotes.items()}
+    changes = {symbol: quote["change_24h"] for symbol, quote in quotes.items()}
+    values = {
+        symbol: round((amount or 0) * prices[symbol], 2)
+        for symbol, amount in assets.items()
+        if symbol in prices
     }
 
     return jsonify({
         "balance": round(user.wallet_balance, 2),
         "assets": assets,
         "prices": prices,
-        "changes": changes
+        "changes": changes,
+        "values": values,
+        "total_value": round(user.wallet_balance + sum(values.values()), 2)
     })
 
 
+def get_holdings(user_id):
+    """
+    Return {symbol: quantity} for a user with one indexed query.
+    Every tradable asset is listed, with 0.0 for those not held.
+    """
+    holdings = {symbol: 0.0 for symbol in COINGECKO_IDS}
+    rows = db.session.query(Holding.symbol, Holding.quantity).filter(Holding.user_id == user_id)
+    for symbol, quantity in rows:
+        holdings[symbol] = quantity
+    return holdings
+
+# Row source for position_upsert_sql when trades are passed as bind parameters
+TRADE_PARAMS_SOURCE = "SELECT :user_id AS user_id, :symbol AS symbol, :amount AS amount, :price AS price, :timestamp AS traded_at"
+
+def position_upsert_sql(source):
+    """
+    INSERT ... ON CONFLICT statement folding trades into portfolio_position.
+    `source` is a SELECT with columns user_id, symbol, amount, price, traded_at; sells have
+    negative amounts. Buys move the average cost, sells realize (price - avg_cost) per unit sold.
+    A new row starts from an empty position, exactly as apply_trade_to_position does.
+    """
+    table = PortfolioPosition.__tablename__
+    # The inserted row is the trade applied to an empty position, so EXCLUDED carries
+    # avg_cost = price for buys and realized_pnl = -amount * price for sells
+    return f"""
+        INSERT INTO {table} (user_id, symbol, quantity, avg_cost, realized_pnl, last_trade_at)
+        SELECT user_id, symbol, amount,
+               CASE WHEN amount > 0 THEN price ELSE 0 END,
+               CASE WHEN amount < 0 THEN -amount * price ELSE 0 END,
+               traded_at
+        FROM ({source}) AS trade
+        WHERE true
+        ON CONFLICT (user_id, symbol) DO UPDATE SET
+            quantity = {table}.quantity + EXCLUDED.quantity,
+            avg_cost = CASE
+                WHEN {table}.quantity + EXCLUDED.quantity <= 0 THEN 0
+                WHEN EXCLUDED.quantity > 0 THEN
+                    ({table}.quantity * {table}.avg_cost + EXCLUDED.quantity * EXCLUDED.avg_cost)
+                    / ({table}.quantity + EXCLUDED.quantity)
+                ELSE {table}.avg_cost
+            END,
+            realized_pnl = {table}.realized_pnl + EXCLUDED.realized_pnl + CASE
+                WHEN EXCLUDED.quantity < 0 THEN EXCLUDED.quantity * {table}.avg_cost
+                ELSE 0
+            END,
+            last_trade_at = CASE
+                WHEN {table}.last_trade_at IS NULL OR EXCLUDED.last_trade_at > {table}.last_trade_at
+                THEN EXCLUDED.last_trade_at
+                ELSE {table}.last_trade_at
+            END
+    """
+
+def apply_trade_to_position(position, amount, price, timestamp):
+    """
+    In-memory twin of position_upsert_sql, used by the rebuild command.
+    position is a dict with quantity, avg_cost, realized_pnl and last_trade_at.
+    """
+    quantity = position["quantity"] + amount
+    if quantity <= 0:
+        if amount < 0:
+            position["realized_pnl"] += -amount * (price - position["avg_cost"])
+        position["avg_cost"] = 0.0
+    elif amount > 0:
+        position["avg_cost"] = (position["quantity"] * position["avg_cost"] + amount * price) / quantity
+    elif amount < 0:
+        position["realized_pnl"] += -amount * (price - position["avg_cost"])
+    position["quantity"] = quantity
+    if timestamp and (not position["last_trade_at"] or timestamp > position["last_trade_at"]):
+        position["last_trade_at"] = timestamp
+    return position
+
+# Queues users from a row source for the poller's next portfolio rollup
+ROLLUP_QUEUE_SQL = (
+    f"INSERT INTO {PortfolioRollupQueue.__tablename__} (user_id) SELECT user_id FROM ({{source}}) AS changed "
+    "WHERE true ON CONFLICT (user_id) DO NOTHING"
+)
+
+def apply_balance_delta(user_id, delta, asset=None, transaction=None, required=0.0):
+    """
+    Atomically add delta to a user's wallet balance (and optionally a quantity to one
+    holding) in a single conditional statement that refuses to go below zero, or to
+    run unless the balance is at least `required` beforehand.
+    If transaction is given ({symbol, amount, price, total_value}) it is inserted and
+    folded into portfolio_position in the same statement. The user is also queued for
+    the poller's next portfolio rollup. Returns {"id", "wallet_balance", "quantity", "transaction_id"},
+    or None if the user does not exist or the update would overdraw.
+    """
+    user_table = User.__tablename__
+    holding_table = Holding.__tablename__
+    params = {"user_id": user_id, "delta": delta, "required": required}
+    wallet_update = f"""
+            UPDATE "{user_table}"
+            SET wallet_balance = COALESCE(wallet_balance, 0) + :delta
+            WHERE id = :user_id AND COALESCE(wallet_balance, 0) + :delta >= 0
+              AND COALESCE(wallet_balance, 0) >= :required
+    """
+
+    if not asset:
+        sql = f"""
+        WITH updated AS ({wallet_update} RETURNING id, wallet_balance),
+        held AS (SELECT NULL::float AS quantity)
+        """
+    else:
+        symbol, quantity = asset
+        params.update({"symbol": symbol, "quantity": quantity})
+        if quantity >= 0:
+            # Credit the holding only if the wallet update went through
+            sql = f"""
+            WITH updated AS ({wallet_update} RETURNING id, wallet_balance),
+            held AS (
+                INSERT INTO {holding_table} (user_id, symbol, quantity)
+                SELECT id, :symbol, :quantity FROM updated
+                ON CONFLICT (user_id, symbol)
+                DO UPDATE SET quantity = {holding_table}.quantity + EXCLUDED.quantity
+                RETURNING quantity
+            )
+            """
+        else:
+            # Debit the holding first; the wallet moves only if enough was held
+            sql = f"""
+            WITH held AS (
+                UPDATE {holding_table}
+                SET quantity = quantity + :quantity
+                WHERE user_id = :user_id AND symbol = :symbol AND quantity + :quantity >= 0
+                  AND EXISTS (
+                      SELECT 1 FROM "{user_table}"
+                      WHERE id = :user_id AND COALESCE(wallet_balance, 0) + :delta >= 0
+                        AND COALESCE(wallet_balance, 0) >= :required
+                  )
+                RETURNING quantity
+            ),
+            updated AS ({wallet_update} AND EXISTS (SELECT 1 FROM held) RETURNING id, wallet_balance)
+            """
+
+    if PORTFOLIO_ROLLUP_ENABLED:
+        # Queue the user for the poller's next portfolio rollup in the same statement
+        sql += f""",
+        queued AS ({ROLLUP_QUEUE_SQL.format(source="SELECT id AS user_id FROM updated")})
+        """
+
+    if transaction:
+        sql += f""",
+        recorded AS (
+            INSERT INTO "{Transaction.__tablename__}" (user_id, symbol, amount, price, total_value, timestamp)
+            SELECT id, :tx_symbol, :tx_amount, :tx_price, :tx_total_value, :tx_timestamp FROM updated
+            RETURNING id
+        ),
+        positioned AS ({position_upsert_sql(
+            "SELECT id AS user_id, :tx_symbol AS symbol, :tx_amount AS amount, "
+            ":tx_price AS price, :tx_timestamp AS traded_at FROM updated"
+        )})
+        SELECT updated.id, updated.wallet_balance, (SELECT quantity FROM held) AS quantity,
+               (SELECT id FROM recorded) AS transaction_id
+        FROM updated
+        """
+        params.update({
+            "tx_symbol": transaction["symbol"],
+            "tx_amount": transaction["amount"],
+            "tx_price": transaction["price"],
+            "tx_total_value": transaction["total_value"],
+            "tx_timestamp": transaction.get("timestamp") or datetime.utcnow()
+        })
+    else:
+        sql += """
+        SELECT updated.id, updated.wallet_balance, (SELECT quantity FROM held) AS quantity,
+               NULL AS transaction_id
+        FROM updated
+        """
+
+    row = db.session.execute(text(sql), params).mappings().first()
+    db.session.commit()
+    return dict(row) if row else None
+
+def user_exists(user_id):
+    return db.session.query(User.id).filter_by(id=user_id).first() is not None
+
 @app.route("/deposit", methods=["POST"])
 @jwt_required()
 def deposit():
@@ -289,14 +1454,11 @@ def deposit():
     if amount <= 0:
         return jsonify(success=False, message="Invalid amount"), 400
 
-    user = User.query.get(user_id)
-    if not user:
+    balances = apply_balance_delta(user_id, amount)
+    if not balances:
         return jsonify(success=False, message="User not found"), 404
 
-    user.wallet_balance += amount
-    db.session.commit()
-
-    return jsonify(success=True, new_balance=user.wallet_balance)
+    return jsonify(success=True, new_balance=balances["wallet_balance"])
 
 
 
@@ -305,19 +1467,17 @@ def deposit():
 def withdraw():
     user_id = get_jwt_identity()
     amount = request.json.get("amount", 0)
-    user = User.query.get(user_id)
 
-    if not user:
-        return jsonify(success=False, message="User not found"), 404
     if amount <= 0:
         return jsonify(success=False, message="Invalid amount"), 400
-    if amount > user.wallet_balance:
-        return jsonify(success=False, message="Insufficient funds"), 400
 
-    user.wallet_balance -= amount
-    db.session.commit()
+    balances = apply_balance_delta(user_id, -amount)
+    if not balances:
+        if not user_exists(user_id):
+            return jsonify(success=False, message="User not found"), 404
+        return jsonify(success=False, message="Insufficient funds"), 400
 
-    return jsonify(success=True, new_balance=user.wallet_balance)
+    return jsonify(success=True, new_balance=balances["wallet_balance"])
 
 
 def get_wallet_balance(user_id):
@@ -325,27 +1485,18 @@ def get_wallet_balance(user_id):
     return user.wallet_balance if user else 0.0
 
 def update_wallet(user_id, delta):
-    user = User.query.get(user_id)
-    if user:
-        user.wallet_balance = max(0, user.wallet_balance + delta)
-        db.session.commit()
-        return True
-    return False
+    return apply_balance_delta(user_id, delta) is not None
 
 @app.route("/buy_crypto", methods=["POST"])
 @jwt_required()
 def buy_crypto():
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-
-    if not user:
-        return jsonify({"success": False, "message": "User not found"}), 404
 
     data = request.get_json()
     symbol = data.get("symbol", "").upper()
     amount = float(data.get("amount", 0))  # amount of crypto (e.g. 0.5 ETH)
 
-    if symbol not in ["BTC", "ETH", "LTC", "SOL"]:
+    if symbol not in COINGECKO_IDS:
         return jsonify({"success": False, "message": "Invalid symbol"}), 400
     if amount <= 0:
         return jsonify({"success": False, "message": "Invalid amount"}), 400
@@ -357,63 +1508,602 @@ def buy_crypto():
 
     total_cost = amount * price
 
-    if user.wallet_balance < total_cost:
-        return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
-
-    # ✅ Deduct fiat and add crypto
-    user.wallet_balance -= total_cost
-    if symbol == "BTC":
-        user.btc_balance += amount
-    elif symbol == "ETH":
-        user.eth_balance += amount
-    elif symbol == "LTC":
-        user.ltc_balance += amount
-    elif symbol == "SOL":
-        user.sol_balance += amount
-
-    # ✅ Log transaction
-    tx = Transaction(
-        user_id=user.id,
-        symbol=symbol,
-        amount=amount,
-        price=price,
-        total_value=total_cost
+    # ✅ Deduct fiat, add crypto and log the transaction in one atomic statement
+    balances = apply_balance_delta(
+        user_id,
+        -total_cost,
+        asset=(symbol, amount),
+        transaction={"symbol": symbol, "amount": amount, "price": price, "total_value": total_cost}
     )
-    db.session.add(tx)
-    db.session.commit()
+    if not balances:
+        if not user_exists(user_id):
+            return jsonify({"success": False, "message": "User not found"}), 404
+        return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
 
     return jsonify({
         "success": True,
         "message": f"Bought {amount:.6f} {symbol}",
-        "new_balance": round(user.wallet_balance, 2),
-        "holdings": {
-            "BTC": user.btc_balance,
-            "ETH": user.eth_balance,
-            "LTC": user.ltc_balance,
-            "SOL": user.sol_balance
-        }
+        "new_balance": round(balances["wallet_balance"], 2),
+        "holdings": get_holdings(user_id)
     })
 
-@app.route("/transactions", methods=["GET"])
+# Maximum number of orders accepted in one /batch_orders request
+MAX_BATCH_ORDERS = 50
+
+@app.route("/batch_orders", methods=["POST"])
 @jwt_required()
-def get_transactions():
+def batch_orders():
+    """
+    Execute a list of buys and sells at one batched quote, in a single DB transaction.
+    Body: {"idempotency_key": "...", "orders": [{"symbol": "BTC", "side": "buy", "amount": 0.1}, ...]}
+    Retrying with the same idempotency key returns the original result.
+    """
     user_id = get_jwt_identity()
-    if not user_id:
-        return jsonify({"error": "Invalid or expired token"}), 401
+    data = request.get_json() or {}
+    key = str(data.get("idempotency_key", "")).strip()
+    orders = data.get("orders") or []
 
-    txs = Transaction.query.filter_by(user_id=user_id).order_by(Transaction.timestamp.desc()).all()
+    if not key or len(key) > 64:
+        return jsonify({"success": False, "message": "An idempotency_key of up to 64 characters is required"}), 400
 
-    return jsonify([
-        {
-            "symbol": tx.symbol,
-            "amount": tx.amount,
-            "price": tx.price,
-            "total_value": tx.total_value,
-            "timestamp": tx.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        }
-        for tx in txs
+    existing = db.session.get(BatchOrder, (user_id, key))
+    if existing and existing.response:
+        return jsonify(dict(json.loads(existing.response), replayed=True))
+
+    if not orders or len(orders) > MAX_BATCH_ORDERS:
+        return jsonify({"success": False, "message": f"Send between 1 and {MAX_BATCH_ORDERS} orders"}), 400
+
+    parsed = []
+    for order in orders:
+        try:
+            symbol = str(order["symbol"]).upper()
+            side = str(order.get("side", "buy")).lower()
+            amount = float(order["amount"])
+        except (KeyError, ValueError, TypeError):
+            return jsonify({"success": False, "message": f"Invalid order: {order}"}), 400
+        if symbol not in COINGECKO_IDS or side not in ("buy", "sell") or amount <= 0:
+            return jsonify({"success": False, "message": f"Invalid order: {order}"}), 400
+        parsed.append((symbol, side, amount))
+
+    # ✅ Price every order with one batched quote
+    quotes = fetch_live_quotes(sorted({symbol for symbol, _, _ in parsed}))
+    if any(symbol not in quotes for symbol, _, _ in parsed):
+        return jsonify({"success": False, "message": "Failed to fetch live prices"}), 500
+
+    timestamp = datetime.utcnow()
+    rows = []
+    quantity_deltas = {}
+    for symbol, side, amount in parsed:
+        quantity = amount if side == "buy" else -amount
+        price = quotes[symbol]["price"]
+        quantity_deltas[symbol] = quantity_deltas.get(symbol, 0.0) + quantity
+        rows.append({
+            "user_id": user_id,
+            "symbol": symbol,
+            "amount": quantity,
+            "price": price,
+            "total_value": quantity * price,
+            "timestamp": timestamp
+        })
+    cash_delta = -sum(row["total_value"] for row in rows)
+
+    try:
+        # Claim the idempotency key; a concurrent retry fails on the primary key
+        db.session.add(BatchOrder(user_id=user_id, idempotency_key=key))
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        existing = db.session.get(BatchOrder, (user_id, key))
+        if existing and existing.response:
+            return jsonify(dict(json.loads(existing.response), replayed=True))
+        return jsonify({"success": False, "message": "Batch with this key is already in progress"}), 409
+
+    balance = db.session.execute(text(f"""
+        UPDATE "{User.__tablename__}"
+        SET wallet_balance = COALESCE(wallet_balance, 0) + :delta
+        WHERE id = :user_id AND COALESCE(wallet_balance, 0) + :delta >= 0
+        RETURNING wallet_balance
+    """), {"user_id": user_id, "delta": cash_delta}).scalar()
+    if balance is None:
+        db.session.rollback()
+        if not user_exists(user_id):
+            return jsonify({"success": False, "message": "User not found"}), 404
+        return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
+
+    # All touched holdings in one upsert; any negative result means a sell exceeded the holding
+    values = ", ".join(f"(:user_id, :symbol_{i}, :quantity_{i})" for i in range(len(quantity_deltas)))
+    params = {"user_id": user_id}
+    for i, (symbol, quantity) in enumerate(quantity_deltas.items()):
+        params[f"symbol_{i}"] = symbol
+        params[f"quantity_{i}"] = quantity
+    holdings = dict(db.session.execute(text(f"""
+        INSERT INTO {Holding.__tablename__} (user_id, symbol, quantity)
+        VALUES {values}
+        ON CONFLICT (user_id, symbol)
+        DO UPDATE SET quantity = {Holding.__tablename__}.quantity + EXCLUDED.quantity
+        RETURNING symbol, quantity
+    """), params).all())
+    short = [symbol for symbol, quantity in holdings.items() if quantity < -1e-12]
+    if short:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Insufficient holdings: {', '.join(short)}"}), 400
+
+    # ✅ Log every order with one bulk insert, then fold them into the portfolio in order
+    db.session.execute(db.insert(Transaction), rows)
+    db.session.execute(text(position_upsert_sql(TRADE_PARAMS_SOURCE)), rows)
+
+    result = {
+        "success": True,
+        "message": f"Executed {len(rows)} orders",
+        "new_balance": round(balance, 2),
+        "orders": [
+            {"symbol": row["symbol"], "amount": row["amount"], "price": row["price"], "total_value": row["total_value"]}
+            for row in rows
+        ],
+        "holdings": holdings
+    }
+    db.session.query(BatchOrder).filter_by(user_id=user_id, idempotency_key=key).update(
+        {"response": json.dumps(result)}
+    )
+    db.session.execute(text(ROLLUP_QUEUE_SQL.format(source="SELECT :user_id AS user_id")), {"user_id": user_id})
+    db.session.commit()
+    return jsonify(result)
+
+# Rows fetched per server-side cursor round trip (and per Parquet row group) when exporting
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+EXPORT_COLUMNS = ["id", "user_id", "symbol", "amount", "price", "total_value", "timestamp"]
+
+def iter_transaction_chunks(user_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield lists of Transaction row tuples (EXPORT_COLUMNS order) from a server-side
+    cursor, chunk_size rows at a time. All users when user_id is None.
+    """
+    query = db.select(*(getattr(Transaction, column) for column in EXPORT_COLUMNS))
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    query = query.order_by(Transaction.user_id, Transaction.timestamp, Transaction.id)
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    for chunk in result.partitions():
+        yield chunk
+
+class ParquetChunkSink:
+    """
+    Write-only file object for ParquetWriter that hands back whatever was
+    written since the last drain(), so row groups can be streamed as produced.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def export_transactions(fmt, user_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the ledger as CSV or Parquet bytes, one piece per cursor chunk,
+    so memory stays constant however many rows there are.
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for chunk in iter_transaction_chunks(user_id, chunk_size):
+            writer.writerows(chunk)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode()
+        return
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("user_id", pa.int64()), ("symbol", pa.string()),
+        ("amount", pa.float64()), ("price", pa.float64()), ("total_value", pa.float64()),
+        ("timestamp", pa.timestamp("us"))
     ])
+    sink = ParquetChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in iter_transaction_chunks(user_id, chunk_size):
+        columns = list(zip(*chunk))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+@app.route("/transactions/export", methods=["GET"])
+@jwt_required()
+def export_transactions_endpoint():
+    """
+    Stream the caller's full ledger as CSV (default) or Parquet (?format=parquet).
+    """
+    user_id = get_jwt_identity()
+    fmt = request.args.get("format", "csv").lower()
+    if fmt not in ("csv", "parquet"):
+        return jsonify({"error": "format must be csv or parquet"}), 400
+    if fmt == "parquet" and pq is None:
+        return jsonify({"error": "Parquet export requires pyarrow"}), 501
+
+    mimetype = "text/csv" if fmt == "csv" else "application/vnd.apache.parquet"
+    return Response(
+        stream_with_context(export_transactions(fmt, user_id)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=transactions.{fmt}"}
+    )
+
+@app.route("/portfolio", methods=["GET"])
+@jwt_required()
+def get_portfolio():
+    """
+    Per-asset position, cost basis and realized/unrealized P&L from portfolio_position,
+    priced with one batched quote.
+    """
+    user_id = get_jwt_identity()
+    positions = PortfolioPosition.query.filter_by(user_id=user_id).all()
+    quotes = fetch_live_quotes([position.symbol for position in positions if position.quantity > 0])
+
+    assets = []
+    totals = {"market_value": 0.0, "cost_basis": 0.0, "realized_pnl": 0.0, "unrealized_pnl": 0.0}
+    for position in positions:
+        price = quotes.get(position.symbol, {}).get("price")
+        cost_basis = position.quantity * position.avg_cost
+        market_value = position.quantity * price if price is not None else None
+        unrealized = market_value - cost_basis if market_value is not None else None
+        assets.append({
+            "symbol": position.symbol,
+            "quantity": position.quantity,
+            "avg_cost": round(position.avg_cost, 2),
+            "price": price,
+            "cost_basis": round(cost_basis, 2),
+            "market_value": round(market_value, 2) if market_value is not None else None,
+            "realized_pnl": round(position.realized_pnl, 2),
+            "unrealized_pnl": round(unrealized, 2) if unrealized is not None else None,
+            "last_trade_at": position.last_trade_at.strftime('%Y-%m-%d %H:%M:%S') if position.last_trade_at else None
+        })
+        totals["cost_basis"] += cost_basis
+        totals["realized_pnl"] += position.realized_pnl
+        if market_value is not None:
+            totals["market_value"] += market_value
+            totals["unrealized_pnl"] += unrealized
+
+    return jsonify({
+        "assets": assets,
+        "totals": {key: round(value, 2) for key, value in totals.items()}
+    })
+
+@app.route("/portfolio/history", methods=["GET"])
+@jwt_required()
+def get_portfolio_history():
+    """
+    OHLC bars of the caller's portfolio value from the precomputed rollups.
+    Query params: resolution (1m, 1h, 1d), start, end (ISO dates), limit (latest N bars).
+    Buckets in which the value did not change have no stored bar and are filled flat
+    from the previous close, up to the current bucket.
+    """
+    user_id = get_jwt_identity()
+    resolution = request.args.get("resolution", "1h")
+    if resolution not in PORTFOLIO_RESOLUTIONS:
+        return jsonify({"error": f"resolution must be one of {', '.join(PORTFOLIO_RESOLUTIONS)}"}), 400
+    try:
+        limit = min(5000, max(1, int(request.args.get("limit", 500))))
+        start = datetime.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = datetime.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit or date"}), 400
+
+    query = db.select(
+        PortfolioValueBar.bucket_start, PortfolioValueBar.open, PortfolioValueBar.high,
+        PortfolioValueBar.low, PortfolioValueBar.close
+    ).where(PortfolioValueBar.user_id == user_id, PortfolioValueBar.resolution == resolution)
+    if start:
+        query = query.where(PortfolioValueBar.bucket_start >= start)
+    if end:
+        query = query.where(PortfolioValueBar.bucket_start < end)
+    rows = db.session.execute(query.order_by(PortfolioValueBar.bucket_start.desc()).limit(limit)).all()
+
+    return jsonify({
+        "resolution": resolution,
+        "bars": [
+            {"time": bucket.strftime('%Y-%m-%d %H:%M:%S'), "open": round(open_, 2), "high": round(high, 2),
+             "low": round(low, 2), "close": round(close, 2)}
+            for bucket, open_, high, low, close in fill_portfolio_bars(
+                list(reversed(rows)), PORTFOLIO_RESOLUTIONS[resolution], limit, start, end
+            )
+        ]
+    })
+
+def fill_portfolio_bars(rows, unit, limit, start=None, end=None):
+    """
+    Return the last `limit` buckets up to the current one (or end) from stored
+    (bucket_start, open, high, low, close) rows, oldest first, with missing buckets
+    filled flat from the previous close.
+    """
+    if not rows:
+        return []
+    width = PORTFOLIO_BUCKET_WIDTHS[unit]
+    now = datetime.utcnow()
+    last = bucket_start(min(end - timedelta(microseconds=1), now) if end else now, unit)
+    first = max(rows[0][0], last - width * (limit - 1))
+    if start:
+        first = max(first, bucket_start(start, unit))
+
+    stored = {row[0]: row for row in rows}
+    carry = None
+    for row in rows:
+        if row[0] < first:
+            carry = row[4]
+    bars = []
+    bucket = first
+    while bucket <= last:
+        row = stored.get(bucket)
+        if row:
+            bars.append(tuple(row))
+            carry = row[4]
+        elif carry is not None:
+            bars.append((bucket, carry, carry, carry, carry))
+        bucket += width
+    return bars
+
+# Page size limits for /transactions
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_MAX_PAGE_SIZE = 1000
+
+def encode_transaction_cursor(timestamp, tx_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{tx_id}".encode()).decode()
+
+def decode_transaction_cursor(cursor):
+    timestamp, tx_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(tx_id)
+
+@app.route("/transactions", methods=["GET"])
+@jwt_required()
+def get_transactions():
+    """
+    Newest-first transaction history, keyset-paginated on (timestamp, id).
+    Query params: limit, cursor (from the previous page's next_cursor), symbol, start, end (ISO dates).
+    """
+    user_id = get_jwt_identity()
+    if not user_id:
+        return jsonify({"error": "Invalid or expired token"}), 401
+
+    try:
+        limit = min(TRANSACTIONS_MAX_PAGE_SIZE, max(1, int(request.args.get("limit", TRANSACTIONS_PAGE_SIZE))))
+        cursor = request.args.get("cursor")
+        after = decode_transaction_cursor(cursor) if cursor else None
+        start = datetime.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = datetime.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid limit, cursor or date"}), 400
+
+    query = db.select(
+        Transaction.id, Transaction.symbol, Transaction.amount,
+        Transaction.price, Transaction.total_value, Transaction.timestamp
+    ).where(Transaction.user_id == user_id)
+    if request.args.get("symbol"):
+        query = query.where(Transaction.symbol == request.args["symbol"].upper())
+    if start:
+        query = query.where(Transaction.timestamp >= start)
+    if end:
+        query = query.where(Transaction.timestamp < end)
+    if after:
+        query = query.where(tuple_(Transaction.timestamp, Transaction.id) < after)
+    # One extra row tells us whether another page exists
+    query = query.order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(limit + 1)
+
+    rows = db.session.execute(query)
+
+    def generate():
+        yield '{"transactions": ['
+        last = None
+        for count, (tx_id, symbol, amount, price, total_value, timestamp) in enumerate(rows):
+            if count == limit:
+                break
+            if last:
+                yield ","
+            last = (timestamp, tx_id)
+            yield json.dumps({
+                "id": tx_id,
+                "symbol": symbol,
+                "amount": amount,
+                "price": price,
+                "total_value": total_value,
+                "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')
+            })
+        else:
+            last = None
+        next_cursor = encode_transaction_cursor(*last) if last else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
 
+def network_fee_for(crypto_symbol):
+    """
+    Network (gas) fee in USD for a coin name or ticker.
+    """
+    symbol = normalize_symbol(crypto_symbol) or crypto_symbol.upper()
+    return NETWORK_FEES.get(symbol, 5.0)
+
+def slippage_for_amount(amount):
+    return min(SLIPPAGE_MAX, max(SLIPPAGE_MIN, amount / SLIPPAGE_SCALE))
+
+def arbitrage_net_profit(amount, buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee):
+    """
+    Net USD profit of buying `amount` USD on one exchange and selling on another,
+    under the same fee, network-fee and slippage model as calculate_realistic_arbitrage.
+    """
+    slippage_factor = slippage_for_amount(amount)
+    crypto_amount = (amount - amount * buy_fee_pct - network_fee) / (buy_price * (1 + slippage_factor))
+    proceeds = crypto_amount * sell_price * (1 - slippage_factor) - amount * sell_fee_pct - network_fee
+    return proceeds - amount
+
+def sliding_slippage_coefficients(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee):
+    """
+    (qa, qb, qc) such that, where slippage is amount / SLIPPAGE_SCALE,
+    profit(a) * buy_price * (1 + a / SLIPPAGE_SCALE) = qa * a^2 + qb * a + qc.
+    """
+    k = SLIPPAGE_SCALE
+    a_term = (1 - buy_fee_pct) * sell_price
+    b_term = (1 + sell_fee_pct) * buy_price
+    qa = -(a_term + b_term) / k
+    qb = (a_term - b_term) + network_fee * (sell_price - buy_price) / k
+    qc = -network_fee * (sell_price + buy_price)
+    return qa, qb, qc
+
+def profitable_amount_ranges(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee):
+    """
+    Solve the arbitrage profit model in closed form and return the USD trade sizes
+    that make a profit, as a list of (low, high) intervals (high may be math.inf).
+
+    Slippage is piecewise: constant below and above the clamp points, where profit is
+    linear in the amount, and amount / SLIPPAGE_SCALE in between, where profit has the
+    sign of a concave quadratic. Each piece is solved exactly.
+    """
+    low_end = SLIPPAGE_MIN * SLIPPAGE_SCALE
+    high_start = SLIPPAGE_MAX * SLIPPAGE_SCALE
+    intervals = []
+
+    def linear_piece(slippage_factor, lo, hi):
+        # profit(a) = slope * a - offset
+        rate = sell_price * (1 - slippage_factor) / (buy_price * (1 + slippage_factor))
+        slope = (1 - buy_fee_pct) * rate - sell_fee_pct - 1
+        offset = network_fee * (rate + 1)
+        if slope <= 0:
+            return
+        start = max(lo, offset / slope)
+        if start < hi:
+            intervals.append((start, hi))
+
+    def quadratic_piece(lo, hi):
+        qa, qb, qc = sliding_slippage_coefficients(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee)
+        disc = qb * qb - 4 * qa * qc
+        if disc < 0:
+            return
+        root = math.sqrt(disc)
+        r1, r2 = sorted(((-qb + root) / (2 * qa), (-qb - root) / (2 * qa)))
+        start, end = max(lo, r1), min(hi, r2)
+        if start < end:
+            intervals.append((start, end))
+
+    linear_piece(SLIPPAGE_MIN, 0.0, low_end)
+    quadratic_piece(low_end, high_start)
+    linear_piece(SLIPPAGE_MAX, high_start, math.inf)
+
+    # Join intervals that meet at a clamp point
+    merged = []
+    for lo, hi in intervals:
+        if merged and lo - merged[-1][1] <= 1e-9:
+            merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def solve_break_even_amount(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee):
+    """
+    Smallest USD trade size that makes a profit, rounded up to the cent, or None.
+    """
+    ranges = profitable_amount_ranges(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee)
+    if not ranges:
+        return None
+    amount = math.ceil(ranges[0][0] * 100) / 100
+    # Step past a root that lands exactly on a cent
+    if arbitrage_net_profit(amount, buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee) <= 0:
+        amount += 0.01
+    return round(amount, 2)
+
+def book_execution_prices(buy_exchange, sell_exchange, crypto_symbol, spend_usd):
+    """
+    Walk the local order books to price a round trip: spend spend_usd on the buy
+    exchange's asks, then sell the coins into the sell exchange's bids.
+    Returns (effective_buy_price, effective_sell_price, crypto_amount), or None
+    when either book is missing, stale or too thin.
+    """
+    symbol = normalize_symbol(crypto_symbol)
+    buy_book = order_books.get(buy_exchange, symbol, max_age=ORDER_BOOK_MAX_AGE)
+    sell_book = order_books.get(sell_exchange, symbol, max_age=ORDER_BOOK_MAX_AGE)
+    if not buy_book or not sell_book or spend_usd <= 0:
+        return None
+
+    effective_buy_price = buy_book.average_buy_price(spend_usd)
+    if not effective_buy_price:
+        return None
+    crypto_amount = spend_usd / effective_buy_price
+    effective_sell_price = sell_book.average_sell_price(crypto_amount)
+    if not effective_sell_price:
+        return None
+    return effective_buy_price, effective_sell_price, crypto_amount
+
+def trade_success_probability(latency):
+    """
+    Probability that a trade fills before prices move, given the combined exchange latency.
+    Works on scalars and NumPy arrays.
+    """
+    return np.clip(SUCCESS_PROB_BASE - latency * SUCCESS_PROB_PER_SECOND, SUCCESS_PROB_MIN, SUCCESS_PROB_BASE)
+
+def optimal_trade_size(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee, max_amount=None):
+    """
+    Profit-maximizing USD trade size up to max_amount, and the profitable size range around it.
+
+    Solved in closed form. Profit is linear in the amount on both constant-slippage pieces,
+    so their optimum is an endpoint: whenever the piece above SLIPPAGE_MAX * SLIPPAGE_SCALE
+    still gains per extra dollar, the answer is max_amount (MAX_TRADE_USD by default).
+    On the middle piece profit is (qa a^2 + qb a + qc) / (buy_price (1 + a / k)), whose
+    stationary points solve qa a^2 / k + 2 qa a + qb - qc / k = 0.
+    """
+    max_amount = max_amount or MAX_TRADE_USD
+
+    def profit(amount):
+        return arbitrage_net_profit(amount, buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee)
+
+    low_end = min(SLIPPAGE_MIN * SLIPPAGE_SCALE, max_amount)
+    high_start = min(SLIPPAGE_MAX * SLIPPAGE_SCALE, max_amount)
+    candidates = [low_end, high_start, max_amount]
+
+    qa, qb, qc = sliding_slippage_coefficients(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee)
+    k = SLIPPAGE_SCALE
+    a2, a1, a0 = qa / k, 2 * qa, qb - qc / k
+    disc = a1 * a1 - 4 * a2 * a0
+    if a2 != 0 and disc >= 0:
+        for root in ((-a1 + math.sqrt(disc)) / (2 * a2), (-a1 - math.sqrt(disc)) / (2 * a2)):
+            if low_end < root < high_start:
+                candidates.append(root)
+
+    best = round(max(candidates, key=profit), 2)
+    best_profit = profit(best)
+    if best_profit <= 0:
+        return {"optimal_amount": None, "max_net_profit": round(best_profit, 4), "profitable_range": None}
+
+    profitable_range = None
+    for start, end in profitable_amount_ranges(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee):
+        if start <= best <= end:
+            profitable_range = [round(start, 2), round(min(end, max_amount), 2)]
+            break
+
+    return {
+        "optimal_amount": best,
+        "max_net_profit": round(best_profit, 4),
+        "profitable_range": profitable_range
+    }
 
 def calculate_realistic_arbitrage(buy_exchange, sell_exchange, crypto_symbol, amount, price_data=None):
     prices = price_data or fetch_prices(crypto_symbol)
@@ -425,13 +2115,26 @@ def calculate_realistic_arbitrage(buy_exchange, sell_exchange, crypto_symbol, am
 
     buy_fee = amount * EXCHANGE_FEES.get(buy_exchange, 0.005)
     sell_fee = amount * EXCHANGE_FEES.get(sell_exchange, 0.005)
-    network_fee = NETWORK_FEES.get(crypto_symbol.upper(), 5.0)
+    network_fee = network_fee_for(crypto_symbol)
 
-    slippage_factor = min(0.01, max(0.001, amount / 100000))
+    slippage_factor = slippage_for_amount(amount)
     effective_buy_price = buy_price * (1 + slippage_factor)
     effective_sell_price = sell_price * (1 - slippage_factor)
 
     crypto_amount = (amount - buy_fee - network_fee) / effective_buy_price
+
+    # Price against the local order books when both are fresh and deep enough
+    book_prices = book_execution_prices(
+        buy_exchange, sell_exchange, crypto_symbol, amount - buy_fee - network_fee
+    )
+    if book_prices:
+        effective_buy_price, effective_sell_price, crypto_amount = book_prices
+        slippage_factor = max(
+            effective_buy_price / buy_price - 1,
+            1 - effective_sell_price / sell_price,
+            0.0
+        )
+
     proceeds = (crypto_amount * effective_sell_price) - sell_fee - network_fee
     profit = proceeds - amount
 
@@ -450,13 +2153,16 @@ def calculate_realistic_arbitrage(buy_exchange, sell_exchange, crypto_symbol, am
         "latency": latency,
         "effective_buy_price": effective_buy_price,
         "effective_sell_price": effective_sell_price,
-        "crypto_amount": crypto_amount
+        "crypto_amount": crypto_amount,
+        "priced_from": "order_book" if book_prices else "ticker"
     }
 
 
 @app.route('/execute_trade', methods=['POST'])
+@jwt_required()
 def execute_trade():
     try:
+        user_id = get_jwt_identity()
         data = request.get_json()
         print(f"🔹 Received Trade Data: {data}")
 
@@ -468,13 +2174,13 @@ def execute_trade():
         # Convert and validate amounts
         try:
             trade_amount = float(data["tradeAmount"])
-            crypto = data["crypto"].upper()
-        except (ValueError, TypeError):
+            crypto = normalize_symbol(data["crypto"]) or data["crypto"].upper()
+        except (ValueError, TypeError, AttributeError):
             return jsonify({"status": "error", "message": "Invalid numeric values"}), 400
-
-        # Check wallet balance
-        if trade_amount > wallet["balance"]:
-            return jsonify({"status": "error", "message": "Insufficient balance"}), 400
+        if trade_amount <= 0:
+            return jsonify({"status": "error", "message": "Invalid numeric values"}), 400
+        if trade_amount <= network_fee_for(crypto):
+            return jsonify({"status": "error", "message": "Trade amount must exceed the network fee"}), 400
 
         # Calculate realistic trade execution
         realistic_trade = calculate_realistic_arbitrage(
@@ -486,18 +2192,22 @@ def execute_trade():
 
         if not realistic_trade:
             return jsonify({"status": "error", "message": "Could not calculate trade parameters"}), 400
+        if realistic_trade["crypto_amount"] <= 0:
+            return jsonify({"status": "error", "message": "Trade amount does not cover the fees"}), 400
 
         # Simulate trade execution with success probability based on latency
         # Faster trades have higher success rates
-        success_prob = 0.95 - (realistic_trade["latency"] * 0.1)
-        success_prob = max(0.7, min(0.95, success_prob))  # Keep between 70-95%
+        success_prob = trade_success_probability(realistic_trade["latency"])
         
         if random.random() < success_prob:  # Trade succeeds
-            # Deduct trade amount and add profit
-            wallet["balance"] -= trade_amount
-            wallet["balance"] += trade_amount + realistic_trade["net_profit"]
-            wallet["assets"][crypto] += realistic_trade["crypto_amount"]
-            
+            # The coins are bought and sold again in the same round trip, so only the net
+            # P&L settles; the balance must cover the trade amount beforehand
+            balances = apply_balance_delta(user_id, realistic_trade["net_profit"], required=trade_amount)
+            if not balances:
+                if not user_exists(user_id):
+                    return jsonify({"status": "error", "message": "User not found"}), 404
+                return jsonify({"status": "error", "message": "Insufficient balance"}), 400
+
             # Log successful trade
             log_transaction(
                 "arbitrage_trade",
@@ -513,23 +2223,29 @@ def execute_trade():
             return jsonify({
                 "status": "success",
                 "profit": round(realistic_trade["net_profit"], 2),
-                "new_balance": round(wallet["balance"], 2),
-                "crypto_balance": round(wallet["assets"][crypto], 6),
+                "new_balance": round(balances["wallet_balance"], 2),
+                "crypto_balance": round(get_holdings(user_id).get(crypto, 0.0), 6),
                 "fees": realistic_trade["fees"],
                 "slippage": realistic_trade["slippage"],
                 "latency": realistic_trade["latency"],
-                "effective_prices": realistic_trade["effective_prices"]
+                "effective_prices": {
+                    "buy": realistic_trade["effective_buy_price"],
+                    "sell": realistic_trade["effective_sell_price"]
+                }
             })
         else:
             # Simulate failed trade (only deduct trade amount and fees)
-            wallet["balance"] -= trade_amount
-            lost_amount = trade_amount * 0.02  # Lose 2% in failed trade
-            wallet["balance"] -= lost_amount
+            lost_amount = trade_amount * FAILED_TRADE_LOSS  # Lose 2% in failed trade
+            balances = apply_balance_delta(user_id, -(trade_amount + lost_amount), required=trade_amount)
+            if not balances:
+                if not user_exists(user_id):
+                    return jsonify({"status": "error", "message": "User not found"}), 404
+                return jsonify({"status": "error", "message": "Insufficient balance"}), 400
             
             return jsonify({
                 "status": "failed",
                 "message": "Trade failed - price moved during execution",
-                "new_balance": round(wallet["balance"], 2),
+                "new_balance": round(balances["wallet_balance"], 2),
                 "lost_amount": round(lost_amount, 2),
                 "reason": "Price movement during execution window"
             })
@@ -543,20 +2259,10 @@ def calculate_minimum_trade_to_break_even(buy_price, sell_price, buy_fee_pct, se
     if spread <= 0:
         return None
 
-    # Assume $1 trade to find net profit per dollar
-    test_amount = 1
-    buy_fee = test_amount * buy_fee_pct
-    sell_fee = test_amount * sell_fee_pct
-    crypto_amount = (test_amount - buy_fee - network_fee) / buy_price
-    proceeds = crypto_amount * sell_price
-    net_profit = proceeds - test_amount - sell_fee - network_fee
-
-    if net_profit <= 0:
+    required_trade = solve_break_even_amount(buy_price, sell_price, buy_fee_pct, sell_fee_pct, network_fee)
+    if required_trade is None:
         return "not profitable"
-
-    # Estimate trade amount needed to offset fixed network fees
-    required_trade = (2 * network_fee + buy_fee + sell_fee) / (net_profit / test_amount)
-    return round(required_trade, 2)
+    return required_trade
 
 
 @app.route('/arbitrage')
@@ -566,12 +2272,24 @@ def arbitrage():
         return jsonify({"response": "Please specify a cryptocurrency."})
 
     try:
-        price_data = fetch_prices(crypto)
+        # Answer from the background scanner when it has a fresh result for this coin
+        scan = opportunity_index.get(normalize_symbol(crypto))
+        if scan:
+            quotes = {
+                "prices": scan["prices"],
+                "missing": {e: "stale" for e in PRICE_FETCHERS if e not in scan["prices"]}
+            }
+        else:
+            quotes = fetch_quotes(crypto)
+        price_data = quotes["prices"]
         if not price_data:
-            return jsonify({"response": "Failed to fetch prices from exchanges"})
+            return jsonify({
+                "response": "Failed to fetch prices from exchanges",
+                "missing_exchanges": quotes["missing"]
+            })
 
         stable_prices = {e: {"price": p, "stable": True} for e, p in price_data.items()}
-        opportunities = find_arbitrage_opportunities(price_data)
+        opportunities = scan["opportunities"] if scan else find_arbitrage_opportunities(price_data, crypto)
 
         if not opportunities:
             exchanges = list(price_data.keys())
@@ -587,21 +2305,21 @@ def arbitrage():
 
             # ✅ Correct break-even logic: always buy low, sell high
             def find_break_even_amount(prices, crypto):
-                exchanges = list(prices.keys())
-                for usd in range(10, 10001, 10):
-                    for buy_exchange in exchanges:
-                        for sell_exchange in exchanges:
-                            if buy_exchange != sell_exchange:
-                                test_result = calculate_realistic_arbitrage(
-                                    buy_exchange=buy_exchange,
-                                    sell_exchange=sell_exchange,
-                                    crypto_symbol=crypto,
-                                    amount=usd,
-                                    price_data=prices
-                                )
-                                if test_result and test_result['net_profit'] > 0:
-                                    return usd
-                return None
+                network_fee = network_fee_for(crypto)
+                amounts = [
+                    solve_break_even_amount(
+                        prices[buy_exchange],
+                        prices[sell_exchange],
+                        EXCHANGE_FEES.get(buy_exchange, 0.005),
+                        EXCHANGE_FEES.get(sell_exchange, 0.005),
+                        network_fee
+                    )
+                    for buy_exchange in prices
+                    for sell_exchange in prices
+                    if buy_exchange != sell_exchange
+                ]
+                amounts = [amount for amount in amounts if amount is not None]
+                return min(amounts) if amounts else None
 
             min_required_usd = find_break_even_amount(price_data, crypto)
             formatted_min = f"${min_required_usd:.2f}" if min_required_usd else "$0.00"
@@ -621,9 +2339,11 @@ def arbitrage():
                     "max_price_difference": round(max_diff, 4),
                     "price_stability": "stable" if all(p["stable"] for p in stable_prices.values()) else "volatile",
                     "suggestion": "Try again during periods of higher market volatility",
-                    "reason": reason
+                    "reason": reason,
+                    "break_even_amount": min_required_usd
                 },
-                "prices": price_data
+                "prices": price_data,
+                "missing_exchanges": quotes["missing"]
             })
 
         # ✅ Arbitrage opportunity found
@@ -632,7 +2352,8 @@ def arbitrage():
             "response": "Arbitrage opportunities found!",
             "crypto_symbol": crypto.upper(),
             **{f"{exchange.lower()}_price": price for exchange, price in price_data.items()},
-            "arbitrage_opportunity": arbitrage_opportunity
+            "arbitrage_opportunity": arbitrage_opportunity,
+            "missing_exchanges": quotes["missing"]
         })
 
     except Exception as e:
@@ -648,148 +2369,1046 @@ def arbitrage():
 #     """
 #     return jsonify({"balance": wallet['balance']})
 
-@app.route("/fees", methods=["GET"])
-def get_fees():
-    return jsonify({
-        "exchange_fees": EXCHANGE_FEES,
-        "network_fees": NETWORK_FEES
-    })
+@app.route("/fees", methods=["GET"])
+def get_fees():
+    return jsonify({
+        "exchange_fees": EXCHANGE_FEES,
+        "network_fees": NETWORK_FEES
+    })
+
+@app.route("/arbitrage/matrix", methods=["GET"])
+def arbitrage_matrix_endpoint():
+    """
+    Net profit for every exchange pair across a sweep of trade sizes,
+    e.g. /arbitrage/matrix?crypto=bitcoin&amounts=100,1000,5000
+    """
+    crypto = request.args.get("crypto", "").lower()
+    if not crypto:
+        return jsonify({"response": "Please specify a cryptocurrency."}), 400
+    try:
+        amounts = [float(a) for a in request.args.get("amounts", "1000").split(",") if a.strip()]
+    except ValueError:
+        return jsonify({"response": "Invalid amounts"}), 400
+
+    price_data = fetch_prices(crypto)
+    if not price_data:
+        return jsonify({"response": "Failed to fetch prices from exchanges"})
+
+    matrix = arbitrage_matrix(price_data, crypto, amounts)
+    net_profit = np.where(matrix["valid"], matrix["net_profit"], np.nan)
+    return jsonify({
+        "crypto_symbol": normalize_symbol(crypto) or crypto.upper(),
+        "prices": price_data,
+        "exchanges": matrix["exchanges"],
+        "amounts": matrix["amounts"].tolist(),
+        # net_profit[buy][sell][amount]; null on the diagonal
+        "net_profit": [
+            [[None if np.isnan(v) else round(float(v), 4) for v in row] for row in plane]
+            for plane in net_profit
+        ],
+        "slippage": matrix["slippage"].tolist(),
+        "optimal_sizes": {
+            f"{buy}->{sell}": optimal_trade_size(
+                price_data[buy],
+                price_data[sell],
+                EXCHANGE_FEES.get(buy, 0.005),
+                EXCHANGE_FEES.get(sell, 0.005),
+                network_fee_for(crypto)
+            )
+            for buy in matrix["exchanges"]
+            for sell in matrix["exchanges"]
+            if buy != sell
+        }
+    })
+
+@app.route("/opportunities/best", methods=["GET"])
+def best_opportunities():
+    """
+    Current best arbitrage opportunities across every scanned symbol, by net profit.
+    Answers 503 until this process has scanner results, rather than an empty list.
+    """
+    updated_at = opportunity_index.updated_at()
+    if updated_at is None:
+        return jsonify({"error": "Opportunity scanner has no results yet, retry later"}), 503, {"Retry-After": "5"}
+    limit = request.args.get("limit", OPPORTUNITY_TOP_K, type=int)
+    return jsonify({"opportunities": opportunity_index.top(limit), "updated_at": updated_at})
+
+@app.route("/arbitrage/cycles", methods=["GET"])
+def arbitrage_cycles():
+    """
+    Latest multi-leg arbitrage cycle found by the graph scanner, if any.
+    """
+    return jsonify({
+        "cycle": latest_arbitrage_cycle,
+        "nodes": len(arbitrage_graph.nodes)
+    })
+
+@app.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(quote_cache.stats())
+
+@app.route("/ticks/<exchange>/<symbol>", methods=["GET"])
+def get_ticks(exchange, symbol):
+    """
+    Return the buffered tick history for an exchange/symbol, oldest first.
+    """
+    limit = request.args.get("limit", type=int)
+    symbol = normalize_symbol(symbol) or symbol.upper()
+    timestamps, prices = tick_store.history(exchange, symbol, limit)
+    return jsonify({
+        "exchange": exchange,
+        "symbol": symbol,
+        "timestamps": list(timestamps),
+        "prices": list(prices)
+    })
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """
+    Server-sent events stream of price ticks and newly detected arbitrage opportunities.
+    Optional ?symbols=BTC,ETH limits tick and opportunity events to those symbols.
+    """
+    if event_hub.subscriber_count() >= STREAM_MAX_CLIENTS:
+        return jsonify({"error": "Too many open streams, retry later"}), 503, {"Retry-After": "5"}
+
+    symbols = {
+        normalize_symbol(s) or s.upper()
+        for s in request.args.get("symbols", "").split(",")
+        if s.strip()
+    }
+
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        q = event_hub.subscribe()
+        closes_at = time.monotonic() + STREAM_MAX_SECONDS
+        try:
+            # Start every client off with the latest known prices
+            for exchange, symbol in tick_store.keys():
+                if symbols and symbol not in symbols:
+                    continue
+                price = tick_store.latest(exchange, symbol)
+                yield format_event("tick", {"symbol": symbol, "prices": {exchange: price}})
+
+            while time.monotonic() < closes_at:
+                try:
+                    event, data = q.get(timeout=STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Cycle events span several symbols and always pass
+                if symbols and event in ("tick", "opportunity") and data.get("symbol") not in symbols:
+                    continue
+                yield format_event(event, data)
+        finally:
+            event_hub.unsubscribe(q)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/update-settings", methods=["POST"])
+def update_settings():
+    """
+    Endpoint to update bot settings from the frontend.
+    """
+    global bot_settings
+    settings = request.json
+
+    bot_settings["aggressionLevel"] = settings.get("aggressionLevel", bot_settings["aggressionLevel"])
+    bot_settings["riskTolerance"] = settings.get("riskTolerance", bot_settings["riskTolerance"])
+    bot_settings["buyLimit"] = settings.get("buyLimit", bot_settings["buyLimit"])
+    bot_settings["sellLimit"] = settings.get("sellLimit", bot_settings["sellLimit"])
+    bot_settings["maxLossLimit"] = settings.get("maxLossLimit", bot_settings["maxLossLimit"])
+
+    return jsonify({"success": True, "message": "Settings updated successfully."})
+
+def extract_crypto_name(query):
+    """
+    Extract a cryptocurrency name from a user query.
+    """
+    keywords = ["bitcoin", "ethereum", "dogecoin", "solana", "cardano"]
+    for word in keywords:
+        if word in query:
+            return word
+    return None
+
+
+def fetch_prices(crypto_name):
+    """
+    Fetch live price data from every configured exchange.
+    Returns a dict of exchange -> price, or None if no exchange answered.
+    """
+    quotes = fetch_quotes(crypto_name)
+    if quotes["missing"]:
+        logging.warning(f"Missing prices for {crypto_name}: {quotes['missing']}")
+
+    if not quotes["prices"]:
+        print("Failed to fetch prices from all sources.")
+        return None
+
+    return quotes["prices"]
+
+def fetch_quotes(crypto_name, exchanges=None, deadline=None):
+    """
+    Query the exchanges concurrently and collect the quotes that arrive in time.
+    Exchanges that fail or miss the deadline are tagged in "missing" with the reason,
+    so the call takes as long as the slowest exchange inside the deadline.
+    """
+    exchanges = exchanges or list(PRICE_FETCHERS.keys())
+    deadline = deadline or PRICE_FETCH_DEADLINE
+    symbol = normalize_symbol(crypto_name)
+
+    # Serve fresh poller ticks from memory and only go upstream for the rest
+    prices = {}
+    pending = []
+    for exchange in exchanges:
+        tick_price = tick_store.latest(exchange, symbol, max_age=PRICE_TICK_MAX_AGE) if symbol else None
+        if tick_price is not None:
+            prices[exchange] = round(tick_price, 2)
+        elif exchange in PRICE_FETCHERS:
+            pending.append(exchange)
+
+    futures = {
+        price_executor.submit(fetch_exchange_price, exchange, crypto_name): exchange
+        for exchange in pending
+    }
+    done, not_done = wait(futures, timeout=deadline) if futures else (set(), set())
+
+    missing = {exchange: "unsupported" for exchange in exchanges if exchange not in PRICE_FETCHERS}
+    for future in done:
+        exchange = futures[future]
+        try:
+            price = future.result()
+        except Exception as e:
+            logging.warning(f"{exchange} price fetch failed: {e}")
+            price = None
+        if price:
+            prices[exchange] = round(price, 2)
+        else:
+            missing[exchange] = "unavailable"
+
+    for future in not_done:
+        future.cancel()
+        missing[futures[future]] = "timeout"
+
+    return {"prices": prices, "missing": missing}
+
+def fetch_exchange_price(exchange, crypto_name):
+    """
+    Return the price of a cryptocurrency on one exchange, served through the quote cache.
+    """
+    fetcher = PRICE_FETCHERS[exchange]
+    key = normalize_symbol(crypto_name) or crypto_name.lower()
+    return quote_cache.get(
+        exchange, key, lambda: call_upstream(exchange, key, lambda: fetcher(crypto_name))
+    )
+
+class ExchangeAdapter:
+    """
+    Base class for exchange price adapters.
+    Subclasses describe the ticker request and parse its response; the base class
+    handles symbol normalization, the pooled session, timeouts and errors.
+    The base URL can be overridden (e.g. <NAME>_API_URL) to point at a local stub server.
+    """
+    name = None
+    env_prefix = None
+    default_base_url = None
+    # Requests per minute when the exchange has no RATE_LIMITS entry
+    rate_limit = 60
+    # Some exchanges serve order books from a different host
+    default_book_base_url = None
+    # Websocket base URL of the exchange's order book diff feed, if it has one
+    default_stream_base_url = None
+
+    def __init__(self, base_url=None):
+        self.base_url = (
+            base_url or os.getenv(f"{self.env_prefix}_API_URL") or self.default_base_url
+        ).rstrip("/")
+        self.book_base_url = (
+            base_url
+            or os.getenv(f"{self.env_prefix}_BOOK_API_URL")
+            or self.default_book_base_url
+            or self.base_url
+        ).rstrip("/")
+        self.stream_base_url = (
+            os.getenv(f"{self.env_prefix}_STREAM_URL") or self.default_stream_base_url or ""
+        ).rstrip("/") or None
+
+    def ticker_request(self, symbol):
+        """
+        Return (path, params) for the ticker request of a normalized symbol.
+        """
+        raise NotImplementedError
+
+    def parse_ticker(self, symbol, data):
+        """
+        Extract the last price from a decoded ticker response.
+        """
+        raise NotImplementedError
+
+    def order_book_request(self, symbol, depth):
+        """
+        Return (path, params) for the L2 order book request of a normalized symbol.
+        """
+        raise NotImplementedError
+
+    def parse_order_book(self, symbol, data):
+        """
+        Extract ([(price, size)...] bids, [(price, size)...] asks) from a decoded book response.
+        """
+        raise NotImplementedError
+
+    def parse_order_book_sequence(self, data):
+        """
+        Sequence number of a decoded book response, matched against diff feed updates.
+        """
+        return None
+
+    def diff_stream_url(self, symbol):
+        """
+        Websocket URL of the order book diff feed for a normalized symbol, or None.
+        """
+        return None
+
+    def parse_diff(self, message):
+        """
+        Extract (bids, asks, first_sequence, last_sequence) from a decoded diff feed message,
+        or None for messages that are not book updates.
+        """
+        return None
+
+    def get_json(self, path, params=None, base_url=None):
+        return http_get_json(self.name, (base_url or self.base_url) + path, params)
+
+    def fetch_price(self, crypto_name):
+        """
+        Fetch the spot price of a cryptocurrency. Supports full names and symbols.
+        Returns None on unsupported symbols, timeouts and upstream errors.
+        """
+        symbol = normalize_symbol(crypto_name)
+        if not symbol:
+            print(f"Unsupported crypto symbol: {crypto_name}")
+            return None
+
+        try:
+            path, params = self.ticker_request(symbol)
+            return float(self.parse_ticker(symbol, self.get_json(path, params)))
+        except requests.exceptions.Timeout:
+            logging.warning(f"{self.name} timed out fetching {symbol}")
+        except requests.exceptions.HTTPError as e:
+            logging.warning(f"HTTP error fetching {symbol} from {self.name}: {e.response.text}")
+        except Exception as e:
+            logging.warning(f"Error fetching {symbol} price from {self.name}: {e}")
+        return None
+
+    def fetch_order_book(self, crypto_name, depth=None):
+        """
+        Fetch an L2 order book snapshot as (bids, asks, sequence), or None.
+        Bids and asks are lists of (price, size); sequence is None if the exchange has none.
+        """
+        symbol = normalize_symbol(crypto_name)
+        if not symbol:
+            return None
+
+        try:
+            path, params = self.order_book_request(symbol, depth or ORDER_BOOK_DEPTH)
+            data = self.get_json(path, params, base_url=self.book_base_url)
+            bids, asks = self.parse_order_book(symbol, data)
+            return (
+                [(float(level[0]), float(level[1])) for level in bids],
+                [(float(level[0]), float(level[1])) for level in asks],
+                self.parse_order_book_sequence(data)
+            )
+        except NotImplementedError:
+            return None
+        except Exception as e:
+            logging.warning(f"Error fetching {symbol} order book from {self.name}: {e}")
+        return None
+
+
+class CoinbaseAdapter(ExchangeAdapter):
+    name = "Coinbase"
+    env_prefix = "COINBASE"
+    default_base_url = "https://api.coinbase.com"
+    default_book_base_url = "https://api.exchange.coinbase.com"
+
+    def ticker_request(self, symbol):
+        return f"/v2/prices/{symbol}-USD/spot", None
+
+    def parse_ticker(self, symbol, data):
+        return data["data"]["amount"]
+
+    def order_book_request(self, symbol, depth):
+        return f"/products/{symbol}-USD/book", {"level": 2}
+
+    def parse_order_book(self, symbol, data):
+        return data["bids"][:ORDER_BOOK_DEPTH], data["asks"][:ORDER_BOOK_DEPTH]
+
+    def parse_order_book_sequence(self, data):
+        return data.get("sequence")
+
+
+class CryptoComAdapter(ExchangeAdapter):
+    name = "Crypto.com"
+    env_prefix = "CRYPTO_COM"
+    default_base_url = "https://api.crypto.com"
+
+    def ticker_request(self, symbol):
+        return "/v2/public/get-ticker", {"instrument_name": f"{symbol}_USDT"}
+
+    def parse_ticker(self, symbol, data):
+        if data["code"] != 0 or "data" not in data["result"]:
+            raise ValueError(f"Unexpected API response structure: {data}")
+        for ticker in data["result"]["data"]:
+            if ticker["i"] == f"{symbol}_USDT":
+                return ticker["a"]  # 'a' is the last traded price
+        raise ValueError("Instrument not found in API response.")
+
+    def order_book_request(self, symbol, depth):
+        return "/v2/public/get-book", {"instrument_name": f"{symbol}_USDT", "depth": min(depth, 150)}
+
+    def parse_order_book(self, symbol, data):
+        if data["code"] != 0:
+            raise ValueError(f"Unexpected API response structure: {data}")
+        book = data["result"]["data"][0]
+        return book["bids"], book["asks"]
+
+
+class BinanceAdapter(ExchangeAdapter):
+    name = "Binance"
+    env_prefix = "BINANCE"
+    default_base_url = "https://api.binance.com"
+    default_stream_base_url = "wss://stream.binance.com:9443/ws"
+
+    def ticker_request(self, symbol):
+        return "/api/v3/ticker/price", {"symbol": f"{symbol}USDT"}
+
+    def parse_ticker(self, symbol, data):
+        return data["price"]
+
+    def order_book_request(self, symbol, depth):
+        return "/api/v3/depth", {"symbol": f"{symbol}USDT", "limit": depth}
+
+    def parse_order_book(self, symbol, data):
+        return data["bids"], data["asks"]
+
+    def parse_order_book_sequence(self, data):
+        return data.get("lastUpdateId")
+
+    def diff_stream_url(self, symbol):
+        if not self.stream_base_url:
+            return None
+        return f"{self.stream_base_url}/{symbol.lower()}usdt@depth@100ms"
+
+    def parse_diff(self, message):
+        # U/u are the first and last update ids in the event
+        if message.get("e") != "depthUpdate":
+            return None
+        return message["b"], message["a"], message["U"], message["u"]
+
+
+class KrakenAdapter(ExchangeAdapter):
+    name = "Kraken"
+    env_prefix = "KRAKEN"
+    default_base_url = "https://api.kraken.com"
+
+    # Kraken uses its own codes for some assets
+    asset_codes = {"BTC": "XBT", "DOGE": "XDG"}
+
+    def ticker_request(self, symbol):
+        return "/0/public/Ticker", {"pair": f"{self.asset_codes.get(symbol, symbol)}USD"}
+
+    def parse_ticker(self, symbol, data):
+        if data.get("error"):
+            raise ValueError(f"Kraken error: {data['error']}")
+        ticker = next(iter(data["result"].values()))
+        return ticker["c"][0]  # 'c' is [last trade price, lot volume]
+
+    def order_book_request(self, symbol, depth):
+        return "/0/public/Depth", {"pair": f"{self.asset_codes.get(symbol, symbol)}USD", "count": depth}
 
-@app.route("/update-settings", methods=["POST"])
-def update_settings():
+    def parse_order_book(self, symbol, data):
+        if data.get("error"):
+            raise ValueError(f"Kraken error: {data['error']}")
+        book = next(iter(data["result"].values()))
+        return book["bids"], book["asks"]
+
+
+# Exchange name -> adapter
+EXCHANGE_ADAPTERS = {}
+
+# Exchange name -> price fetcher used by the fan-out in fetch_quotes
+PRICE_FETCHERS = {}
+
+def register_exchange_adapter(adapter):
     """
-    Endpoint to update bot settings from the frontend.
+    Add an exchange to the price fan-out, the poller and the arbitrage scan,
+    with a token bucket at its RATE_LIMITS entry (or the adapter's rate_limit).
     """
-    global bot_settings
-    settings = request.json
+    RATE_LIMITS.setdefault(adapter.name, adapter.rate_limit)
+    if adapter.name not in rate_limiters:
+        rate_limiters[adapter.name] = TokenBucket(RATE_LIMITS[adapter.name])
+    EXCHANGE_ADAPTERS[adapter.name] = adapter
+    PRICE_FETCHERS[adapter.name] = adapter.fetch_price
+    return adapter
 
-    bot_settings["aggressionLevel"] = settings.get("aggressionLevel", bot_settings["aggressionLevel"])
-    bot_settings["riskTolerance"] = settings.get("riskTolerance", bot_settings["riskTolerance"])
-    bot_settings["buyLimit"] = settings.get("buyLimit", bot_settings["buyLimit"])
-    bot_settings["sellLimit"] = settings.get("sellLimit", bot_settings["sellLimit"])
-    bot_settings["maxLossLimit"] = settings.get("maxLossLimit", bot_settings["maxLossLimit"])
+for adapter in (CoinbaseAdapter(), CryptoComAdapter(), BinanceAdapter(), KrakenAdapter()):
+    register_exchange_adapter(adapter)
 
-    return jsonify({"success": True, "message": "Settings updated successfully."})
+# Symbols sampled by the background poller
+POLL_SYMBOLS = list(NETWORK_FEES.keys())
 
-def extract_crypto_name(query):
+def poll_prices_once():
     """
-    Extract a cryptocurrency name from a user query.
+    Sample every supported symbol on every exchange (and CoinGecko) concurrently
+    and write the results into the tick store and the quote cache.
     """
-    keywords = ["bitcoin", "ethereum", "dogecoin", "solana", "cardano"]
-    for word in keywords:
-        if word in query:
-            return word
-    return None
-
+    jobs = {}
+    for symbol in POLL_SYMBOLS:
+        for exchange, fetcher in PRICE_FETCHERS.items():
+            future = price_executor.submit(
+                call_upstream, exchange, symbol, lambda fetcher=fetcher, symbol=symbol: fetcher(symbol)
+            )
+            jobs[future] = (exchange, symbol)
+    coingecko_job = price_executor.submit(
+        call_upstream, "CoinGecko", tuple(sorted(COINGECKO_IDS)), lambda: fetch_coingecko_quotes(list(COINGECKO_IDS))
+    )
+    jobs[coingecko_job] = ("CoinGecko", None)
 
-def fetch_prices(crypto_name):
+    done, not_done = wait(jobs, timeout=PRICE_FETCH_DEADLINE)
+    now = time.time()
+    history = []
+    for future in done:
+        source, symbol = jobs[future]
+        try:
+            price = future.result()
+        except Exception as e:
+            logging.warning(f"Poll of {source} {symbol} failed: {e}")
+            continue
+        if future is coingecko_job:
+            for coin, quote in (price or {}).items():
+                tick_store.record(source, coin, quote["price"], now)
+                quote_cache.set(source, coin, quote)
+                history.append((source, coin, now, quote["price"], quote.get("volume_24h")))
+        elif price:
+            tick_store.record(source, symbol, price, now)
+            quote_cache.set(source, symbol, price)
+            history.append((source, symbol, now, price, None))
+    for future in not_done:
+        future.cancel()
+    if HISTORY_RECORD and history:
+        price_history.append_many(history)
+
+    scanned = scan_opportunities_once(now)
+    if BACKTEST_RECORD:
+        for symbol, price_data in scanned.items():
+            writer = tick_column_writers.get(symbol)
+            if writer is None:
+                writer = tick_column_writers[symbol] = TickColumnWriter(os.path.join(BACKTEST_DIR, symbol))
+            writer.append(now, price_data, list(EXCHANGE_ADAPTERS))
+    scan_arbitrage_cycles()
+    publish_poll_results(now)
+    if PORTFOLIO_ROLLUP_ENABLED:
+        try:
+            with app.app_context():
+                update_portfolio_rollups(now)
+        except Exception as e:
+            logging.warning(f"Portfolio rollup failed: {e}")
+    return len(done)
+
+# Portfolio value rollups: resolution -> bucket unit
+PORTFOLIO_ROLLUP_ENABLED = env_flag("PORTFOLIO_ROLLUP_ENABLED", True)
+PORTFOLIO_RESOLUTIONS = {"1m": "minute", "1h": "hour", "1d": "day"}
+PORTFOLIO_BUCKET_WIDTHS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+# 1m bars older than this are pruned; 1h and 1d bars are kept
+PORTFOLIO_MINUTE_RETENTION = timedelta(days=int(os.getenv("PORTFOLIO_MINUTE_RETENTION_DAYS", "7")))
+# Prices of the last poller rollup, so a tick only revalues holders of assets that moved
+portfolio_rollup_state = {"last_prune": 0.0, "prices": {}}
+
+def bucket_start(moment, unit):
+    """
+    Truncate a datetime to the start of its minute, hour or day.
+    """
+    moment = moment.replace(second=0, microsecond=0)
+    if unit in ("hour", "day"):
+        moment = moment.replace(minute=0)
+    if unit == "day":
+        moment = moment.replace(hour=0)
+    return moment
+
+def update_portfolio_rollups(timestamp=None, prices=None):
     """
-    Fetch live price data from Coinbase and Crypto.com.
+    Value wallet plus holdings and fold the result into the open 1m/1h/1d bars with one upsert.
+    Only users holding an asset whose CoinGecko tick moved since the last rollup, and users
+    queued in portfolio_rollup_queue by a balance change, are valued. Runs in the poller only.
+    Skipped unless every asset has a price. Returns the number of bars written.
     """
-    coinbase_price = fetch_coinbase_price(crypto_name)
-    print(f"Coinbase price for {crypto_name}: {coinbase_price}") 
-    crypto_com_price = fetch_crypto_com_price(crypto_name)
-    print(f"Crypto.com price for {crypto_name}: {crypto_com_price}")
+    timestamp = timestamp or time.time()
+    if prices is None:
+        prices = {symbol: tick_store.latest("CoinGecko", symbol, max_age=PRICE_TICK_MAX_AGE) for symbol in COINGECKO_IDS}
+    if any(prices.get(symbol) is None for symbol in COINGECKO_IDS):
+        return 0
 
-    prices = {}
-    if coinbase_price:
-        prices["Coinbase"] = round(coinbase_price, 2)
-    if crypto_com_price:
-        prices["Crypto.com"] = round(crypto_com_price, 2)
+    now = datetime.utcfromtimestamp(timestamp)
+    moved = [symbol for symbol in COINGECKO_IDS if portfolio_rollup_state["prices"].get(symbol) != prices[symbol]]
+    # Claimed in this transaction, so a failed rollup leaves the users queued
+    queued = db.session.execute(
+        text(f"DELETE FROM {PortfolioRollupQueue.__tablename__} RETURNING user_id")
+    ).scalars().all()
+    if not moved and not queued:
+        db.session.commit()
+        return 0
 
-    if not prices:
-        print("Failed to fetch prices from both sources.")
-        return None
+    params = {}
+    user_filters = []
+    if moved:
+        for i, symbol in enumerate(moved):
+            params[f"moved_{i}"] = symbol
+        user_filters.append(f"""u.id IN (
+                SELECT user_id FROM {Holding.__tablename__}
+                WHERE quantity <> 0 AND symbol IN ({", ".join(f":moved_{i}" for i in range(len(moved)))})
+            )""")
+    if queued:
+        for i, user_id in enumerate(queued):
+            params[f"user_{i}"] = user_id
+        user_filters.append(f"u.id IN ({', '.join(f':user_{i}' for i in range(len(queued)))})")
+
+    price_rows = []
+    for i, symbol in enumerate(COINGECKO_IDS):
+        params[f"symbol_{i}"] = symbol
+        params[f"price_{i}"] = prices[symbol]
+        price_rows.append(f"(:symbol_{i}, CAST(:price_{i} AS float))")
+    bucket_rows = []
+    for i, (resolution, unit) in enumerate(PORTFOLIO_RESOLUTIONS.items()):
+        params[f"resolution_{i}"] = resolution
+        params[f"bucket_{i}"] = bucket_start(now, unit)
+        bucket_rows.append(f"(:resolution_{i}, :bucket_{i})")
+
+    bar_table = PortfolioValueBar.__tablename__
+    result = db.session.execute(text(f"""
+        WITH prices (symbol, price) AS (VALUES {", ".join(price_rows)}),
+        buckets (resolution, bucket_start) AS (VALUES {", ".join(bucket_rows)}),
+        valued AS (
+            SELECT u.id AS user_id,
+                   COALESCE(u.wallet_balance, 0) + COALESCE(SUM(h.quantity * p.price), 0) AS value
+            FROM "{User.__tablename__}" u
+            LEFT JOIN {Holding.__tablename__} h ON h.user_id = u.id
+            LEFT JOIN prices p ON p.symbol = h.symbol
+            WHERE {" OR ".join(user_filters)}
+            GROUP BY u.id, u.wallet_balance
+        )
+        INSERT INTO {bar_table} (user_id, resolution, bucket_start, open, high, low, close)
+        SELECT v.user_id, b.resolution, b.bucket_start, v.value, v.value, v.value, v.value
+        FROM valued v CROSS JOIN buckets b
+        WHERE true
+        ON CONFLICT (user_id, resolution, bucket_start) DO UPDATE SET
+            high = CASE WHEN EXCLUDED.high > {bar_table}.high THEN EXCLUDED.high ELSE {bar_table}.high END,
+            low = CASE WHEN EXCLUDED.low < {bar_table}.low THEN EXCLUDED.low ELSE {bar_table}.low END,
+            close = EXCLUDED.close
+    """), params)
+
+    if timestamp - portfolio_rollup_state["last_prune"] >= 3600:
+        portfolio_rollup_state["last_prune"] = timestamp
+        db.session.query(PortfolioValueBar).filter(
+            PortfolioValueBar.resolution == "1m",
+            PortfolioValueBar.bucket_start < now - PORTFOLIO_MINUTE_RETENTION
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    portfolio_rollup_state["prices"] = dict(prices)
+    return result.rowcount
+
+def backfill_portfolio_rollups(since=None, user_ids=None):
+    """
+    Fill past 1m/1h/1d bars from the Transaction ledger and the CoinGecko price history.
+    Cash and holdings at each price sample are reconstructed backwards from the current
+    wallet and holdings by undoing later trades, so deposits and withdrawals are taken as
+    having happened before the backfilled range. Existing bars are kept.
+    Returns the number of bars offered for insertion.
+    """
+    histories = {symbol: price_history.range("CoinGecko", symbol, since) for symbol in COINGECKO_IDS}
+    if any(len(history) == 0 for history in histories.values()):
+        return 0
+    timeline = np.unique(np.concatenate([history["timestamp"] for history in histories.values()]))
+    # Price of every asset at every sample, carried forward; samples before an asset's first price are dropped
+    valid = np.ones(len(timeline), dtype=bool)
+    positions = {}
+    for symbol, history in histories.items():
+        positions[symbol] = np.searchsorted(history["timestamp"], timeline, side="right") - 1
+        valid &= positions[symbol] >= 0
+    timeline = timeline[valid]
+    prices = {symbol: histories[symbol]["price"][positions[symbol][valid]] for symbol in COINGECKO_IDS}
+    if not len(timeline):
+        return 0
 
-    return prices
+    users = db.select(User.id, User.wallet_balance)
+    if user_ids is not None:
+        users = users.where(User.id.in_(user_ids))
+    epoch = datetime(1970, 1, 1)
+    minute_cutoff = time.time() - PORTFOLIO_MINUTE_RETENTION.total_seconds()
+    count = 0
+    for user_id, wallet_balance in db.session.execute(users).all():
+        trades = db.session.execute(
+            db.select(Transaction.timestamp, Transaction.symbol, Transaction.amount, Transaction.total_value)
+            .where(Transaction.user_id == user_id, Transaction.timestamp > datetime.utcfromtimestamp(timeline[0]))
+            .order_by(Transaction.timestamp, Transaction.id)
+        ).all()
+        trade_times = np.array([(t.timestamp - epoch).total_seconds() for t in trades])
+        # Index of the first trade after each sample; everything from there on is undone
+        after = np.searchsorted(trade_times, timeline, side="right")
+
+        def undo(values):
+            suffix = np.concatenate([np.cumsum(np.asarray(values, dtype=float)[::-1])[::-1], [0.0]])
+            return suffix[after]
+
+        value = (wallet_balance or 0.0) + undo([t.total_value for t in trades])
+        holdings = get_holdings(user_id)
+        for symbol in COINGECKO_IDS:
+            quantity = holdings[symbol] - undo([t.amount if t.symbol == symbol else 0.0 for t in trades])
+            value = value + quantity * prices[symbol]
+
+        bars = []
+        for resolution, unit in PORTFOLIO_RESOLUTIONS.items():
+            width = PORTFOLIO_BUCKET_WIDTHS[unit].total_seconds()
+            keep = timeline >= minute_cutoff if unit == "minute" else np.ones(len(timeline), dtype=bool)
+            times, values = timeline[keep], value[keep]
+            if not len(times):
+                continue
+            buckets = np.floor(times / width)
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+            ends = np.concatenate([starts[1:] - 1, [len(times) - 1]])
+            highs = np.maximum.reduceat(values, starts)
+            lows = np.minimum.reduceat(values, starts)
+            for k, (first, last) in enumerate(zip(starts, ends)):
+                bars.append({
+                    "user_id": user_id, "resolution": resolution,
+                    "bucket_start": datetime.utcfromtimestamp(buckets[first] * width),
+                    "open": float(values[first]), "high": float(highs[k]),
+                    "low": float(lows[k]), "close": float(values[last])
+                })
+        if bars:
+            db.session.execute(text(f"""
+                INSERT INTO {PortfolioValueBar.__tablename__} (user_id, resolution, bucket_start, open, high, low, close)
+                VALUES (:user_id, :resolution, :bucket_start, :open, :high, :low, :close)
+                ON CONFLICT (user_id, resolution, bucket_start) DO NOTHING
+            """), bars)
+            db.session.commit()
+            count += len(bars)
+    return count
+
+def scan_opportunities_once(timestamp=None):
+    """
+    Evaluate every polled symbol across all venues from the latest ticks
+    and store the results in the opportunity index. Returns {symbol: prices} as scanned.
+    """
+    scanned = {}
+    for symbol in POLL_SYMBOLS:
+        price_data = {}
+        for exchange in PRICE_FETCHERS:
+            price = tick_store.latest(exchange, symbol, max_age=PRICE_TICK_MAX_AGE)
+            if price is not None:
+                price_data[exchange] = round(price, 2)
+        if not price_data:
+            continue
+        opportunities = find_arbitrage_opportunities(price_data, symbol)
+        opportunity_index.update(symbol, price_data, opportunities, timestamp)
+        scanned[symbol] = price_data
+    return scanned
 
-def fetch_coinbase_price(crypto_symbol):
+def scan_arbitrage_cycles():
     """
-    Fetch the spot price of a cryptocurrency from Coinbase.
-    Supports full names and symbols.
+    Feed the latest ticks into the arbitrage graph and look for a profitable cycle.
+    Only edges whose prices changed are re-relaxed.
     """
-    try:
-        symbol_map = {
-            "bitcoin": "BTC", "btc": "BTC",
-            "ethereum": "ETH", "eth": "ETH",
-            "dogecoin": "DOGE", "doge": "DOGE",
-            "solana": "SOL", "sol": "SOL",
-            "cardano": "ADA", "ada": "ADA"
-        }
+    global latest_arbitrage_cycle
+    for exchange, symbol in tick_store.keys():
+        if exchange not in EXCHANGE_ADAPTERS:
+            continue
+        price = tick_store.latest(exchange, symbol, max_age=PRICE_TICK_MAX_AGE)
+        if price:
+            update_arbitrage_graph(arbitrage_graph, exchange, symbol, "USD", price)
+
+    cycle = arbitrage_graph.find_cycle()
+    latest_arbitrage_cycle = dict(cycle, timestamp=time.time()) if cycle else None
+    if latest_arbitrage_cycle:
+        event_hub.publish("cycle", latest_arbitrage_cycle)
+    return latest_arbitrage_cycle
+
+# Opportunities seen in the previous poll, so only new ones are pushed
+last_published_opportunities = set()
+
+def publish_poll_results(timestamp):
+    """
+    Push the latest ticks and newly detected opportunities to stream subscribers.
+    One upstream sample is shared by every connected client.
+    """
+    global last_published_opportunities
+    if not event_hub.subscriber_count():
+        return
 
-        crypto_symbol = symbol_map.get(crypto_symbol.lower())
-        if not crypto_symbol:
-            print(f"Unsupported crypto symbol: {crypto_symbol}")
-            return None
+    current = set()
+    for symbol in POLL_SYMBOLS:
+        scan = opportunity_index.get(symbol)
+        if not scan:
+            continue
 
-        url = f"https://api.coinbase.com/v2/prices/{crypto_symbol}-USD/spot"
-        response = requests.get(url)
-        data = response.json()
+        event_hub.publish("tick", {"symbol": symbol, "timestamp": timestamp, "prices": scan["prices"]})
 
-        if response.status_code == 200:
-            return float(data["data"]["amount"])
-        else:
-            print("Error fetching data from Coinbase:", data)
-            return None
-    except Exception as e:
-        print("Error fetching price from Coinbase:", e)
-        return None
+        for opportunity in scan["opportunities"]:
+            key = (symbol, opportunity["buy_from"], opportunity["sell_to"])
+            current.add(key)
+            if key not in last_published_opportunities:
+                event_hub.publish("opportunity", {"symbol": symbol, "timestamp": timestamp, **opportunity})
 
+    last_published_opportunities = current
 
-def fetch_crypto_com_price(crypto_symbol):
+def poll_order_books_once():
     """
-    Fetch the last traded price of a cryptocurrency from Crypto.com public API.
+    Refresh the local order book of every polled symbol on every exchange from snapshots.
+    Books kept current by a live diff feed are skipped.
     """
-    try:
-        crypto_symbol = crypto_symbol.lower() 
-        # Map cryptocurrency names to Crypto.com trading symbols
-        symbol_map = {
-            "bitcoin": "BTC", "btc": "BTC",
-            "ethereum": "ETH", "eth": "ETH",
-            "dogecoin": "DOGE", "doge": "DOGE",
-            "solana": "SOL", "sol": "SOL",
-            "cardano": "ADA", "ada": "ADA"
-        }
-        crypto_code = symbol_map.get(crypto_symbol.lower())
-        if not crypto_code:
-            raise ValueError(f"Unsupported cryptocurrency: {crypto_symbol}")    
+    jobs = {}
+    for symbol in POLL_SYMBOLS:
+        for exchange, adapter in EXCHANGE_ADAPTERS.items():
+            if (exchange, symbol) in order_book_feeds and order_books.get(exchange, symbol, max_age=ORDER_BOOK_MAX_AGE):
+                continue
+            future = price_executor.submit(
+                call_upstream, exchange, ("book", symbol),
+                lambda adapter=adapter, symbol=symbol: adapter.fetch_order_book(symbol)
+            )
+            jobs[future] = (exchange, symbol)
 
-        # Public API endpoint
-        url = "https://api.crypto.com/v2/public/get-ticker"
-        
-        # Request parameters
-        params = {
-            "instrument_name": f"{crypto_code}_USDT"
-        }
+    done, not_done = wait(jobs, timeout=PRICE_FETCH_DEADLINE)
+    for future in done:
+        exchange, symbol = jobs[future]
+        try:
+            snapshot = future.result()
+        except Exception as e:
+            logging.warning(f"Order book poll of {exchange} {symbol} failed: {e}")
+            continue
+        if snapshot:
+            order_books.book(exchange, symbol).apply_snapshot(*snapshot)
+    for future in not_done:
+        future.cancel()
+    return len(done)
+
+# (exchange, symbol) -> thread running its order book diff feed
+order_book_feeds = {}
+
+def run_order_book_feed(adapter, symbol, stop=None):
+    """
+    Keep one local book current from the exchange's diff feed: connect, take a snapshot,
+    then apply each update. A sequence gap forces a fresh snapshot; a dropped connection
+    is retried. Runs until `stop` is set.
+    """
+    stop = stop or threading.Event()
+    book = order_books.book(adapter.name, symbol)
+    while not stop.is_set():
+        try:
+            conn = websocket.create_connection(adapter.diff_stream_url(symbol), timeout=ORDER_BOOK_FEED_TIMEOUT)
+            try:
+                # Updates arriving while the snapshot loads wait in the socket and are
+                # applied after it; those the snapshot already covers are ignored
+                resnapshot = True
+                while not stop.is_set():
+                    if resnapshot:
+                        snapshot = call_upstream(
+                            adapter.name, ("book", symbol), lambda: adapter.fetch_order_book(symbol)
+                        )
+                        if not snapshot or snapshot[2] is None:
+                            raise ValueError("no sequenced snapshot")
+                        book.apply_snapshot(*snapshot)
+                        resnapshot = False
+                    delta = adapter.parse_diff(json.loads(conn.recv()))
+                    if delta and not book.apply_delta(*delta):
+                        logging.info(f"{adapter.name} {symbol} book sequence gap, resnapshotting")
+                        resnapshot = True
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.warning(f"{adapter.name} {symbol} order book feed error: {e}")
+            stop.wait(ORDER_BOOK_FEED_TIMEOUT)
+
+def start_order_book_feeds():
+    """
+    Start a diff feed thread for every polled symbol on every exchange that has one.
+    """
+    if websocket is None or not ORDER_BOOK_FEEDS:
+        return
+    for symbol in POLL_SYMBOLS:
+        for exchange, adapter in EXCHANGE_ADAPTERS.items():
+            if (exchange, symbol) in order_book_feeds or not adapter.diff_stream_url(symbol):
+                continue
+            thread = threading.Thread(
+                target=run_order_book_feed, args=(adapter, symbol), name=f"book-feed-{exchange}-{symbol}", daemon=True
+            )
+            order_book_feeds[(exchange, symbol)] = thread
+            thread.start()
 
-        # Send GET request
-        response = requests.get(url, params=params)
-        print(f"API Response Status Code: {response.status_code}")  # Debugging
-        print(f"API Response Body: {response.text}")  # Debugging
-        response.raise_for_status()
-        
-        data = response.json()
-
-        # Debugging: Print the response to understand its structure
-        print("API Response JSON:", data)
-
-        # Extract and return the last traded price
-        if data["code"] == 0 and "data" in data["result"]:
-            tickers = data["result"]["data"]  # List of ticker entries
-            for ticker in tickers:
-                if ticker["i"] == f"{crypto_code}_USDT":
-                    last_price = float(ticker["a"])  # 'a' is the last traded price
-                    print(f"Last traded price for {crypto_symbol}: {last_price}")
-                    return last_price
-            raise ValueError("Instrument not found in API response.")
-        else:
-            raise ValueError(f"Unexpected API response structure: {data}")
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP error fetching Crypto.com price: {e.response.text}")
+def run_price_poller():
+    start_order_book_feeds()
+    if HISTORY_RECORD:
+        # Charts cover their full range from the first poll instead of filling up over weeks
+        try:
+            logging.info(f"Backfilled {backfill_price_history()} CoinGecko history records")
+        except Exception as e:
+            logging.warning(f"Price history backfill failed: {e}")
+    last_book_poll = 0.0
+    while True:
+        started = time.monotonic()
+        try:
+            poll_prices_once()
+            if started - last_book_poll >= ORDER_BOOK_INTERVAL:
+                last_book_poll = started
+                poll_order_books_once()
+            write_poller_snapshot(time.time())
+        except Exception as e:
+            logging.error(f"Price poller error: {e}")
+        time.sleep(max(0.0, PRICE_POLL_INTERVAL - (time.monotonic() - started)))
+
+def write_poller_snapshot(timestamp, path=None):
+    """
+    Publish the latest ticks, order books and arbitrage cycle for the other workers on this host.
+    Written to a temporary file and renamed, so followers never read a partial snapshot.
+    """
+    path = path or POLLER_SNAPSHOT_FILE
+    snapshot = {
+        "timestamp": timestamp,
+        "ticks": [
+            [exchange, symbol, *tick_store.latest_tick(exchange, symbol)]
+            for exchange, symbol in tick_store.keys()
+        ],
+        "books": [
+            [exchange, symbol, *book.levels(), book.sequence, book.updated_at]
+            for (exchange, symbol), book in order_books.items()
+            if book.updated_at
+        ],
+        "scans": opportunity_index.export(),
+        "cycle": latest_arbitrage_cycle
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".poller-snapshot-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def apply_poller_snapshot(snapshot):
+    """
+    Load a poller snapshot into this worker's tick store, order books and opportunity
+    index, and push the results to this worker's stream clients.
+    """
+    global latest_arbitrage_cycle
+    for exchange, symbol, timestamp, price in snapshot["ticks"]:
+        latest = tick_store.latest_tick(exchange, symbol)
+        if latest is None or timestamp > latest[0]:
+            tick_store.record(exchange, symbol, price, timestamp)
+    for exchange, symbol, bids, asks, sequence, updated_at in snapshot["books"]:
+        book = order_books.book(exchange, symbol)
+        if updated_at > book.updated_at:
+            book.apply_snapshot(bids, asks, sequence, updated_at=updated_at)
+
+    opportunity_index.load(snapshot["scans"])
+    latest_arbitrage_cycle = snapshot["cycle"]
+    if latest_arbitrage_cycle:
+        event_hub.publish("cycle", latest_arbitrage_cycle)
+    publish_poll_results(snapshot["timestamp"])
+
+def run_snapshot_follower():
+    """
+    Follow the poller's snapshot file until this process takes over polling itself.
+    """
+    last_mtime = None
+    while price_poller_thread is None:
+        started = time.monotonic()
+        try:
+            mtime = os.stat(POLLER_SNAPSHOT_FILE).st_mtime_ns
+            if mtime != last_mtime:
+                with open(POLLER_SNAPSHOT_FILE) as f:
+                    snapshot = json.load(f)
+                last_mtime = mtime
+                apply_poller_snapshot(snapshot)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Poller snapshot follower error: {e}")
+        time.sleep(max(0.0, PRICE_POLL_INTERVAL / 2 - (time.monotonic() - started)))
+
+price_poller_thread = None
+snapshot_follower_thread = None
+snapshot_follower_start_lock = threading.Lock()
+price_poller_state = {"lock_file": None, "last_attempt": 0.0}
+price_poller_start_lock = threading.Lock()
+
+def acquire_poller_lock():
+    """
+    Take the host-wide poller lock without blocking.
+    Returns the open lock file (keep it open to hold the lock), or None if another process polls.
+    """
+    lock_file = open(POLLER_LOCK_FILE, "a")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
         return None
-    except Exception as e:
-        print(f"Error fetching Crypto.com price: {e}")
+    return lock_file
+
+def start_price_poller():
+    """
+    Start the background price poller in this process if no other process on the host
+    is polling; otherwise follow that poller's snapshots. Retried at most every 30 seconds
+    so a worker can take over from a dead poller. Never started while replaying.
+    """
+    global price_poller_thread
+    if replaying():
+        return None
+    with price_poller_start_lock:
+        if price_poller_thread is not None or time.time() - price_poller_state["last_attempt"] < 30:
+            return price_poller_thread
+        price_poller_state["last_attempt"] = time.time()
+        lock_file = acquire_poller_lock()
+        if lock_file is None:
+            start_snapshot_follower()
+            return None
+        price_poller_state["lock_file"] = lock_file
+        price_poller_thread = threading.Thread(target=run_price_poller, name="price-poller", daemon=True)
+        price_poller_thread.start()
+        logging.info(f"Price poller started in process {os.getpid()} (every {PRICE_POLL_INTERVAL}s)")
+    return price_poller_thread
+
+def start_snapshot_follower():
+    """
+    Start following the poller's snapshot file in this process, once. Never started while replaying.
+    """
+    global snapshot_follower_thread
+    if replaying():
         return None
+    with snapshot_follower_start_lock:
+        if snapshot_follower_thread is None:
+            snapshot_follower_thread = threading.Thread(
+                target=run_snapshot_follower, name="snapshot-follower", daemon=True
+            )
+            snapshot_follower_thread.start()
+    return snapshot_follower_thread
+
+@app.before_request
+def ensure_price_poller():
+    # Started from the first request rather than on import, so CLI commands and importers never poll.
+    # Workers with polling disabled still follow the dedicated poller (`flask run-poller`)
+    if price_poller_thread is not None:
+        return
+    if PRICE_POLLER_ENABLED:
+        start_price_poller()
+    elif snapshot_follower_thread is None:
+        start_snapshot_follower()
 
 @app.route('/simulate_trade', methods=['POST'])
 def simulate_trade():
@@ -820,9 +3439,28 @@ def simulate_trade():
         if not simulated:
             return jsonify({"status": "error", "message": "Simulation failed. Check input or prices."}), 400
 
+        # Optional Monte Carlo run, e.g. "monte_carlo": {"paths": 20000, "seed": 7}
+        monte_carlo = None
+        if data.get("monte_carlo"):
+            options = data["monte_carlo"] if isinstance(data["monte_carlo"], dict) else {}
+            try:
+                monte_carlo = simulate_trade_paths(
+                    simulated,
+                    trade_amount,
+                    data["buy_from"],
+                    data["sell_to"],
+                    paths=int(options.get("paths", 10000)),
+                    seed=options.get("seed"),
+                    volatility=options.get("volatility"),
+                    budget_ms=options.get("budget_ms")
+                )
+            except (ValueError, TypeError):
+                return jsonify({"status": "error", "message": "Invalid Monte Carlo options"}), 400
+
         return jsonify({
             "status": "success",
             "simulated": True,
+            "monte_carlo": monte_carlo,
             "net_profit": round(simulated["net_profit"], 2),
             "gross_profit": round(simulated["gross_profit"], 2),
             "crypto_received": round(simulated["crypto_amount"], 6),
@@ -839,48 +3477,755 @@ def simulate_trade():
         print(f"❌ Simulation Error: {str(e)}")
         return jsonify({"status": "error", "message": f"Simulation error: {str(e)}"}), 500
 
-def find_arbitrage_opportunities(price_data):
-    opportunities = []
+def simulate_trade_paths(trade, amount, buy_exchange, sell_exchange, paths=10000, seed=None,
+                         volatility=None, budget_ms=None):
+    """
+    Monte Carlo distribution of the P&L of a trade from calculate_realistic_arbitrage.
+    Each path drifts the buy price over the buy exchange's latency and the sell price
+    over the combined latency (log-normal moves), then draws the fill against the
+    latency-based success probability; failed fills lose FAILED_TRADE_LOSS of the amount.
+
+    Paths run in vectorized batches, each with its own seeded RNG stream, so results
+    are reproducible. Batches stop once the time budget is spent.
+    """
+    volatility = MONTE_CARLO_VOLATILITY if volatility is None else volatility
+    budget = (MONTE_CARLO_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+    paths = max(1, min(int(paths), MONTE_CARLO_MAX_PATHS))
+
+    buy_latency = EXCHANGE_LATENCY.get(buy_exchange, 0.3)
+    buy_sigma = volatility * math.sqrt(buy_latency)
+    sell_sigma = volatility * math.sqrt(trade["latency"])
+    success_prob = float(trade_success_probability(trade["latency"]))
+    spend = amount - trade["fees"]["buy_fee"] - trade["fees"]["network_fee"] / 2
+    costs = trade["fees"]["sell_fee"] + trade["fees"]["network_fee"] / 2 + amount
+
+    n_batches = -(-paths // MONTE_CARLO_BATCH)
+    streams = np.random.SeedSequence(seed).spawn(n_batches)
+    started = time.perf_counter()
+    results = []
+    for i, stream in enumerate(streams):
+        rng = np.random.default_rng(stream)
+        size = min(MONTE_CARLO_BATCH, paths - i * MONTE_CARLO_BATCH)
+        buy_price = trade["effective_buy_price"] * np.exp(buy_sigma * rng.standard_normal(size))
+        sell_price = trade["effective_sell_price"] * np.exp(sell_sigma * rng.standard_normal(size))
+        pnl = spend / buy_price * sell_price - costs
+        filled = rng.random(size) < success_prob
+        results.append(np.where(filled, pnl, -amount * FAILED_TRADE_LOSS))
+        if time.perf_counter() - started > budget:
+            break
+
+    pnl = np.concatenate(results)
+    percentiles = np.percentile(pnl, [1, 5, 25, 50, 75, 95, 99])
+    return {
+        "paths": int(len(pnl)),
+        "requested_paths": paths,
+        "truncated": len(pnl) < paths,
+        "seed": seed,
+        "volatility": volatility,
+        "success_probability": round(success_prob, 4),
+        "mean": round(float(pnl.mean()), 4),
+        "std": round(float(pnl.std()), 4),
+        "probability_of_loss": round(float((pnl < 0).mean()), 4),
+        "percentiles": {
+            f"p{q}": round(float(v), 4) for q, v in zip((1, 5, 25, 50, 75, 95, 99), percentiles)
+        },
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+def arbitrage_matrix(price_data, crypto_symbol, amounts):
+    """
+    Evaluate calculate_realistic_arbitrage for every (buy exchange, sell exchange, trade size)
+    in one vectorized pass. Arrays are indexed [buy, sell, amount]; pairs of an exchange
+    with itself are masked out of "valid".
+    """
     exchanges = list(price_data.keys())
+    prices = np.array([price_data[e] for e in exchanges], dtype=float)
+    fee_pcts = np.array([EXCHANGE_FEES.get(e, 0.005) for e in exchanges])
+    latencies = np.array([EXCHANGE_LATENCY.get(e, 0.3) for e in exchanges])
+    amounts = np.atleast_1d(np.asarray(amounts, dtype=float))
+    network_fee = network_fee_for(crypto_symbol)
+
+    slippage = np.clip(amounts / SLIPPAGE_SCALE, SLIPPAGE_MIN, SLIPPAGE_MAX)
+    buy_fee = fee_pcts[:, None, None] * amounts
+    sell_fee = fee_pcts[None, :, None] * amounts
+    effective_buy_price = prices[:, None, None] * (1 + slippage)
+    effective_sell_price = prices[None, :, None] * (1 - slippage)
+
+    crypto_amount = (amounts - buy_fee - network_fee) / effective_buy_price
+    proceeds = crypto_amount * effective_sell_price - sell_fee - network_fee
+    net_profit = proceeds - amounts
+
+    n = len(exchanges)
+    shape = (n, n, len(amounts))
+    return {
+        "exchanges": exchanges,
+        "amounts": amounts,
+        "valid": np.broadcast_to(~np.eye(n, dtype=bool)[:, :, None], shape),
+        "gross_profit": prices[None, :] - prices[:, None],
+        "net_profit": net_profit,
+        "buy_fee": np.broadcast_to(buy_fee, shape),
+        "sell_fee": np.broadcast_to(sell_fee, shape),
+        "network_fee": network_fee * 2,
+        "slippage": slippage * 100,
+        "latency": latencies[:, None] + latencies[None, :],
+        "effective_buy_price": np.broadcast_to(effective_buy_price, shape),
+        "effective_sell_price": np.broadcast_to(effective_sell_price, shape),
+        "crypto_amount": np.broadcast_to(crypto_amount, shape)
+    }
 
-    for i in range(len(exchanges)):
-        for j in range(len(exchanges)):
-            if i == j:
-                continue
+class ArbitrageGraph:
+    """
+    Directed graph over (exchange, asset) nodes whose edge weights are -log(rate).
+    A negative cycle is a sequence of trades and transfers that ends with more of
+    the starting asset than it began with.
+
+    Shortest-path labels from a virtual source are kept between updates (SPFA style),
+    so changing one edge only re-relaxes the part of the graph it affects instead of
+    running Bellman-Ford from scratch on every tick. The predecessor tree is kept
+    with its children lists so that invalidating a subtree costs only its size.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.nodes = []
+        self.out_edges = []
+        self.in_edges = []
+        self.dist = []
+        self.pred = []
+        self.children = []
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def node_id(self, node):
+        i = self.index.get(node)
+        if i is None:
+            i = self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.out_edges.append({})
+            self.in_edges.append(set())
+            self.dist.append(0.0)
+            self.pred.append(None)
+            self.children.append(set())
+        return i
+
+    def _set_pred(self, i, p):
+        old = self.pred[i]
+        if old == p:
+            return
+        if old is not None:
+            self.children[old].discard(i)
+        if p is not None:
+            self.children[p].add(i)
+        self.pred[i] = p
+
+    def set_rate(self, u, v, rate):
+        """
+        Set the conversion rate from node u to node v (units of v per unit of u).
+        A rate of 0 or less removes the edge.
+        """
+        with self._lock:
+            ui, vi = self.node_id(u), self.node_id(v)
+            old = self.out_edges[ui].get(vi)
+            if rate <= 0:
+                if old is None:
+                    return
+                del self.out_edges[ui][vi]
+                self.in_edges[vi].discard(ui)
+                if self.pred[vi] == ui:
+                    self._invalidate(vi)
+                return
+
+            weight = -math.log(rate)
+            if old is not None and abs(weight - old) < 1e-15:
+                return
+            self.out_edges[ui][vi] = weight
+            self.in_edges[vi].add(ui)
+            if old is None or weight < old:
+                self._pending.add(ui)
+            elif self.pred[vi] == ui:
+                self._invalidate(vi)
+
+    def _invalidate(self, *roots):
+        # The labels below the roots were derived through an edge that got worse
+        # (or around a negative cycle): reset those subtrees to the virtual source
+        # and re-relax into them
+        stack = list(roots)
+        seen = set(roots)
+        while stack:
+            i = stack.pop()
+            for child in self.children[i]:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+            self.dist[i] = 0.0
+            self._pending.update(self.in_edges[i])
+        for i in seen:
+            self._set_pred(i, None)
+
+    def _reset(self):
+        self.dist = [0.0] * len(self.nodes)
+        self.pred = [None] * len(self.nodes)
+        self.children = [set() for _ in self.nodes]
+        self._pending = set(range(len(self.nodes)))
+
+    def _extract_cycle(self, start):
+        n = len(self.nodes)
+        i = start
+        for _ in range(n):
+            i = self.pred[i]
+            if i is None:
+                return None
+        cycle = [i]
+        j = self.pred[i]
+        while j != i:
+            if j is None or len(cycle) > n:
+                return None
+            cycle.append(j)
+            j = self.pred[j]
+        cycle.reverse()
+        cycle.append(cycle[0])
+        return cycle
+
+    def _describe_cycle(self, cycle):
+        weight = sum(self.out_edges[a][b] for a, b in zip(cycle, cycle[1:]))
+        return {
+            "path": [list(self.nodes[k]) for k in cycle],
+            "rate": math.exp(-weight),
+            "profit_pct": round((math.exp(-weight) - 1) * 100, 6)
+        }
+
+    def find_cycle(self):
+        """
+        Re-relax from the edges changed since the last call and return a
+        negative cycle as {"path", "rate", "profit_pct"}, or None.
+        """
+        with self._lock:
+            n = len(self.nodes)
+            queue_ = deque(self._pending)
+            in_queue = set(self._pending)
+            self._pending = set()
+            relaxations = {}
+
+            while queue_:
+                u = queue_.popleft()
+                in_queue.discard(u)
+                du = self.dist[u]
+                for v, w in self.out_edges[u].items():
+                    if du + w < self.dist[v] - 1e-12:
+                        self.dist[v] = du + w
+                        self._set_pred(v, u)
+                        relaxations[v] = relaxations.get(v, 0) + 1
+                        if relaxations[v] >= n:
+                            cycle = self._extract_cycle(v)
+                            if cycle is None:
+                                self._reset()
+                                return None
+                            # Labels around a negative cycle are unbounded: reset only the
+                            # cycle and what was reached through it, and finish the rest of
+                            # this pass next time
+                            self._pending.update(queue_)
+                            self._invalidate(*cycle[:-1])
+                            return self._describe_cycle(cycle)
+                        if v not in in_queue:
+                            in_queue.add(v)
+                            queue_.append(v)
+            return None
 
-            buy_exchange = exchanges[i]
-            sell_exchange = exchanges[j]
-            buy_price = price_data[buy_exchange]
-            sell_price = price_data[sell_exchange]
 
-            if sell_price > buy_price:
-                realistic = calculate_realistic_arbitrage(
-                    buy_exchange, sell_exchange, "BTC", 1000, price_data
-                )
+def update_arbitrage_graph(graph, exchange, base, quote, price, notional=None):
+    """
+    Add or refresh the trade edges for one market (base priced in quote) on an exchange,
+    and the transfer edges that move base between this exchange and the others.
+    Fees come from EXCHANGE_FEES; network fees from NETWORK_FEES as a fraction of notional.
+    """
+    fee = EXCHANGE_FEES.get(exchange, 0.005)
+    graph.set_rate((exchange, base), (exchange, quote), price * (1 - fee))
+    graph.set_rate((exchange, quote), (exchange, base), (1 - fee) / price)
+
+    notional = notional or GRAPH_NOTIONAL_USD
+    for asset in (base, quote):
+        transfer_rate = 1 - NETWORK_FEES.get(asset, 0.0) / notional
+        for other in EXCHANGE_ADAPTERS:
+            if other != exchange:
+                graph.set_rate((exchange, asset), (other, asset), transfer_rate)
+                graph.set_rate((other, asset), (exchange, asset), transfer_rate)
+
+
+# Multi-leg arbitrage graph over every polled exchange and symbol
+arbitrage_graph = ArbitrageGraph()
+latest_arbitrage_cycle = None
+
+def find_arbitrage_opportunities(price_data, crypto_symbol="BTC", amount=1000):
+    """
+    Screen every exchange pair with the vectorized ticker model, then re-price the
+    candidates through calculate_realistic_arbitrage so pairs with fresh order books
+    are valued exactly as /execute_trade would settle them.
+    """
+    matrix = arbitrage_matrix(price_data, crypto_symbol, [amount])
+    exchanges = matrix["exchanges"]
+    net_profit = matrix["net_profit"][:, :, 0]
+    candidates = matrix["valid"][:, :, 0] & (matrix["gross_profit"] > 0)
+
+    network_fee = network_fee_for(crypto_symbol)
+    opportunities = []
+    for i, j in zip(*np.nonzero(candidates)):
+        buy_fee = float(matrix["buy_fee"][i, j, 0])
+        sell_fee = float(matrix["sell_fee"][i, j, 0])
+        opportunity = {
+            "buy_from": exchanges[i],
+            "sell_to": exchanges[j],
+            "lowest_price": price_data[exchanges[i]],
+            "highest_price": price_data[exchanges[j]],
+            "gross_profit": float(matrix["gross_profit"][i, j]),
+            "net_profit": float(net_profit[i, j]),
+            "fees": {
+                "buy_fee": buy_fee,
+                "sell_fee": sell_fee,
+                "network_fee": matrix["network_fee"],
+                "total_fees": buy_fee + sell_fee + matrix["network_fee"]
+            },
+            "slippage": float(matrix["slippage"][0]),
+            "latency": float(matrix["latency"][i, j]),
+            "effective_prices": {
+                "buy": float(matrix["effective_buy_price"][i, j, 0]),
+                "sell": float(matrix["effective_sell_price"][i, j, 0])
+            },
+            "priced_from": "ticker"
+        }
 
-                if realistic and realistic["net_profit"] > 0:
-                    percentage_diff = (realistic["net_profit"] / 1000) * 100
-                    opportunities.append({
-                        "buy_from": buy_exchange,
-                        "sell_to": sell_exchange,
-                        "lowest_price": buy_price,
-                        "highest_price": sell_price,
-                        "gross_profit": sell_price - buy_price,
-                        "net_profit": realistic["net_profit"],
-                        "percentage_diff": round(percentage_diff, 4),
-                        "fees": realistic["fees"],
-                        "slippage": realistic["slippage"],
-                        "latency": realistic["latency"],
-                        "effective_prices": {
-                            "buy": realistic["effective_buy_price"],
-                            "sell": realistic["effective_sell_price"]
-                        }
-                    })
+        realistic = calculate_realistic_arbitrage(exchanges[i], exchanges[j], crypto_symbol, amount, price_data)
+        if realistic and realistic["priced_from"] == "order_book":
+            opportunity.update({
+                "net_profit": realistic["net_profit"],
+                "fees": realistic["fees"],
+                "slippage": realistic["slippage"],
+                "effective_prices": {
+                    "buy": realistic["effective_buy_price"],
+                    "sell": realistic["effective_sell_price"]
+                },
+                "priced_from": "order_book"
+            })
+        if opportunity["net_profit"] <= 0:
+            continue
+
+        opportunity["percentage_diff"] = round(opportunity["net_profit"] / amount * 100, 4)
+        # Sized with the ticker model; book depth is reflected in net_profit above
+        opportunity["optimal_size"] = optimal_trade_size(
+            price_data[exchanges[i]],
+            price_data[exchanges[j]],
+            EXCHANGE_FEES.get(exchanges[i], 0.005),
+            EXCHANGE_FEES.get(exchanges[j], 0.005),
+            network_fee
+        )
+        opportunities.append(opportunity)
 
     opportunities.sort(key=lambda x: x["net_profit"], reverse=True)
     return opportunities
 
 
+class TickColumnWriter:
+    """
+    Appends aligned price snapshots for one symbol to a columnar directory:
+    timestamp.f64 plus one <exchange>.f64 column per venue, each a flat array of
+    little-endian float64 values (NaN where a venue had no price).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def column_path(self, name):
+        return os.path.join(self.directory, f"{name}.f64")
+
+    def rows(self):
+        path = self.column_path("timestamp")
+        return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+    def columns(self):
+        return [
+            name[:-4] for name in os.listdir(self.directory)
+            if name.endswith(".f64") and name != "timestamp.f64"
+        ]
+
+    def append(self, timestamp, price_data, exchanges):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            rows = self.rows()
+            # Venues no longer registered keep growing with NaN so every column stays aligned
+            for exchange in set(exchanges).union(self.columns()):
+                path = self.column_path(exchange)
+                written = os.path.getsize(path) // 8 if os.path.exists(path) else 0
+                with open(path, "ab") as f:
+                    if written > rows:
+                        # Left over from an append that stopped before its timestamp
+                        f.truncate(rows * 8)
+                    elif written < rows:
+                        # A venue added later starts with NaN for the rows it missed
+                        f.write(np.full(rows - written, np.nan, dtype="<f8").tobytes())
+                    f.write(np.array([price_data.get(exchange, np.nan)], dtype="<f8").tobytes())
+            with open(self.column_path("timestamp"), "ab") as f:
+                f.write(np.array([timestamp], dtype="<f8").tobytes())
+
+
+# Symbol -> columnar recorder used when BACKTEST_RECORD is on
+tick_column_writers = {}
+
+
+def read_tick_columns(symbol, directory=None):
+    """
+    Memory-map the recorded columns of a symbol: returns (timestamps, {exchange: prices}).
+    """
+    directory = os.path.join(directory or BACKTEST_DIR, symbol)
+    timestamps = np.memmap(os.path.join(directory, "timestamp.f64"), dtype="<f8", mode="r")
+    columns = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".f64") and name != "timestamp.f64":
+            column = np.memmap(os.path.join(directory, name), dtype="<f8", mode="r")
+            columns[name[:-4]] = column[:len(timestamps)]
+    return timestamps, columns
+
+
+def run_backtest(symbol, amount=1000, directory=None, exchange_fees=None, exchange_latency=None,
+                 seed=None, chunk_size=1_000_000, curve_points=500):
+    """
+    Replay recorded ticks through the calculate_realistic_arbitrage economics.
+    At every tick the best profitable exchange pair is traded; the fill is drawn
+    against the latency-based success probability, and a failed fill loses
+    FAILED_TRADE_LOSS of the amount. Ticks are evaluated in vectorized chunks.
+    Fee and latency tables can be overridden to tune assumptions offline.
+    """
+    exchange_fees = exchange_fees or EXCHANGE_FEES
+    exchange_latency = exchange_latency or EXCHANGE_LATENCY
+    timestamps, columns = read_tick_columns(symbol, directory)
+    exchanges = list(columns.keys())
+    n_rows = len(timestamps)
+
+    fee_pcts = np.array([exchange_fees.get(e, 0.005) for e in exchanges])
+    latencies = np.array([exchange_latency.get(e, 0.3) for e in exchanges])
+    pair_success = trade_success_probability(latencies[:, None] + latencies[None, :])
+    network_fee = network_fee_for(symbol)
+    slippage = slippage_for_amount(amount)
+    off_diagonal = ~np.eye(len(exchanges), dtype=bool)
+    rng = np.random.default_rng(seed)
+
+    stride = max(1, n_rows // curve_points)
+    curve_timestamps, curve_equity = [], []
+    equity = 0.0
+    peak = 0.0
+    max_drawdown = 0.0
+    trades = 0
+    successes = 0
+    pair_counts = np.zeros((len(exchanges), len(exchanges)), dtype=np.int64)
+
+    for start in range(0, n_rows, chunk_size):
+        end = min(start + chunk_size, n_rows)
+        prices = np.column_stack([columns[e][start:end] for e in exchanges])
+
+        buy = prices[:, :, None]
+        sell = prices[:, None, :]
+        crypto_amount = (amount - amount * fee_pcts[:, None] - network_fee) / (buy * (1 + slippage))
+        net_profit = crypto_amount * sell * (1 - slippage) - amount * fee_pcts[None, :] - network_fee - amount
+        net_profit = np.where(off_diagonal & (sell > buy) & ~np.isnan(net_profit), net_profit, -np.inf)
+
+        flat = net_profit.reshape(len(prices), -1)
+        best = flat.argmax(axis=1)
+        best_profit = flat[np.arange(len(prices)), best]
+        traded = best_profit > 0
+        buy_idx, sell_idx = np.divmod(best, len(exchanges))
+
+        filled = rng.random(len(prices)) < pair_success[buy_idx, sell_idx]
+        pnl = np.where(traded, np.where(filled, best_profit, -amount * FAILED_TRADE_LOSS), 0.0)
+
+        chunk_equity = equity + np.cumsum(pnl)
+        chunk_peak = np.maximum.accumulate(np.concatenate(([peak], chunk_equity)))[1:]
+        max_drawdown = max(max_drawdown, float(np.max(chunk_peak - chunk_equity, initial=0.0)))
+        if len(chunk_equity):
+            equity = float(chunk_equity[-1])
+            peak = float(chunk_peak[-1])
+
+        trades += int(traded.sum())
+        successes += int((traded & filled).sum())
+        np.add.at(pair_counts, (buy_idx[traded], sell_idx[traded]), 1)
+
+        sample = np.arange((-start) % stride, end - start, stride)
+        curve_timestamps.extend(timestamps[start:end][sample].tolist())
+        curve_equity.extend(chunk_equity[sample].tolist())
+
+    return {
+        "symbol": symbol,
+        "amount": amount,
+        "ticks": n_rows,
+        "trades": trades,
+        "successes": successes,
+        "hit_rate": round(successes / trades, 4) if trades else 0,
+        "total_pnl": round(equity, 2),
+        "max_drawdown": round(max_drawdown, 2),
+        "pairs": {
+            f"{exchanges[i]}->{exchanges[j]}": int(pair_counts[i, j])
+            for i, j in zip(*np.nonzero(pair_counts))
+        },
+        "pnl_curve": {"timestamps": curve_timestamps, "equity": curve_equity}
+    }
+
+
+class PriceHistoryStore:
+    """
+    Append-only price history per (exchange, symbol): fixed-width little-endian
+    (timestamp, price, volume) float64 records in <directory>/<exchange>/<symbol>.bin,
+    read back as memory-mapped NumPy record arrays. Volume is NaN when unknown.
+    Older records from a backfill are merged in by rewriting the file and renaming it into place.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._maps = {}
+
+    def path(self, exchange, symbol):
+        return os.path.join(self.directory, exchange, f"{symbol}.bin")
+
+    def append_many(self, records):
+        """
+        Append (exchange, symbol, timestamp, price, volume) tuples and return how many were written.
+        Each file is appended under an exclusive flock after re-reading its last record from disk,
+        so concurrent writers cannot interleave; rows not newer than that record are rejected.
+        """
+        grouped = {}
+        for exchange, symbol, timestamp, price, volume in records:
+            grouped.setdefault((exchange, symbol), []).append(
+                (timestamp, price, np.nan if volume is None else volume)
+            )
+        written = 0
+        with self._lock:
+            for (exchange, symbol), rows in grouped.items():
+                path = self.path(exchange, symbol)
+                with self._locked_file(path) as f:
+                    written += self._append_locked(f, path, sorted(rows))
+        return written
+
+    @contextmanager
+    def _locked_file(self, path):
+        # Exclusive flock on the file currently at path; retried if a merge replaced it meanwhile
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        while True:
+            f = open(path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                break
+            f.close()
+        try:
+            yield f
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def merge(self, exchange, symbol, rows):
+        """
+        Add (timestamp, price, volume) rows falling outside the span already stored, such as
+        a backfill from before recording started. Returns how many rows were added.
+        """
+        path = self.path(exchange, symbol)
+        with self._lock, self._locked_file(path) as f:
+            itemsize = HISTORY_RECORD_DTYPE.itemsize
+            size = os.fstat(f.fileno()).st_size
+            f.seek(0)
+            existing = np.frombuffer(f.read(size - size % itemsize), HISTORY_RECORD_DTYPE)
+            new = np.array(
+                [(t, p, np.nan if v is None else v) for t, p, v in rows], dtype=HISTORY_RECORD_DTYPE
+            )
+            if len(existing):
+                span = (new["timestamp"] < existing["timestamp"][0]) | (new["timestamp"] > existing["timestamp"][-1])
+                new = new[span]
+            if not len(new):
+                return 0
+            merged = np.concatenate([existing, new])
+            merged = merged[np.argsort(merged["timestamp"], kind="stable")]
+            merged = merged[np.concatenate([[True], np.diff(merged["timestamp"]) > 0])]
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{symbol}-")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    out.write(merged.tobytes())
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            return len(merged) - len(existing)
+
+    def _append_locked(self, f, path, rows):
+        itemsize = HISTORY_RECORD_DTYPE.itemsize
+        size = os.fstat(f.fileno()).st_size
+        if size % itemsize:
+            # Drop a torn trailing record left by a writer that died mid-append
+            logging.warning(f"Truncating partial record at the end of {path}")
+            size -= size % itemsize
+            f.truncate(size)
+        last = -math.inf
+        if size:
+            f.seek(size - itemsize)
+            last = np.frombuffer(f.read(itemsize), HISTORY_RECORD_DTYPE)[0]["timestamp"]
+        accepted = [row for row in rows if row[0] > last]
+        if len(accepted) < len(rows):
+            logging.warning(f"Rejected {len(rows) - len(accepted)} out-of-order records for {path}")
+        # Keep strictly increasing timestamps within the batch as well
+        accepted = [row for i, row in enumerate(accepted) if i == 0 or row[0] > accepted[i - 1][0]]
+        if accepted:
+            f.seek(size)
+            f.write(np.array(accepted, dtype=HISTORY_RECORD_DTYPE).tobytes())
+            f.flush()
+        return len(accepted)
+
+    def records(self, exchange, symbol):
+        """
+        All records for (exchange, symbol) as a read-only memmap; remapped when the file grows.
+        """
+        path = self.path(exchange, symbol)
+        count = os.path.getsize(path) // HISTORY_RECORD_DTYPE.itemsize if os.path.exists(path) else 0
+        if count == 0:
+            return np.empty(0, dtype=HISTORY_RECORD_DTYPE)
+        with self._lock:
+            mapped = self._maps.get(path)
+            if mapped is None or len(mapped) != count:
+                mapped = np.memmap(path, dtype=HISTORY_RECORD_DTYPE, mode="r", shape=(count,))
+                self._maps[path] = mapped
+        return mapped
+
+    def range(self, exchange, symbol, start=None, end=None):
+        """
+        Zero-copy view of the records with start <= timestamp <= end.
+        """
+        records = self.records(exchange, symbol)
+        timestamps = records["timestamp"]
+        lo = np.searchsorted(timestamps, start, side="left") if start is not None else 0
+        hi = np.searchsorted(timestamps, end, side="right") if end is not None else len(records)
+        return records[lo:hi]
+
+
+price_history = PriceHistoryStore(HISTORY_DIR)
+
+
+def fetch_coingecko_history(symbol, start, end):
+    """
+    Fetch (timestamp, price, volume) rows for a symbol between two unix times from CoinGecko
+    (5-minute points for ranges up to a day, hourly up to 90 days).
+    """
+    data = http_get_json(
+        "CoinGecko",
+        f"https://api.coingecko.com/api/v3/coins/{COINGECKO_IDS[symbol]}/market_chart/range",
+        params={"vs_currency": "usd", "from": int(start), "to": int(end)},
+        timeout=10
+    )
+    volumes = {ms: volume for ms, volume in data.get("total_volumes", [])}
+    return [(ms / 1000.0, price, volumes.get(ms)) for ms, price in data.get("prices", [])]
+
+def backfill_price_history(days=None, now=None):
+    """
+    Merge CoinGecko history into the local store for every asset whose recording does not
+    reach back `days`, or whose latest record is over an hour old. Returns rows added.
+    """
+    days = HISTORY_BACKFILL_DAYS if days is None else days
+    now = now or time.time()
+    start = now - days * 86400
+    added = 0
+    for symbol in COINGECKO_IDS:
+        records = price_history.records("CoinGecko", symbol)
+        if len(records) and records["timestamp"][0] <= start + 3600 and records["timestamp"][-1] >= now - 3600:
+            continue
+        rows = call_upstream(
+            "CoinGecko", ("history", symbol, int(start)), lambda symbol=symbol: fetch_coingecko_history(symbol, start, now)
+        )
+        if rows:
+            added += price_history.merge("CoinGecko", symbol, rows)
+    return added
+
+
+def lttb_indices(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets: indices of `points` samples that keep the visual shape of y(x).
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    # points - 2 buckets over the interior samples; the first and last samples are always kept
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def minmax_indices(y, points):
+    """
+    Min/max bucketing: the indices of the lowest and highest sample in each of points // 2 buckets.
+    """
+    n = len(y)
+    buckets = max(1, points // 2)
+    if points >= n:
+        return np.arange(n)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            window = y[start:end]
+            selected.extend(sorted({start + int(np.argmin(window)), start + int(np.argmax(window))}))
+    return np.array(selected, dtype=np.int64)
+
+@app.route("/history", methods=["GET"])
+def get_history():
+    """
+    Price history for one exchange and symbol from the local store, downsampled server-side.
+    Query params: exchange (default CoinGecko), symbol, start/end (unix seconds, default last 24h),
+    points (default 500), method (lttb or minmax).
+    """
+    exchange = request.args.get("exchange", "CoinGecko")
+    symbol = normalize_symbol(request.args.get("symbol", "BTC")) or request.args.get("symbol", "").upper()
+    method = request.args.get("method", "lttb").lower()
+    if exchange != "CoinGecko" and exchange not in PRICE_FETCHERS:
+        return jsonify({"error": f"Unknown exchange {exchange}"}), 400
+    if symbol not in COINGECKO_IDS and symbol not in POLL_SYMBOLS:
+        return jsonify({"error": f"Unsupported symbol {symbol}"}), 400
+    if method not in ("lttb", "minmax"):
+        return jsonify({"error": "method must be lttb or minmax"}), 400
+    try:
+        end = float(request.args["end"]) if request.args.get("end") else time.time()
+        start = float(request.args["start"]) if request.args.get("start") else end - 86400
+        points = min(HISTORY_MAX_POINTS, max(3, int(request.args.get("points", 500))))
+    except ValueError:
+        return jsonify({"error": "Invalid start, end or points"}), 400
+
+    records = price_history.range(exchange, symbol, start, end)
+    timestamps, prices = records["timestamp"], records["price"]
+    if method == "lttb":
+        indices = lttb_indices(timestamps, prices, points)
+    else:
+        indices = minmax_indices(prices, points)
+    sampled = records[indices]
+
+    return jsonify({
+        "exchange": exchange,
+        "symbol": symbol,
+        "method": method,
+        "count": len(records),
+        "points": [
+            {"timestamp": timestamp, "price": price, "volume": None if math.isnan(volume) else volume}
+            for timestamp, price, volume in sampled.tolist()
+        ]
+    })
+
+
 def generate_gpt_response(prompt):
     """
     Generate a response from GPT model.
@@ -929,7 +4274,7 @@ def get_trade_feedback():
         """
 
         # Send the request to the OpenAI chat completions endpoint
-        response = openai.ChatCompletion.create(
+        response = create_chat_completion(
             model="gpt-4",  # Use the latest chat model
             messages=[
                 {"role": "system", "content": "You are a financial advisor."},
@@ -957,7 +4302,7 @@ def ask():
             return jsonify({"error": "Query is required"}), 400
 
         # Call OpenAI's GPT-3.5-turbo model to get a response
-        response = openai.ChatCompletion.create(
+        response = create_chat_completion(
             model="gpt-3.5-turbo",  # Use GPT-3.5-turbo model
             messages=[
                 {"role": "system", "content": "You are a knowledgeable financial advisor."},
@@ -977,6 +4322,10 @@ def ask():
 
 
 def scrape_reddit_bitcoin():
+    return recorded_call("Reddit", ["Bitcoin", "new", 25], fetch_reddit_bitcoin_posts)
+
+
+def fetch_reddit_bitcoin_posts():
     logging.info("Starting Reddit Scraping...")
     subreddit = reddit.subreddit("Bitcoin")
     posts = subreddit.new(limit=25)  # Fetch latest 25 posts
@@ -1063,7 +4412,7 @@ Date: {post['created']}
 """
         })
 
-    response = openai.ChatCompletion.create(
+    response = create_chat_completion(
         model="gpt-3.5-turbo",
         messages=messages
     )
@@ -1171,6 +4520,155 @@ def get_sentiment():
     return jsonify(response)
 
 
+@app.cli.command("migrate-holdings")
+def migrate_holdings_command():
+    """
+    Create the holding and portfolio tables, copy the legacy per-coin User balances
+    into holdings and build portfolio_position from the ledger.
+    Safe to re-run: existing holdings are left untouched and positions are rebuilt.
+    """
+    db.create_all()
+    legacy_columns = {"BTC": "btc_balance", "ETH": "eth_balance", "LTC": "ltc_balance", "SOL": "sol_balance"}
+    selects = " UNION ALL ".join(
+        f"SELECT id, '{symbol}', {column} FROM \"{User.__tablename__}\" WHERE COALESCE({column}, 0) <> 0"
+        for symbol, column in legacy_columns.items()
+    )
+    result = db.session.execute(text(f"""
+        INSERT INTO {Holding.__tablename__} (user_id, symbol, quantity)
+        {selects}
+        ON CONFLICT (user_id, symbol) DO NOTHING
+    """))
+    db.session.commit()
+    print(f"Migrated {result.rowcount} holdings")
+    print(f"Rebuilt portfolio positions from {rebuild_portfolio_positions()} transactions")
+
+
+def rebuild_portfolio_positions(batch_size=1000):
+    """
+    Recompute portfolio_position from the Transaction ledger in one streaming pass.
+    Returns the number of transactions replayed.
+    """
+    db.create_all()
+    ledger = db.session.execute(
+        db.select(Transaction.user_id, Transaction.symbol, Transaction.amount, Transaction.price, Transaction.timestamp)
+        .order_by(Transaction.user_id, Transaction.symbol, Transaction.timestamp, Transaction.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+    db.session.query(PortfolioPosition).delete()
+    pending = []
+    key, position = None, None
+    count = 0
+    for user_id, symbol, amount, price, timestamp in ledger:
+        if (user_id, symbol) != key:
+            if position:
+                pending.append(position)
+            key = (user_id, symbol)
+            position = {"user_id": user_id, "symbol": symbol, "quantity": 0.0, "avg_cost": 0.0,
+                        "realized_pnl": 0.0, "last_trade_at": None}
+        apply_trade_to_position(position, amount, price, timestamp)
+        count += 1
+        if len(pending) >= batch_size:
+            db.session.execute(db.insert(PortfolioPosition), pending)
+            pending = []
+    if position:
+        pending.append(position)
+    if pending:
+        db.session.execute(db.insert(PortfolioPosition), pending)
+    db.session.commit()
+    return count
+
+
+@app.cli.command("rebuild-portfolio")
+@click.option("--batch-size", default=1000, help="Ledger rows fetched per round trip.")
+def rebuild_portfolio_command(batch_size):
+    """
+    Recompute portfolio_position from the Transaction ledger in one streaming pass.
+    """
+    print(f"Rebuilt portfolio positions from {rebuild_portfolio_positions(batch_size)} transactions")
+
+
+@app.cli.command("backfill-history")
+@click.option("--days", default=HISTORY_BACKFILL_DAYS, help="Days of CoinGecko history to cover.")
+def backfill_history_command(days):
+    """
+    Merge CoinGecko price history into the local store (the poller also does this on start).
+    """
+    print(f"Added {backfill_price_history(days)} CoinGecko history records")
+
+
+@app.cli.command("backfill-portfolio")
+@click.option("--days", default=30, help="How many days of price history to backfill from.")
+def backfill_portfolio_command(days):
+    """
+    Fill past portfolio value bars from the Transaction ledger and recorded CoinGecko prices.
+    """
+    db.create_all()
+    print(f"Backfilled {backfill_portfolio_rollups(since=time.time() - days * 86400)} portfolio bars")
+
+
+@app.cli.command("export-transactions")
+@click.argument("output")
+@click.option("--format", "fmt", type=click.Choice(["csv", "parquet"]), default=None,
+              help="Output format (defaults to the OUTPUT extension).")
+@click.option("--user-id", default=None, type=int, help="Export one user's ledger (default: all users).")
+@click.option("--chunk-size", default=EXPORT_CHUNK_SIZE, help="Rows fetched per round trip.")
+def export_transactions_command(output, fmt, user_id, chunk_size):
+    """
+    Stream Transaction rows to OUTPUT as CSV or Parquet.
+    """
+    fmt = fmt or ("parquet" if output.endswith(".parquet") else "csv")
+    if fmt == "parquet" and pq is None:
+        raise click.ClickException("Parquet export requires pyarrow")
+    size = 0
+    with open(output, "wb") as f:
+        for data in export_transactions(fmt, user_id, chunk_size):
+            f.write(data)
+            size += len(data)
+    print(f"Wrote {size} bytes to {output}")
+
+
+@app.cli.command("create-indexes")
+def create_indexes_command():
+    """
+    Create any model indexes missing from existing tables (db.create_all skips existing tables).
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+            print(f"Ensured index {index.name}")
+
+
+@app.cli.command("run-poller")
+def run_poller_command():
+    """
+    Run the price poller in the foreground as the dedicated polling process.
+    """
+    if replaying():
+        raise click.ClickException("The poller is disabled while UPSTREAM_MODE=replay")
+    lock_file = acquire_poller_lock()
+    if lock_file is None:
+        raise click.ClickException(f"Another process already holds {POLLER_LOCK_FILE}")
+    price_poller_state["lock_file"] = lock_file
+    print(f"Polling every {PRICE_POLL_INTERVAL}s (Ctrl+C to stop)")
+    run_price_poller()
+
+
+@app.cli.command("backtest")
+@click.argument("symbol")
+@click.option("--amount", default=1000.0, help="USD amount per trade.")
+@click.option("--seed", default=None, type=int, help="Seed for reproducible fills.")
+@click.option("--directory", default=None, help="Columnar tick directory (defaults to BACKTEST_DIR).")
+def backtest_command(symbol, amount, seed, directory):
+    """
+    Replay recorded ticks for SYMBOL through the arbitrage model.
+    """
+    result = run_backtest(symbol.upper(), amount=amount, directory=directory, seed=seed)
+    rows = [[key, result[key]] for key in ("ticks", "trades", "successes", "hit_rate", "total_pnl", "max_drawdown")]
+    rows += [[f"trades {pair}", count] for pair, count in result["pairs"].items()]
+    print(tabulate(rows, headers=["metric", "value"]))
+
+
 __all__ = ['db']
 globals()["Transaction"] = Transaction
 
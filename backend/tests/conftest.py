@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+
+# main.py reads its configuration at import time; give it harmless defaults
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-that-is-long-enough-for-hs256")
+os.environ.setdefault("REDDIT_CLIENT_ID", "test")
+os.environ.setdefault("REDDIT_SECRET", "test")
+os.environ.setdefault("REDDIT_USER_AGENT", "intelicoin-tests")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["PRICE_POLLER_ENABLED"] = "0"
+os.environ["HISTORY_RECORD"] = "0"
+os.environ["UPSTREAM_MODE"] = "live"
+# Workers follow the poller's snapshot file; point them at one that never exists
+os.environ["POLLER_SNAPSHOT_FILE"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "no-such-dir", "poller.json")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_db():
+    """
+    Fresh tables in the in-memory SQLite database for one test.
+    """
+    import main
+
+    with main.app.app_context():
+        main.db.create_all()
+        try:
+            yield main.db
+        finally:
+            main.db.session.remove()
+            main.db.drop_all()
+
+
+@pytest.fixture(scope="session")
+def postgres_app():
+    """
+    A second app bound to the PostgreSQL database at TEST_POSTGRES_URL, for the
+    PostgreSQL-only statements. Tests using it are skipped when it is not set or unreachable.
+    """
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    import main
+    from flask import Flask
+    from sqlalchemy import text
+
+    app = Flask("intelicoin-postgres-tests")
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    try:
+        main.db.init_app(app)
+        with app.app_context():
+            main.db.session.execute(text("SELECT 1"))
+    except Exception as e:
+        pytest.skip(f"PostgreSQL is unavailable: {e}")
+    return app
+
+
+@pytest.fixture
+def pg_db(postgres_app):
+    """
+    Fresh tables in the PostgreSQL test database for one test.
+    """
+    import main
+
+    with postgres_app.app_context():
+        main.db.drop_all()
+        main.db.create_all()
+        try:
+            yield main.db
+        finally:
+            main.db.session.remove()
+            main.db.drop_all()
+
+
+@pytest.fixture
+def auth_header():
+    """
+    Build an Authorization header for a user id.
+    """
+    import main
+    from flask_jwt_extended import create_access_token
+
+    def make(user_id):
+        with main.app.app_context():
+            return {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+
+    return make
@@ -0,0 +1,82 @@
+import math
+import random
+
+import main
+
+
+def has_negative_cycle(graph):
+    # Plain Bellman-Ford from a virtual source, over the graph's current edges
+    n = len(graph.nodes)
+    dist = [0.0] * n
+    for _ in range(n):
+        changed = False
+        for u in range(n):
+            for v, w in graph.out_edges[u].items():
+                if dist[u] + w < dist[v] - 1e-12:
+                    dist[v] = dist[u] + w
+                    changed = True
+        if not changed:
+            return False
+    return True
+
+
+def assert_real_cycle(graph, cycle):
+    path = [tuple(node) for node in cycle["path"]]
+    assert path[0] == path[-1]
+    weight = sum(graph.out_edges[graph.index[a]][graph.index[b]] for a, b in zip(path, path[1:]))
+    assert weight < 0
+    assert math.isclose(cycle["rate"], math.exp(-weight))
+
+
+def test_finds_a_profitable_loop():
+    graph = main.ArbitrageGraph()
+    graph.set_rate(("A", "USD"), ("A", "BTC"), 1 / 60000)
+    graph.set_rate(("A", "BTC"), ("B", "BTC"), 1.0)
+    graph.set_rate(("B", "BTC"), ("B", "USD"), 61000)
+    graph.set_rate(("B", "USD"), ("A", "USD"), 1.0)
+
+    cycle = graph.find_cycle()
+
+    assert cycle["profit_pct"] > 1.6
+    assert_real_cycle(graph, cycle)
+    # The opportunity persists, so the next tick reports it again
+    assert graph.find_cycle()["profit_pct"] == cycle["profit_pct"]
+    graph.set_rate(("B", "BTC"), ("B", "USD"), 59000)
+    assert graph.find_cycle() is None
+
+
+def test_persisting_cycle_does_not_reset_the_rest_of_the_graph():
+    graph = main.ArbitrageGraph()
+    graph.set_rate(("X", "c"), ("X", "d"), 2.0)
+    assert graph.find_cycle() is None
+    graph.set_rate(("X", "a"), ("X", "b"), 1.1)
+    graph.set_rate(("X", "b"), ("X", "a"), 1.0)
+
+    for _ in range(3):
+        assert graph.find_cycle() is not None
+        # Labels away from the cycle are kept, and only the cycle is re-relaxed
+        assert graph.dist[graph.index[("X", "d")]] == -math.log(2.0)
+        assert graph._pending == {graph.index[("X", "a")], graph.index[("X", "b")]}
+
+
+def test_incremental_search_matches_bellman_ford():
+    rng = random.Random(7)
+    nodes = [("X", i) for i in range(8)]
+    graph = main.ArbitrageGraph()
+    # Rates around 1 so that cycles keep appearing and disappearing
+    mismatches = 0
+
+    for _ in range(3000):
+        u, v = rng.sample(nodes, 2)
+        rate = 0.0 if rng.random() < 0.3 else rng.uniform(0.9, 1.01)
+        graph.set_rate(u, v, rate)
+        cycle = graph.find_cycle()
+        if cycle:
+            assert_real_cycle(graph, cycle)
+        mismatches += (cycle is not None) != has_negative_cycle(graph)
+
+    assert mismatches == 0
+    # Every child list mirrors the predecessor array
+    for i, p in enumerate(graph.pred):
+        assert all(graph.pred[child] == i for child in graph.children[i])
+        assert p is None or i in graph.children[p]
@@ -0,0 +1,59 @@
+import math
+import random
+
+import pytest
+
+import main
+
+FEES = [(0.001, 0.001), (0.005, 0.004), (0.0026, 0.001)]
+
+
+def brute_force(buy_price, sell_price, buy_fee, sell_fee, network_fee, max_amount, step=1.0):
+    amounts = [step * i for i in range(1, int(max_amount / step) + 1)]
+    profits = [main.arbitrage_net_profit(a, buy_price, sell_price, buy_fee, sell_fee, network_fee) for a in amounts]
+    return amounts, profits
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_break_even_matches_brute_force(seed):
+    rng = random.Random(seed)
+    buy_price = rng.uniform(50, 60000)
+    sell_price = buy_price * (1 + rng.uniform(0.0, 0.03))
+    buy_fee, sell_fee = rng.choice(FEES)
+    network_fee = rng.choice([0.1, 1.0, 5.0])
+
+    amounts, profits = brute_force(buy_price, sell_price, buy_fee, sell_fee, network_fee, 5000)
+    expected = next((a for a, p in zip(amounts, profits) if p > 0), None)
+    solved = main.solve_break_even_amount(buy_price, sell_price, buy_fee, sell_fee, network_fee)
+
+    if expected is None:
+        assert solved is None or solved > 5000 - 1
+    else:
+        assert solved is not None and expected - 1 <= solved <= expected
+        assert main.arbitrage_net_profit(solved, buy_price, sell_price, buy_fee, sell_fee, network_fee) >= -1e-9
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_optimal_size_matches_brute_force(seed):
+    rng = random.Random(1000 + seed)
+    buy_price = rng.uniform(50, 60000)
+    sell_price = buy_price * (1 + rng.uniform(0.0, 0.03))
+    buy_fee, sell_fee = rng.choice(FEES)
+    network_fee = rng.choice([0.1, 1.0, 5.0])
+    max_amount = 3000
+
+    amounts, profits = brute_force(buy_price, sell_price, buy_fee, sell_fee, network_fee, max_amount, step=0.25)
+    best_profit = max(profits)
+    result = main.optimal_trade_size(buy_price, sell_price, buy_fee, sell_fee, network_fee, max_amount=max_amount)
+
+    if best_profit <= 0:
+        assert result["optimal_amount"] is None
+    else:
+        assert result["max_net_profit"] >= best_profit - 1e-3
+
+
+def test_optimal_size_pins_to_cap_when_high_slippage_piece_gains():
+    result = main.optimal_trade_size(100.0, 105.0, 0.001, 0.001, 1.0, max_amount=50000)
+
+    assert result["optimal_amount"] == 50000
+    assert result["profitable_range"][1] == 50000
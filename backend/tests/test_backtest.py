@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+FEES = {"A": 0.0, "B": 0.0, "C": 0.0}
+# A and B always fill, anything through C never does
+LATENCY = {"A": 0.0, "B": 0.0, "C": 1.0}
+
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SUCCESS_PROB_BASE", 1.0)
+    monkeypatch.setattr(main, "SUCCESS_PROB_PER_SECOND", 1.0)
+    monkeypatch.setattr(main, "SUCCESS_PROB_MIN", 0.0)
+    writer = main.TickColumnWriter(str(tmp_path / "BTC"))
+    writer.append(1.0, {"A": 100.0, "B": 110.0}, ["A", "B", "C"])
+    writer.append(2.0, {"A": 100.0, "B": 100.0, "C": 130.0}, ["A", "B", "C"])
+    # C is no longer registered
+    writer.append(3.0, {"A": 100.0, "B": 100.0}, ["A", "B"])
+    writer.append(4.0, {"A": 105.0, "B": 100.0}, ["A", "B"])
+    return tmp_path
+
+
+def test_every_column_stays_aligned_with_the_timestamps(recording):
+    timestamps, columns = main.read_tick_columns("BTC", str(recording))
+
+    assert list(timestamps) == [1.0, 2.0, 3.0, 4.0]
+    assert set(columns) == {"A", "B", "C"}
+    assert all(os.path.getsize(recording / "BTC" / f"{name}.f64") == 4 * 8 for name in columns)
+    assert np.isnan(columns["C"][[0, 2, 3]]).all() and columns["C"][1] == 130.0
+
+
+def test_backtest_pnl_hit_rate_and_drawdown(recording):
+    result = main.run_backtest("BTC", amount=1000, directory=str(recording), exchange_fees=FEES,
+                               exchange_latency=LATENCY, seed=1)
+
+    network_fee = main.network_fee_for("BTC")
+    first = main.arbitrage_net_profit(1000, 100.0, 110.0, 0.0, 0.0, network_fee)
+    last = main.arbitrage_net_profit(1000, 100.0, 105.0, 0.0, 0.0, network_fee)
+    failed = -1000 * main.FAILED_TRADE_LOSS
+    assert (result["ticks"], result["trades"], result["successes"]) == (4, 3, 2)
+    assert result["hit_rate"] == pytest.approx(0.6667)
+    assert result["total_pnl"] == pytest.approx(first + failed + last, abs=0.01)
+    assert result["max_drawdown"] == pytest.approx(-failed)
+    assert result["pairs"] == {"A->B": 1, "A->C": 1, "B->A": 1}
+    assert result["pnl_curve"]["equity"] == pytest.approx([first, first + failed, first + failed, first + failed + last])
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+
+import main
+
+# apply_balance_delta is a single PostgreSQL data-modifying CTE; these run only with TEST_POSTGRES_URL
+
+
+@pytest.fixture
+def user(pg_db):
+    pg_db.session.add(main.User(id=1, username="alice", email="alice@example.com", password_hash="x", wallet_balance=100.0))
+    pg_db.session.commit()
+    return pg_db
+
+
+def wallet(user_id=1):
+    main.db.session.expire_all()
+    return main.db.session.get(main.User, user_id).wallet_balance
+
+
+def holding(symbol, user_id=1):
+    row = main.db.session.get(main.Holding, (user_id, symbol))
+    return row.quantity if row else None
+
+
+def queued():
+    return [row.user_id for row in main.PortfolioRollupQueue.query.all()]
+
+
+def test_overdraw_is_refused_and_nothing_is_written(user):
+    assert main.apply_balance_delta(1, -150.0) is None
+
+    assert wallet() == 100.0
+    assert queued() == []
+    assert main.apply_balance_delta(2, 10.0) is None
+
+
+def test_withdrawal_down_to_zero_goes_through(user):
+    result = main.apply_balance_delta(1, -100.0)
+
+    assert result["wallet_balance"] == 0.0
+    assert result["quantity"] is None and result["transaction_id"] is None
+    assert queued() == [1]
+
+
+def test_required_balance_guards_the_update(user):
+    assert main.apply_balance_delta(1, 5.0, required=100.01) is None
+    assert wallet() == 100.0
+
+    assert main.apply_balance_delta(1, 5.0, required=100.0)["wallet_balance"] == 105.0
+
+
+def test_holding_is_credited_only_when_the_wallet_moves(user):
+    first = main.apply_balance_delta(1, -60.0, asset=("BTC", 0.5))
+    second = main.apply_balance_delta(1, -30.0, asset=("BTC", 0.25))
+
+    assert (first["quantity"], second["quantity"]) == (0.5, 0.75)
+    assert main.apply_balance_delta(1, -30.0, asset=("BTC", 0.25)) is None
+    assert main.apply_balance_delta(1, -5.0, asset=("ETH", 1.0), required=50.0) is None
+    main.db.session.expire_all()
+    assert (wallet(), holding("BTC"), holding("ETH")) == (10.0, 0.75, None)
+
+
+def test_holding_debit_is_guarded(user):
+    main.apply_balance_delta(1, -60.0, asset=("BTC", 0.5))
+
+    # Selling more than is held, or with the wallet guard failing, moves nothing
+    assert main.apply_balance_delta(1, 80.0, asset=("BTC", -0.6)) is None
+    assert main.apply_balance_delta(1, 80.0, asset=("ETH", -0.1)) is None
+    assert main.apply_balance_delta(1, 10.0, asset=("BTC", -0.1), required=1000.0) is None
+    main.db.session.expire_all()
+    assert (wallet(), holding("BTC")) == (40.0, 0.5)
+
+    result = main.apply_balance_delta(1, 48.0, asset=("BTC", -0.2))
+    assert result["wallet_balance"] == 88.0
+    assert result["quantity"] == pytest.approx(0.3)
+
+
+def test_transaction_and_position_are_written_in_the_same_statement(user):
+    timestamp = datetime(2026, 1, 1, 12, 0)
+    buy = {"symbol": "BTC", "amount": 0.001, "price": 60000.0, "total_value": 60.0, "timestamp": timestamp}
+
+    result = main.apply_balance_delta(1, -60.0, asset=("BTC", 0.001), transaction=buy)
+    refused = main.apply_balance_delta(1, -60.0, asset=("BTC", 0.001), transaction=buy)
+
+    assert refused is None
+    [tx] = main.Transaction.query.all()
+    assert tx.id == result["transaction_id"]
+    assert (tx.user_id, tx.symbol, tx.amount, tx.total_value, tx.timestamp) == (1, "BTC", 0.001, 60.0, timestamp)
+    position = main.db.session.get(main.PortfolioPosition, (1, "BTC"))
+    assert (position.quantity, position.avg_cost, position.last_trade_at) == (0.001, 60000.0, timestamp)
+    assert queued() == [1]
+
+    sell = {"symbol": "BTC", "amount": -0.001, "price": 62000.0, "total_value": 62.0, "timestamp": timestamp}
+    main.apply_balance_delta(1, 62.0, asset=("BTC", -0.001), transaction=sell)
+    main.db.session.expire_all()
+    position = main.db.session.get(main.PortfolioPosition, (1, "BTC"))
+    assert position.quantity == pytest.approx(0.0)
+    assert position.realized_pnl == pytest.approx(2.0)
+    assert main.Transaction.query.count() == 2
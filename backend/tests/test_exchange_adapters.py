@@ -0,0 +1,123 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+import main
+
+
+class StubExchange:
+    """
+    Local HTTP server answering each path with a canned (status, body).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.requests.append((url.path, url.query))
+                status, body = stub.routes.get(url.path, (404, {"error": "not found"}))
+                payload = body if isinstance(body, str) else json.dumps(body)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(payload.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubExchange()
+    yield server
+    server.close()
+
+
+def test_binance_parses_ticker(stub):
+    stub.routes["/api/v3/ticker/price"] = (200, {"symbol": "BTCUSDT", "price": "64000.50"})
+    adapter = main.BinanceAdapter(base_url=stub.url)
+
+    assert adapter.fetch_price("bitcoin") == 64000.5
+    assert stub.requests == [("/api/v3/ticker/price", "symbol=BTCUSDT")]
+
+
+def test_binance_parses_order_book(stub):
+    stub.routes["/api/v3/depth"] = (
+        200, {"lastUpdateId": 42, "bids": [["100.0", "2"], ["99.5", "1"]], "asks": [["100.5", "3"]]}
+    )
+    adapter = main.BinanceAdapter(base_url=stub.url)
+
+    assert adapter.fetch_order_book("BTC") == ([(100.0, 2.0), (99.5, 1.0)], [(100.5, 3.0)], 42)
+
+
+def test_binance_parses_depth_updates():
+    adapter = main.BinanceAdapter()
+    message = {"e": "depthUpdate", "U": 43, "u": 45, "b": [["100.0", "0"]], "a": [["100.6", "1.5"]]}
+
+    assert adapter.diff_stream_url("BTC").endswith("/btcusdt@depth@100ms")
+    assert adapter.parse_diff(message) == ([["100.0", "0"]], [["100.6", "1.5"]], 43, 45)
+    assert adapter.parse_diff({"result": None, "id": 1}) is None
+
+
+def test_binance_http_error_returns_none(stub):
+    stub.routes["/api/v3/ticker/price"] = (500, {"msg": "internal error"})
+    adapter = main.BinanceAdapter(base_url=stub.url)
+
+    assert adapter.fetch_price("BTC") is None
+
+
+def test_binance_malformed_body_returns_none(stub):
+    stub.routes["/api/v3/ticker/price"] = (200, "not json")
+    adapter = main.BinanceAdapter(base_url=stub.url)
+
+    assert adapter.fetch_price("BTC") is None
+
+
+def test_unsupported_symbol_skips_request(stub):
+    adapter = main.BinanceAdapter(base_url=stub.url)
+
+    assert adapter.fetch_price("not-a-coin") is None
+    assert stub.requests == []
+
+
+def test_kraken_maps_asset_codes_and_reports_errors(stub):
+    adapter = main.KrakenAdapter(base_url=stub.url)
+
+    stub.routes["/0/public/Ticker"] = (200, {"error": [], "result": {"XXBTZUSD": {"c": ["63990.1", "0.01"]}}})
+    assert adapter.fetch_price("BTC") == 63990.1
+    assert stub.requests[-1] == ("/0/public/Ticker", "pair=XBTUSD")
+
+    stub.routes["/0/public/Ticker"] = (200, {"error": ["EQuery:Unknown asset pair"], "result": {}})
+    assert adapter.fetch_price("BTC") is None
+
+
+def test_register_exchange_adapter_creates_rate_limiter():
+    class StubAdapter(main.ExchangeAdapter):
+        name = "StubExchange"
+        env_prefix = "STUB_EXCHANGE"
+        default_base_url = "http://127.0.0.1:1"
+        rate_limit = 42
+
+    try:
+        main.register_exchange_adapter(StubAdapter())
+        assert main.RATE_LIMITS["StubExchange"] == 42
+        assert main.rate_limiters["StubExchange"].rate == pytest.approx(42 / 60.0)
+        assert "StubExchange" in main.PRICE_FETCHERS
+    finally:
+        for registry in (main.EXCHANGE_ADAPTERS, main.PRICE_FETCHERS, main.RATE_LIMITS, main.rate_limiters):
+            registry.pop("StubExchange", None)
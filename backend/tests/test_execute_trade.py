@@ -0,0 +1,63 @@
+import pytest
+
+import main
+
+REALISTIC_TRADE = {
+    "gross_profit": 10.0,
+    "net_profit": 4.5,
+    "fees": {"buy_fee": 1.0, "sell_fee": 1.0, "network_fee": 2.0, "total_fees": 4.0},
+    "slippage": 0.1,
+    "latency": 0.4,
+    "effective_buy_price": 100.1,
+    "effective_sell_price": 109.9,
+    "crypto_amount": 9.9,
+    "priced_from": "ticker"
+}
+
+
+def test_successful_trade_returns_effective_prices(app_db, monkeypatch, auth_header):
+    settled = []
+
+    def fake_apply_balance_delta(user_id, delta, asset=None, transaction=None, required=0.0):
+        settled.append((user_id, delta, asset, transaction, required))
+        return {"id": 1, "wallet_balance": 1004.5, "quantity": 9.9, "transaction_id": 7}
+
+    monkeypatch.setattr(main, "calculate_realistic_arbitrage", lambda *args, **kwargs: dict(REALISTIC_TRADE))
+    monkeypatch.setattr(main, "apply_balance_delta", fake_apply_balance_delta)
+    monkeypatch.setattr(main.random, "random", lambda: 0.0)
+
+    response = main.app.test_client().post("/execute_trade", json={
+        "buy_from": "Binance", "sell_to": "Kraken", "tradeAmount": 1000, "crypto": "BTC"
+    }, headers=auth_header(1))
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["status"] == "success"
+    assert body["effective_prices"] == {"buy": 100.1, "sell": 109.9}
+    # Only the net P&L settles; the round trip leaves no coins behind
+    [(user_id, delta, asset, transaction, required)] = settled
+    assert (delta, asset, transaction, required) == (4.5, None, None, 1000.0)
+
+
+def test_trade_at_or_below_network_fee_is_rejected(monkeypatch, auth_header):
+    monkeypatch.setattr(main, "calculate_realistic_arbitrage", lambda *args, **kwargs: dict(REALISTIC_TRADE))
+    monkeypatch.setattr(main, "apply_balance_delta", lambda *args, **kwargs: pytest.fail("must not settle"))
+
+    response = main.app.test_client().post("/execute_trade", json={
+        "buy_from": "Binance", "sell_to": "Kraken", "tradeAmount": main.network_fee_for("BTC"), "crypto": "BTC"
+    }, headers=auth_header(1))
+
+    assert response.status_code == 400
+
+
+def test_trade_that_does_not_cover_fees_is_rejected(monkeypatch, auth_header):
+    monkeypatch.setattr(
+        main, "calculate_realistic_arbitrage", lambda *args, **kwargs: dict(REALISTIC_TRADE, crypto_amount=-0.01)
+    )
+    monkeypatch.setattr(main, "apply_balance_delta", lambda *args, **kwargs: pytest.fail("must not settle"))
+
+    response = main.app.test_client().post("/execute_trade", json={
+        "buy_from": "Binance", "sell_to": "Kraken", "tradeAmount": 50, "crypto": "BTC"
+    }, headers=auth_header(1))
+
+    assert response.status_code == 400
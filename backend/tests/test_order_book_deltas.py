@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def book():
+    book = main.OrderBook()
+    book.apply_snapshot([(99.0, 1.0), (100.0, 2.0)], [(101.0, 3.0), (102.0, 4.0)], sequence=10)
+    return book
+
+
+def test_delta_inserts_updates_and_removes_levels(book):
+    assert book.apply_delta([(100.5, 1.0), (99.0, 0.0)], [(101.0, 5.0), (102.0, 0.0), (103.0, 1.0)], 11, 12)
+
+    bids, asks = book.levels()
+    assert bids == [[100.0, 2.0], [100.5, 1.0]]
+    assert asks == [[101.0, 5.0], [103.0, 1.0]]
+    assert (book.best_bid(), book.best_ask(), book.sequence) == (100.5, 101.0, 12)
+
+
+def test_removing_a_missing_level_is_a_no_op(book):
+    assert book.apply_delta([(98.0, 0.0)], [], 11, 11)
+
+    assert book.levels()[0] == [[99.0, 1.0], [100.0, 2.0]]
+
+
+def test_updates_the_book_already_covers_are_ignored(book):
+    # Straddling the snapshot is fine; entirely older is skipped
+    assert book.apply_delta([(100.0, 9.0)], [], 5, 10)
+    assert book.levels()[0][-1] == [100.0, 2.0]
+    assert book.apply_delta([(100.0, 9.0)], [], 8, 11)
+    assert book.levels()[0][-1] == [100.0, 9.0]
+
+
+def test_sequence_gap_forces_a_resnapshot(book):
+    assert not book.apply_delta([(100.0, 9.0)], [], 12, 13)
+
+    assert book.sequence == 10
+    assert book.levels()[0][-1] == [100.0, 2.0]
+
+
+def test_delta_without_a_snapshot_is_refused():
+    assert not main.OrderBook().apply_delta([(100.0, 1.0)], [], 1, 1)
+
+
+def test_delta_keeps_the_levels_nearest_the_touch(book, monkeypatch):
+    monkeypatch.setattr(main, "ORDER_BOOK_DEPTH", 2)
+
+    book.apply_delta([(100.5, 1.0)], [(100.8, 1.0)], 11, 11)
+
+    bids, asks = book.levels()
+    assert [level[0] for level in bids] == [100.0, 100.5]
+    assert [level[0] for level in asks] == [100.8, 101.0]
+
+
+class FakeAdapter:
+    name = "Binance"
+
+    def __init__(self, snapshots):
+        self.snapshots = list(snapshots)
+        self.fetches = 0
+
+    def fetch_order_book(self, symbol):
+        self.fetches += 1
+        return self.snapshots.pop(0)
+
+    def diff_stream_url(self, symbol):
+        return "wss://example.invalid/btc"
+
+    parse_diff = main.BinanceAdapter.parse_diff
+
+
+class FakeConnection:
+    def __init__(self, messages, stop):
+        self.messages = list(messages)
+        self.stop = stop
+
+    def recv(self):
+        message = self.messages.pop(0)
+        if not self.messages:
+            self.stop.set()
+        return main.json.dumps(message)
+
+    def close(self):
+        pass
+
+
+def depth_update(first, last, bids=(), asks=()):
+    return {"e": "depthUpdate", "U": first, "u": last, "b": list(bids), "a": list(asks)}
+
+
+def test_feed_applies_deltas_and_resnapshots_after_a_gap(monkeypatch):
+    monkeypatch.setattr(main, "order_books", main.OrderBookStore())
+    stop = threading.Event()
+    adapter = FakeAdapter([
+        ([(100.0, 1.0)], [(101.0, 1.0)], 10),
+        ([(100.0, 7.0)], [(101.0, 1.0)], 20),
+    ])
+    messages = [
+        depth_update(9, 10, bids=[["100.0", "5"]]),
+        depth_update(11, 12, bids=[["100.0", "2"]]),
+        depth_update(15, 16, bids=[["100.0", "3"]]),
+        depth_update(21, 21, asks=[["101.0", "0"], ["101.5", "4"]]),
+    ]
+    monkeypatch.setattr(main, "websocket", type("ws", (), {
+        "create_connection": staticmethod(lambda url, timeout: FakeConnection(messages, stop))
+    }))
+
+    main.run_order_book_feed(adapter, "BTC", stop)
+
+    book = main.order_books.get("Binance", "BTC")
+    assert adapter.fetches == 2
+    assert book.levels() == ([[100.0, 7.0]], [[101.5, 4.0]])
+    assert book.sequence == 21
@@ -0,0 +1,40 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def books(monkeypatch):
+    store = main.OrderBookStore()
+    monkeypatch.setattr(main, "order_books", store)
+    return store
+
+
+PRICES = {"Binance": 100.0, "Kraken": 110.0}
+
+
+def test_ticker_model_without_books(books):
+    [opportunity] = main.find_arbitrage_opportunities(PRICES, "BTC", 1000)
+
+    assert opportunity["buy_from"] == "Binance"
+    assert opportunity["priced_from"] == "ticker"
+
+
+def test_thin_sell_book_removes_opportunity(books):
+    books.book("Binance", "BTC").apply_snapshot([(99.0, 100.0)], [(100.0, 100.0)])
+    # Only a sliver of size at 110; the rest of the bids sit far below the ticker
+    books.book("Kraken", "BTC").apply_snapshot([(110.0, 0.5), (90.0, 100.0)], [(111.0, 100.0)])
+
+    assert main.find_arbitrage_opportunities(PRICES, "BTC", 1000) == []
+
+
+def test_scan_matches_execute_trade_pricing(books):
+    books.book("Binance", "BTC").apply_snapshot([(99.0, 100.0)], [(100.0, 5.0), (100.5, 100.0)])
+    books.book("Kraken", "BTC").apply_snapshot([(110.0, 100.0)], [(111.0, 100.0)])
+
+    [opportunity] = main.find_arbitrage_opportunities(PRICES, "BTC", 1000)
+    realistic = main.calculate_realistic_arbitrage("Binance", "Kraken", "BTC", 1000, PRICES)
+
+    assert opportunity["priced_from"] == realistic["priced_from"] == "order_book"
+    assert opportunity["net_profit"] == pytest.approx(realistic["net_profit"])
+    assert opportunity["effective_prices"]["buy"] == pytest.approx(realistic["effective_buy_price"])
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import main
+
+
+def fresh_worker_state(monkeypatch):
+    monkeypatch.setattr(main, "tick_store", main.TickStore(16))
+    monkeypatch.setattr(main, "order_books", main.OrderBookStore())
+    monkeypatch.setattr(main, "opportunity_index", main.OpportunityIndex(main.OPPORTUNITY_TOP_K, main.OPPORTUNITY_TTL))
+    monkeypatch.setattr(main, "latest_arbitrage_cycle", None)
+    monkeypatch.setattr(main, "last_published_opportunities", set())
+
+
+@pytest.fixture
+def snapshot_path(monkeypatch, tmp_path):
+    # The poller process: ticks with a wide BTC spread, one book and a cycle
+    fresh_worker_state(monkeypatch)
+    now = time.time()
+    main.tick_store.record("Binance", "BTC", 60000.0, now)
+    main.tick_store.record("Kraken", "BTC", 64000.0, now)
+    main.order_books.book("Kraken", "ETH").apply_snapshot([(2999.0, 4.0)], [(3001.0, 2.0)], sequence=7)
+    main.scan_opportunities_once(now)
+    cycle = {"path": [["Binance", "BTC"], ["Kraken", "BTC"], ["Binance", "BTC"]], "rate": 1.01, "profit_pct": 1.0}
+    monkeypatch.setattr(main, "latest_arbitrage_cycle", cycle)
+
+    path = tmp_path / "poller.json"
+    main.write_poller_snapshot(now, str(path))
+    return path
+
+
+def test_follower_serves_the_pollers_ticks_books_and_scans(monkeypatch, snapshot_path):
+    fresh_worker_state(monkeypatch)
+    client = main.app.test_client()
+    assert client.get("/opportunities/best").status_code == 503
+
+    main.apply_poller_snapshot(main.json.loads(snapshot_path.read_text()))
+
+    assert main.tick_store.latest("Kraken", "BTC") == 64000.0
+    assert client.get("/ticks/Binance/BTC").get_json()["prices"] == [60000.0]
+    book = main.order_books.get("Kraken", "ETH")
+    assert (book.best_bid(), book.best_ask(), book.sequence) == (2999.0, 3001.0, 7)
+    body = client.get("/opportunities/best").get_json()
+    [best] = body["opportunities"]
+    assert (best["symbol"], best["buy_from"], best["sell_to"]) == ("BTC", "Binance", "Kraken")
+    assert body["updated_at"] == pytest.approx(time.time(), abs=60)
+    assert client.get("/arbitrage/cycles").get_json()["cycle"]["profit_pct"] == 1.0
+
+
+def test_follower_pushes_events_to_its_stream_clients(monkeypatch, snapshot_path):
+    fresh_worker_state(monkeypatch)
+    q = main.event_hub.subscribe()
+    try:
+        main.apply_poller_snapshot(main.json.loads(snapshot_path.read_text()))
+        events = []
+        while not q.empty():
+            events.append(q.get_nowait()[0])
+    finally:
+        main.event_hub.unsubscribe(q)
+
+    assert {"tick", "opportunity", "cycle"} <= set(events)
+
+
+def test_follower_ignores_ticks_it_already_has(monkeypatch, snapshot_path):
+    fresh_worker_state(monkeypatch)
+    snapshot = main.json.loads(snapshot_path.read_text())
+
+    main.apply_poller_snapshot(snapshot)
+    main.apply_poller_snapshot(snapshot)
+
+    timestamps, _ = main.tick_store.history("Binance", "BTC")
+    assert len(timestamps) == 1
+
+
+def test_follower_loads_the_pollers_index_without_rescanning(monkeypatch, snapshot_path):
+    fresh_worker_state(monkeypatch)
+    monkeypatch.setattr(main, "find_arbitrage_opportunities", lambda *args, **kwargs: pytest.fail("rescanned"))
+
+    main.apply_poller_snapshot(main.json.loads(snapshot_path.read_text()))
+
+    assert main.opportunity_index.get("BTC")["opportunities"][0]["sell_to"] == "Kraken"
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import main
+
+# (amount, price): buys, a partial sell, an oversell into a negative position,
+# a buy back to exactly zero, then a fresh position
+TRADES = [
+    (2.0, 100.0),
+    (1.0, 130.0),
+    (-1.5, 150.0),
+    (-2.0, 90.0),
+    (0.5, 95.0),
+    (3.0, 80.0),
+    (-1.0, 120.0),
+]
+
+
+def empty_position():
+    return {"quantity": 0.0, "avg_cost": 0.0, "realized_pnl": 0.0, "last_trade_at": None}
+
+
+def sql_position(user_id, symbol):
+    return main.PortfolioPosition.query.filter_by(user_id=user_id, symbol=symbol).one()
+
+
+def replay_sql(db, user_id, symbol, trades, start):
+    for i, (amount, price) in enumerate(trades):
+        db.session.execute(text(main.position_upsert_sql(main.TRADE_PARAMS_SOURCE)), {
+            "user_id": user_id, "symbol": symbol, "amount": amount, "price": price,
+            "timestamp": start + timedelta(minutes=i)
+        })
+    db.session.commit()
+
+
+def assert_same(row, position):
+    assert row.quantity == pytest.approx(position["quantity"])
+    assert row.avg_cost == pytest.approx(position["avg_cost"])
+    assert row.realized_pnl == pytest.approx(position["realized_pnl"])
+    assert row.last_trade_at == position["last_trade_at"]
+
+
+@pytest.mark.parametrize("trades", [TRADES, [(-1.0, 50.0), (1.0, 40.0)], [(1.0, 10.0), (-1.0, 12.0), (1.0, 11.0)]])
+def test_sql_upsert_matches_python_replay(app_db, trades):
+    app_db.session.add(main.User(id=1, username="u", email="u@example.com", password_hash="x"))
+    app_db.session.commit()
+    start = datetime(2024, 1, 1)
+
+    position = empty_position()
+    for i, (amount, price) in enumerate(trades):
+        expected = main.apply_trade_to_position(position, amount, price, start + timedelta(minutes=i))
+        replay_sql(app_db, 1, "BTC", [(amount, price)], start + timedelta(minutes=i))
+        # Compare after every step so a divergence points at the trade that caused it
+        assert_same(sql_position(1, "BTC"), expected)
+
+
+def test_buy_back_to_zero_does_not_divide_by_zero():
+    position = main.apply_trade_to_position(empty_position(), -2.0, 10.0, None)
+    position = main.apply_trade_to_position(position, 2.0, 12.0, None)
+
+    assert position["quantity"] == 0
+    assert position["avg_cost"] == 0
+    assert position["realized_pnl"] == pytest.approx(20.0)
+
+
+def test_rebuild_reproduces_live_positions(app_db):
+    app_db.session.add(main.User(id=1, username="u", email="u@example.com", password_hash="x"))
+    app_db.session.commit()
+    start = datetime(2024, 1, 1)
+    for symbol in ("BTC", "ETH"):
+        replay_sql(app_db, 1, symbol, TRADES, start)
+        for i, (amount, price) in enumerate(TRADES):
+            app_db.session.add(main.Transaction(
+                user_id=1, symbol=symbol, amount=amount, price=price,
+                total_value=amount * price, timestamp=start + timedelta(minutes=i)
+            ))
+    app_db.session.commit()
+    live = {row.symbol: (row.quantity, row.avg_cost, row.realized_pnl, row.last_trade_at)
+            for row in main.PortfolioPosition.query.all()}
+
+    assert main.rebuild_portfolio_positions(batch_size=3) == 2 * len(TRADES)
+    app_db.session.expire_all()
+    rebuilt = {row.symbol: (row.quantity, row.avg_cost, row.realized_pnl, row.last_trade_at)
+               for row in main.PortfolioPosition.query.all()}
+
+    assert rebuilt.keys() == live.keys()
+    for symbol in live:
+        assert rebuilt[symbol][:3] == pytest.approx(live[symbol][:3])
+        assert rebuilt[symbol][3] == live[symbol][3]
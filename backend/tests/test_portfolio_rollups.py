@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import pytest
+
+import main
+
+PRICES = {"BTC": 60000.0, "ETH": 3000.0, "LTC": 80.0, "SOL": 150.0}
+# 2026-01-01 12:34:16 UTC
+TIMESTAMP = 1767270856.0
+
+
+@pytest.fixture
+def users(app_db, monkeypatch):
+    monkeypatch.setattr(main, "portfolio_rollup_state", {"last_prune": TIMESTAMP, "prices": {}})
+    app_db.session.add_all([
+        main.User(id=1, username="holder", email="holder@example.com", password_hash="x", wallet_balance=100.0),
+        main.User(id=2, username="cash", email="cash@example.com", password_hash="x", wallet_balance=50.0),
+        main.Holding(user_id=1, symbol="BTC", quantity=0.5),
+        main.Holding(user_id=1, symbol="ETH", quantity=0.0),
+    ])
+    app_db.session.commit()
+    return app_db
+
+
+def bars(user_id):
+    return {
+        bar.resolution: bar
+        for bar in main.PortfolioValueBar.query.filter_by(user_id=user_id).all()
+    }
+
+
+def test_poller_rollup_values_only_holders_of_moved_assets(users):
+    main.update_portfolio_rollups(TIMESTAMP, prices=PRICES)
+
+    holder = bars(1)
+    assert set(holder) == {"1m", "1h", "1d"}
+    assert holder["1m"].bucket_start == datetime(2026, 1, 1, 12, 34)
+    assert holder["1h"].bucket_start == datetime(2026, 1, 1, 12, 0)
+    assert holder["1d"].bucket_start == datetime(2026, 1, 1)
+    assert holder["1m"].close == pytest.approx(30100.0)
+    # Cash-only users are not revalued by price moves
+    assert bars(2) == {}
+
+
+def test_poller_rollup_skips_unchanged_prices(users):
+    main.update_portfolio_rollups(TIMESTAMP, prices=PRICES)
+    users.session.add(main.Holding(user_id=2, symbol="SOL", quantity=1.0))
+    users.session.commit()
+
+    assert main.update_portfolio_rollups(TIMESTAMP + 5, prices=PRICES) == 0
+    assert bars(2) == {}
+    # SOL moved: user 2 now holds it, user 1 does not
+    main.update_portfolio_rollups(TIMESTAMP + 10, prices=dict(PRICES, SOL=160.0))
+    assert bars(2)["1m"].close == pytest.approx(210.0)
+    assert bars(1)["1m"].close == pytest.approx(30100.0)
+
+
+def test_rollup_tracks_high_low_and_close(users):
+    main.update_portfolio_rollups(TIMESTAMP, prices=PRICES)
+    main.update_portfolio_rollups(TIMESTAMP + 5, prices=dict(PRICES, BTC=62000.0))
+    main.update_portfolio_rollups(TIMESTAMP + 10, prices=dict(PRICES, BTC=59000.0))
+    users.session.expire_all()
+
+    bar = bars(1)["1m"]
+    assert (bar.open, bar.high, bar.low, bar.close) == pytest.approx((30100.0, 31100.0, 29600.0, 29600.0))
+
+
+def test_queued_balance_change_is_rolled_up_without_a_price_move(users):
+    main.update_portfolio_rollups(TIMESTAMP, prices=PRICES)
+    users.session.add(main.PortfolioRollupQueue(user_id=2))
+    users.session.commit()
+
+    main.update_portfolio_rollups(TIMESTAMP + 5, prices=PRICES)
+
+    assert bars(2)["1d"].close == pytest.approx(50.0)
+    assert main.PortfolioRollupQueue.query.count() == 0
+
+
+def test_missing_price_keeps_users_queued(users):
+    users.session.add(main.PortfolioRollupQueue(user_id=2))
+    users.session.commit()
+
+    assert main.update_portfolio_rollups(TIMESTAMP, prices=dict(PRICES, SOL=None)) == 0
+    assert main.PortfolioRollupQueue.query.count() == 1
+
+
+def test_unchanged_buckets_are_filled_from_the_previous_close():
+    rows = [
+        (datetime(2026, 1, 1, 12, 0), 10.0, 12.0, 9.0, 11.0),
+        (datetime(2026, 1, 1, 12, 3), 11.0, 15.0, 11.0, 14.0),
+    ]
+
+    filled = main.fill_portfolio_bars(rows, "minute", 10, end=datetime(2026, 1, 1, 12, 5))
+
+    assert [bar[0].minute for bar in filled] == [0, 1, 2, 3, 4]
+    assert filled[1] == (datetime(2026, 1, 1, 12, 1), 11.0, 11.0, 11.0, 11.0)
+    assert filled[3] == rows[1]
+    assert filled[4][1:] == (14.0, 14.0, 14.0, 14.0)
+    # The limit keeps the latest buckets and carries the close from before them
+    assert main.fill_portfolio_bars(rows, "minute", 2, end=datetime(2026, 1, 1, 12, 3))[0][1:] == (11.0,) * 4
+
+
+def test_backfill_replays_the_ledger_against_price_history(users, monkeypatch, tmp_path):
+    history = main.PriceHistoryStore(str(tmp_path))
+    history.append_many(
+        [("CoinGecko", symbol, TIMESTAMP, price, None) for symbol, price in PRICES.items()]
+        + [("CoinGecko", "BTC", TIMESTAMP + 120, 62000.0, None), ("CoinGecko", "BTC", TIMESTAMP + 3600, 61000.0, None)]
+    )
+    monkeypatch.setattr(main, "price_history", history)
+    monkeypatch.setattr(main.time, "time", lambda: TIMESTAMP + 7200)
+    # User 1 bought 0.25 BTC for 15000 after the second sample, ending at 0.5 BTC and 100 cash
+    users.session.add(main.Transaction(
+        user_id=1, symbol="BTC", amount=0.25, price=60000.0, total_value=15000.0,
+        timestamp=datetime.utcfromtimestamp(TIMESTAMP + 600)
+    ))
+    users.session.commit()
+
+    main.backfill_portfolio_rollups(user_ids=[1])
+
+    minute = {bar.bucket_start.strftime("%H:%M"): bar.close for bar in main.PortfolioValueBar.query.filter_by(
+        user_id=1, resolution="1m")}
+    assert minute == pytest.approx({"12:34": 15100.0 + 15000.0, "12:36": 15100.0 + 15500.0, "13:34": 30600.0})
+    [hour_12, hour_13] = main.PortfolioValueBar.query.filter_by(user_id=1, resolution="1h").order_by(
+        main.PortfolioValueBar.bucket_start).all()
+    assert (hour_12.open, hour_12.high, hour_12.close) == pytest.approx((30100.0, 30600.0, 30600.0))
+    assert hour_13.close == pytest.approx(30600.0)
+    assert main.PortfolioValueBar.query.filter_by(user_id=2).count() == 0
+
+
+def test_missing_price_skips_rollup(users):
+    assert main.update_portfolio_rollups(TIMESTAMP, prices=dict(PRICES, SOL=None)) == 0
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+
+import main
+
+
+def test_two_writers_keep_the_file_sorted(tmp_path):
+    first = main.PriceHistoryStore(str(tmp_path))
+    second = main.PriceHistoryStore(str(tmp_path))
+
+    assert first.append_many([("Binance", "BTC", 10.0, 100.0, None)]) == 1
+    assert second.append_many([("Binance", "BTC", 20.0, 101.0, None)]) == 1
+    # first has not seen 20.0 but re-reads the file before appending
+    assert first.append_many([("Binance", "BTC", 15.0, 99.0, None), ("Binance", "BTC", 30.0, 102.0, 5.0)]) == 1
+
+    records = first.records("Binance", "BTC")
+    assert list(records["timestamp"]) == [10.0, 20.0, 30.0]
+    assert records["volume"][-1] == 5.0
+
+
+def test_backwards_and_duplicate_timestamps_are_rejected(tmp_path):
+    store = main.PriceHistoryStore(str(tmp_path))
+    store.append_many([("Kraken", "ETH", 50.0, 3000.0, None)])
+
+    written = store.append_many([
+        ("Kraken", "ETH", 40.0, 2990.0, None),
+        ("Kraken", "ETH", 50.0, 3001.0, None),
+        ("Kraken", "ETH", 60.0, 3002.0, None),
+        ("Kraken", "ETH", 60.0, 3003.0, None),
+    ])
+
+    assert written == 1
+    records = store.records("Kraken", "ETH")
+    assert list(records["timestamp"]) == [50.0, 60.0]
+    assert records["price"][-1] == 3002.0
+
+
+def test_torn_trailing_record_is_truncated(tmp_path):
+    store = main.PriceHistoryStore(str(tmp_path))
+    store.append_many([("Binance", "SOL", 1.0, 150.0, None)])
+    with open(store.path("Binance", "SOL"), "ab") as f:
+        f.write(b"\x00" * 5)
+
+    assert store.append_many([("Binance", "SOL", 2.0, 151.0, None)]) == 1
+    assert os.path.getsize(store.path("Binance", "SOL")) == 2 * main.HISTORY_RECORD_DTYPE.itemsize
+    assert np.array_equal(store.records("Binance", "SOL")["price"], [150.0, 151.0])
+
+
+def test_merge_adds_only_rows_outside_the_recorded_span(tmp_path):
+    store = main.PriceHistoryStore(str(tmp_path))
+    store.append_many([("CoinGecko", "BTC", 100.0, 1.0, None), ("CoinGecko", "BTC", 200.0, 2.0, None)])
+
+    added = store.merge("CoinGecko", "BTC", [(50.0, 0.5, 9.0), (150.0, 1.5, None), (250.0, 2.5, None)])
+
+    assert added == 2
+    records = store.records("CoinGecko", "BTC")
+    assert list(records["timestamp"]) == [50.0, 100.0, 200.0, 250.0]
+    assert records["volume"][0] == 9.0
+    # Appends keep working on the replaced file
+    assert store.append_many([("CoinGecko", "BTC", 300.0, 3.0, None)]) == 1
+    assert store.records("CoinGecko", "BTC")["timestamp"][-1] == 300.0
+
+
+def test_backfill_fetches_only_uncovered_assets(monkeypatch, tmp_path):
+    now = 10 * 86400.0
+    store = main.PriceHistoryStore(str(tmp_path))
+    # BTC already covers the last two days
+    store.append_many([("CoinGecko", "BTC", now - 2 * 86400, 1.0, None), ("CoinGecko", "BTC", now - 60, 2.0, None)])
+    fetched = []
+
+    def fake_history(symbol, start, end):
+        fetched.append(symbol)
+        return [(start + hour * 3600, 10.0 + hour, None) for hour in range(int((end - start) // 3600) + 1)]
+
+    monkeypatch.setattr(main, "price_history", store)
+    monkeypatch.setattr(main, "fetch_coingecko_history", fake_history)
+
+    main.backfill_price_history(days=2, now=now)
+
+    assert sorted(fetched) == sorted(set(main.COINGECKO_IDS) - {"BTC"})
+    eth = store.records("CoinGecko", "ETH")
+    assert len(eth) == 49 and eth["timestamp"][0] == now - 2 * 86400
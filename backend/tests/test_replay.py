@@ -0,0 +1,26 @@
+import main
+
+
+def test_replay_serves_recordings_in_order_without_cache(monkeypatch, tmp_path):
+    cassette = main.Cassette(str(tmp_path))
+    adapter = main.EXCHANGE_ADAPTERS["Binance"]
+    request_parts = [adapter.base_url + "/api/v3/ticker/price", {"symbol": "BTCUSDT"}]
+    cassette.record("Binance", request_parts, {"price": "100.0"})
+    cassette.record("Binance", request_parts, {"price": "101.0"})
+
+    monkeypatch.setattr(main, "cassette", cassette)
+    monkeypatch.setattr(main, "UPSTREAM_MODE", "replay")
+    monkeypatch.setattr(main, "REPLAY_LATENCY", 0)
+    main.quote_cache.set("Binance", "BTC", 999.0)
+
+    # The cached 999.0 is ignored and each lookup advances the cassette
+    assert main.fetch_exchange_price("Binance", "BTC") == 100.0
+    assert main.fetch_exchange_price("Binance", "BTC") == 101.0
+    assert main.fetch_exchange_price("Binance", "BTC") == 100.0
+
+
+def test_replay_does_not_start_poller(monkeypatch):
+    monkeypatch.setattr(main, "UPSTREAM_MODE", "replay")
+
+    assert main.start_price_poller() is None
+    assert main.price_poller_thread is None
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import main
+
+
+def publish_when_subscribed(events):
+    deadline = time.monotonic() + 2
+    while not main.event_hub.subscriber_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for event, data in events:
+        main.event_hub.publish(event, data)
+
+
+def test_symbol_filter_keeps_cycle_events(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_MAX_SECONDS", 0.5)
+    monkeypatch.setattr(main, "STREAM_HEARTBEAT", 0.05)
+    publisher = threading.Thread(target=publish_when_subscribed, args=([
+        ("tick", {"symbol": "ETH", "prices": {"Binance": 3000.0}}),
+        ("tick", {"symbol": "BTC", "prices": {"Binance": 64000.0}}),
+        ("cycle", {"path": ["USD", "BTC", "ETH", "USD"], "profit_pct": 0.4}),
+    ],))
+    publisher.start()
+
+    body = main.app.test_client().get("/stream?symbols=BTC").get_data(as_text=True)
+    publisher.join()
+
+    assert '"symbol": "BTC"' in body
+    assert '"symbol": "ETH"' not in body
+    assert "event: cycle" in body
+
+
+def test_stream_rejects_clients_over_the_cap(monkeypatch):
+    monkeypatch.setattr(main, "STREAM_MAX_CLIENTS", 0)
+
+    response = main.app.test_client().get("/stream")
+
+    assert response.status_code == 503
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import main
+
+
+def add_user(db, user_id, balance=0.0):
+    user = main.User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com", wallet_balance=balance)
+    user.set_password("secret")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_keyset_pages_cover_history_once(app_db, auth_header):
+    add_user(app_db, 1)
+    add_user(app_db, 2)
+    start = datetime(2024, 1, 1)
+    # Pairs of rows share a timestamp so the id tie-breaker is exercised
+    for i in range(25):
+        app_db.session.add(main.Transaction(
+            user_id=1, symbol="BTC" if i % 2 else "ETH", amount=1.0, price=100.0 + i,
+            total_value=100.0 + i, timestamp=start + timedelta(minutes=i // 2)
+        ))
+    app_db.session.add(main.Transaction(user_id=2, symbol="BTC", amount=1.0, price=1.0, total_value=1.0, timestamp=start))
+    app_db.session.commit()
+
+    client = main.app.test_client()
+    seen, cursor = [], None
+    while True:
+        query = {"limit": 10, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/transactions", query_string=query, headers=auth_header(1)).get_json()
+        seen += page["transactions"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    ids = [tx["id"] for tx in seen]
+    assert len(ids) == 25 == len(set(ids))
+    keys = [(tx["timestamp"], tx["id"]) for tx in seen]
+    assert keys == sorted(keys, reverse=True)
+
+
+def test_symbol_and_date_filters(app_db, auth_header):
+    add_user(app_db, 1)
+    for day, symbol in enumerate(["BTC", "ETH", "BTC", "BTC"]):
+        app_db.session.add(main.Transaction(
+            user_id=1, symbol=symbol, amount=1.0, price=1.0, total_value=1.0, timestamp=datetime(2024, 1, 1 + day)
+        ))
+    app_db.session.commit()
+
+    page = main.app.test_client().get(
+        "/transactions",
+        query_string={"symbol": "btc", "start": "2024-01-02", "end": "2024-01-04"},
+        headers=auth_header(1)
+    ).get_json()
+
+    assert [tx["timestamp"] for tx in page["transactions"]] == ["2024-01-03 00:00:00"]
+    assert page["next_cursor"] is None
+
+
+def test_invalid_cursor_is_rejected(app_db, auth_header):
+    add_user(app_db, 1)
+
+    response = main.app.test_client().get("/transactions?cursor=bogus", headers=auth_header(1))
+
+    assert response.status_code == 400
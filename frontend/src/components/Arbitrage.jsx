@@ -1,8 +1,9 @@
-import React, { useState } from "react";
+import React, { useState, useEffect } from "react";
 import axios from "axios";
 import styled from 'styled-components';
 import { motion } from 'framer-motion';
 import TradeForm from "./TradeForm";
+import { subscribePriceStream } from "../services/Api";
 import './Arbitrage.css';
 
 const ArbitrageContainer = styled.div`
@@ -119,6 +120,13 @@ const ErrorMessage = styled.p`
   margin-top: 1rem;
 `;
 
+const LiveFeed = styled.div`
+  margin-top: 1rem;
+  font-size: 0.85rem;
+  color: var(--light);
+  opacity: 0.85;
+`;
+
 const ToggleWrapper = styled.div`
   display: flex;
   align-items: center;
@@ -163,6 +171,22 @@ const Arbitrage = ({ setArbitrageOpportunity, setAIResponse, setArbitrageAnalysi
   const [walletBalance, setWalletBalance] = useState(1000);
   const [btcBalance, setBtcBalance] = useState(0);
 
+  // Live prices and opportunities for the last scanned coin, pushed over /stream
+  const [liveSymbol, setLiveSymbol] = useState(null);
+  const [livePrices, setLivePrices] = useState(null);
+  const [liveOpportunity, setLiveOpportunity] = useState(null);
+
+  useEffect(() => {
+    if (!liveSymbol) return undefined;
+    setLivePrices(null);
+    setLiveOpportunity(null);
+    const source = subscribePriceStream([liveSymbol], {
+      onTick: (tick) => setLivePrices((prev) => ({ ...prev, ...tick.prices })),
+      onOpportunity: setLiveOpportunity
+    });
+    return () => source.close();
+  }, [liveSymbol]);
+
   const checkArbitrage = async () => {
     if (!crypto.trim()) {
       setError("Please enter a cryptocurrency symbol");
@@ -174,6 +198,7 @@ const Arbitrage = ({ setArbitrageOpportunity, setAIResponse, setArbitrageAnalysi
     setArbitrageAnalysis(null);
     setError(null);
     setLoading(true);
+    setLiveSymbol(crypto.trim());
 
     try {
       const response = await axios.get(
@@ -332,6 +357,20 @@ const Arbitrage = ({ setArbitrageOpportunity, setAIResponse, setArbitrageAnalysi
           setBtcBalance={setBtcBalance}
         />
       )}
+
+      {livePrices && (
+        <LiveFeed>
+          <strong>LIVE</strong>{" "}
+          {Object.entries(livePrices)
+            .map(([exchange, price]) => `${exchange}: $${Number(price).toLocaleString()}`)
+            .join(" · ")}
+          {liveOpportunity && (
+            <div>
+              Latest opportunity: buy on {liveOpportunity.buy_from}, sell on {liveOpportunity.sell_to}
+            </div>
+          )}
+        </LiveFeed>
+      )}
     </ArbitrageContainer>
   );
 };
@@ -98,9 +98,11 @@ const MarketTrends = () => {
         );
         const pricesData = await pricesResponse.json();
 
-        // Fetch historical data for chart (simplified example)
+        // Fetch downsampled chart history from the backend price store
+        const days = timeRange === '24h' ? 1 : timeRange === '7d' ? 7 : 30;
+        const end = Date.now() / 1000;
         const historyResponse = await fetch(
-          `https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=${timeRange === '24h' ? 1 : timeRange === '7d' ? 7 : 30}`
+          `http://127.0.0.1:5000/history?exchange=CoinGecko&symbol=BTC&start=${end - days * 86400}&end=${end}&points=300`
         );
         const historyData = await historyResponse.json();
 
@@ -127,8 +129,8 @@ const MarketTrends = () => {
         );
 
         // Process chart data
-        const chartLabels = historyData.prices.map((price, index) => {
-          const date = new Date(price[0]);
+        const chartLabels = historyData.points.map(point => {
+          const date = new Date(point.timestamp * 1000);
           return timeRange === '24h' 
             ? date.toLocaleTimeString() 
             : date.toLocaleDateString();
@@ -139,7 +141,7 @@ const MarketTrends = () => {
           datasets: [
             {
               label: 'BTC Price',
-              data: historyData.prices.map(price => price[1]),
+              data: historyData.points.map(point => point.price),
               borderColor: '#00f0ff',
               backgroundColor: 'rgba(0, 240, 255, 0.1)',
               tension: 0.4,
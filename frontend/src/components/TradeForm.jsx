@@ -200,15 +200,18 @@ const TradeForm = ({
         buy_from: arbitrage_opportunity.buy_on,
         sell_to: arbitrage_opportunity.sell_on,
         tradeAmount: usd,
+        crypto: arbitrageOpportunity.crypto_symbol || "BTC",
         tradeBTC,
         potentialProfit
       };
 
-      const response = await axios.post("http://127.0.0.1:5000/execute_trade", tradeDetails);
+      const response = await axios.post("http://127.0.0.1:5000/execute_trade", tradeDetails, {
+        headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
+      });
 
       if (response.data.status === "success") {
         setWalletBalance(response.data.new_balance);
-        setBtcBalance(response.data.btc_balance);
+        setBtcBalance(response.data.crypto_balance);
         setStatus({ message: `Trade successful! Profit: $${response.data.profit.toFixed(2)}`, type: "success" });
       } else {
         setWalletBalance(response.data.new_balance);
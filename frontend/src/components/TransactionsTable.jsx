@@ -71,55 +71,60 @@ const StyledTable = styled.table`
 const TransactionsTable = () => {
   const [transactions, setTransactions] = useState([]);
   const [filteredSymbol, setFilteredSymbol] = useState("ALL");
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loading, setLoading] = useState(false);
+
+  // Load one keyset page; a null cursor starts again from the newest transaction
+  const loadPage = async (cursor, symbol) => {
+    const token = localStorage.getItem('token');
+    if (!token) {
+      toast.error("You are not logged in.");
+      return;
+    }
+
+    setLoading(true);
+    try {
+      const res = await axios.get('http://127.0.0.1:5000/transactions', {
+        headers: { Authorization: `Bearer ${token}` },
+        params: {
+          limit: 100,
+          ...(cursor && { cursor }),
+          ...(symbol !== "ALL" && { symbol })
+        },
+        withCredentials: true
+      });
+      setTransactions(prev => (cursor ? [...prev, ...res.data.transactions] : res.data.transactions));
+      setNextCursor(res.data.next_cursor);
+    } catch (err) {
+      console.error("Failed to load transactions:", err);
+      toast.error("Could not load transaction history.");
+    } finally {
+      setLoading(false);
+    }
+  };
 
   useEffect(() => {
-    const fetchTransactions = async () => {
-      const token = localStorage.getItem('token');
-      if (!token) {
-        toast.error("You are not logged in.");
-        return;
-      }
-
-      try {
-        const res = await axios.get('http://127.0.0.1:5000/transactions', {
-          headers: { Authorization: `Bearer ${token}` },
-          withCredentials: true
-        });
-
-        const sorted = res.data.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
-        setTransactions(sorted);
-      } catch (err) {
-        console.error("Failed to load transactions:", err);
-        toast.error("Could not load transaction history.");
-      }
-    };
-
-    fetchTransactions();
-  }, []);
-
-  const filtered = filteredSymbol === "ALL"
-    ? transactions
-    : transactions.filter(tx => tx.symbol === filteredSymbol);
-
-  const exportToCSV = () => {
-    const csv = [
-      ["Symbol", "Amount", "Price", "Total", "Timestamp"],
-      ...filtered.map(tx => [
-        tx.symbol,
-        tx.amount,
-        tx.price,
-        tx.total_value,
-        tx.timestamp
-      ])
-    ];
-
-    const blob = new Blob([csv.map(row => row.join(",")).join("\n")], { type: 'text/csv' });
-    const link = document.createElement("a");
-    link.href = URL.createObjectURL(blob);
-    link.download = "transactions.csv";
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
+    loadPage(null, filteredSymbol);
+  }, [filteredSymbol]);
+
+  // Export the full ledger from the server rather than just the loaded pages
+  const exportToCSV = async () => {
+    try {
+      const res = await axios.get('http://127.0.0.1:5000/transactions/export', {
+        headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+        params: { format: "csv" },
+        responseType: 'blob'
+      });
+      const link = document.createElement("a");
+      link.href = URL.createObjectURL(res.data);
+      link.download = "transactions.csv";
+      document.body.appendChild(link);
+      link.click();
+      document.body.removeChild(link);
+    } catch (err) {
+      console.error("Failed to export transactions:", err);
+      toast.error("Could not export transactions.");
+    }
   };
 
   return (
@@ -146,15 +151,15 @@ const TransactionsTable = () => {
           </tr>
         </thead>
         <tbody>
-          {filtered.length === 0 ? (
+          {transactions.length === 0 ? (
             <tr>
               <td colSpan="5" style={{ color: '#888', textAlign: 'center', padding: '1rem' }}>
                 No matching transactions found.
               </td>
             </tr>
           ) : (
-            filtered.map((tx, i) => (
-              <tr key={i}>
+            transactions.map(tx => (
+              <tr key={tx.id}>
                 <td>{tx.symbol}</td>
                 <td>{parseFloat(tx.amount).toFixed(6)}</td>
                 <td>${parseFloat(tx.price).toLocaleString()}</td>
@@ -165,6 +170,12 @@ const TransactionsTable = () => {
           )}
         </tbody>
       </StyledTable>
+
+      {nextCursor && (
+        <ExportBtn onClick={() => loadPage(nextCursor, filteredSymbol)} disabled={loading}>
+          {loading ? "Loading..." : "Load more"}
+        </ExportBtn>
+      )}
     </TableWrapper>
   );
 };
@@ -8,6 +8,18 @@ import BuyCryptoModal from './BuyCryptoModal';
 import TransactionsTable from './TransactionsTable';
 import axios from 'axios';
 import { toast } from 'react-toastify';
+import { Line } from 'react-chartjs-2';
+import {
+  Chart as ChartJS,
+  CategoryScale,
+  LinearScale,
+  PointElement,
+  LineElement,
+  Tooltip
+} from 'chart.js';
+import { fetchPortfolioHistory } from '../services/Api';
+
+ChartJS.register(CategoryScale, LinearScale, PointElement, LineElement, Tooltip);
 
 const DashboardWrapper = styled.div`
   background: rgba(10, 10, 20, 0.8);
@@ -67,6 +79,21 @@ const ActionButton = styled.button`
   }
 `;
 
+const HistoryPanel = styled.div`
+  margin-bottom: 2rem;
+
+  h4 {
+    font-size: 0.9rem;
+    color: #aaa;
+    margin-bottom: 0.5rem;
+  }
+`;
+
+const HistoryChart = styled.div`
+  height: 220px;
+  margin-top: 0.5rem;
+`;
+
 const CoinGrid = styled.div`
   display: flex;
   gap: 1rem;
@@ -121,29 +148,34 @@ const WalletDashboard = ({
   const [showTransactions, setShowTransactions] = useState(false);
   const [coinPrices, setCoinPrices] = useState({});
   const [coinChanges, setCoinChanges] = useState({});
+  const [historyResolution, setHistoryResolution] = useState('1h');
+  const [portfolioBars, setPortfolioBars] = useState([]);
 
   useEffect(() => {
     fetchPrices();
   }, []);
 
+  // Reload the value history when the resolution changes or a deposit/trade moves the balance
+  useEffect(() => {
+    fetchPortfolioHistory(historyResolution, 200)
+      .then(setPortfolioBars)
+      .catch(() => setPortfolioBars([]));
+  }, [historyResolution, walletBalance]);
+
   const fetchPrices = async () => {
     try {
-      const res = await axios.get('https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,ethereum,litecoin,solana&vs_currencies=usd&include_24hr_change=true');
+      const res = await axios.get('http://127.0.0.1:5000/wallet', {
+        headers: { Authorization: `Bearer ${localStorage.getItem('token')}` }
+      });
       const data = res.data;
 
-      setCoinPrices({
-        BTC: data.bitcoin.usd,
-        ETH: data.ethereum.usd,
-        LTC: data.litecoin.usd,
-        SOL: data.solana.usd
-      });
+      setCoinPrices(data.prices || {});
 
-      setCoinChanges({
-        BTC: parseFloat(data.bitcoin.usd_24h_change).toFixed(2),
-        ETH: parseFloat(data.ethereum.usd_24h_change).toFixed(2),
-        LTC: parseFloat(data.litecoin.usd_24h_change).toFixed(2),
-        SOL: parseFloat(data.solana.usd_24h_change).toFixed(2)
+      const changes = {};
+      Object.entries(data.changes || {}).forEach(([symbol, change]) => {
+        changes[symbol] = change != null ? parseFloat(change).toFixed(2) : '0.00';
       });
+      setCoinChanges(changes);
     } catch (err) {
       console.error("Failed to fetch live prices", err);
     }
@@ -213,6 +245,31 @@ const WalletDashboard = ({
 
   const total = walletBalance + holdingsValue;
 
+  const historyData = {
+    labels: portfolioBars.map(bar => bar.time),
+    datasets: [
+      {
+        label: 'Portfolio Value',
+        data: portfolioBars.map(bar => bar.close),
+        borderColor: '#00f0ff',
+        backgroundColor: 'rgba(0, 240, 255, 0.1)',
+        tension: 0.3,
+        borderWidth: 2,
+        pointRadius: 0
+      }
+    ]
+  };
+
+  const historyOptions = {
+    responsive: true,
+    maintainAspectRatio: false,
+    plugins: { legend: { display: false } },
+    scales: {
+      x: { grid: { color: 'rgba(224, 224, 255, 0.1)' }, ticks: { color: '#e0e0ff', maxTicksLimit: 6 } },
+      y: { grid: { color: 'rgba(224, 224, 255, 0.1)' }, ticks: { color: '#e0e0ff' } }
+    }
+  };
+
   return (
     <DashboardWrapper>
       <BalanceSummary>
@@ -238,6 +295,28 @@ const WalletDashboard = ({
         </BalanceItem>
       </BalanceSummary>
 
+      <HistoryPanel>
+        <h4>Portfolio Value History</h4>
+        <ActionButtons>
+          {['1m', '1h', '1d'].map((resolution) => (
+            <ActionButton
+              key={resolution}
+              onClick={() => setHistoryResolution(resolution)}
+              style={resolution === historyResolution ? { background: 'var(--primary)', color: 'var(--dark)' } : undefined}
+            >
+              {resolution}
+            </ActionButton>
+          ))}
+        </ActionButtons>
+        {portfolioBars.length > 0 ? (
+          <HistoryChart>
+            <Line data={historyData} options={historyOptions} />
+          </HistoryChart>
+        ) : (
+          <p>No portfolio history yet.</p>
+        )}
+      </HistoryPanel>
+
       <CoinGrid>
         {["BTC", "ETH", "LTC", "SOL"].map((symbol) => {
           const amount = parseFloat(walletAssets?.[symbol]) || 0;
@@ -40,4 +40,35 @@ export const getTradeFeedback = async () => {
     console.error("Error fetching feedback:", error);
     throw error;
   }
-};
\ No newline at end of file
+};
+
+// Subscribe to live price ticks and arbitrage opportunities pushed by the backend.
+// Returns the EventSource; call .close() on it to unsubscribe.
+export const subscribePriceStream = (symbols, { onTick, onOpportunity } = {}) => {
+  const query = symbols && symbols.length ? `?symbols=${symbols.join(",")}` : "";
+  const source = new EventSource(`${API_BASE_URL}/stream${query}`);
+
+  if (onTick) {
+    source.addEventListener("tick", (event) => onTick(JSON.parse(event.data)));
+  }
+  if (onOpportunity) {
+    source.addEventListener("opportunity", (event) => onOpportunity(JSON.parse(event.data)));
+  }
+  source.onerror = (error) => console.error("Price stream error:", error);
+
+  return source;
+};
+
+// Portfolio value OHLC bars (resolution: "1m", "1h" or "1d") from the backend rollups.
+export const fetchPortfolioHistory = async (resolution = "1h", limit = 500) => {
+  try {
+    const response = await axios.get(`${API_BASE_URL}/portfolio/history`, {
+      params: { resolution, limit },
+      headers: { Authorization: `Bearer ${localStorage.getItem("token")}` }
+    });
+    return response.data.bars;
+  } catch (error) {
+    console.error("Error fetching portfolio history:", error);
+    throw error;
+  }
+};